@@ -52,6 +52,80 @@ class VectorTests(unittest.TestCase):
             M, error = trimesh.geometry.absolute_orientation(points_A, points_B, return_error=True)
             self.assertTrue(np.all(error < TOL_ZERO))
 
+class GroupingTests(unittest.TestCase):
+    def test_unique_rows(self):
+        # packed integer keys, and hashed keys when the range is too wide
+        for data in [np.random.randint(0, 10, (1000,3)),
+                     np.random.random((1000,3)).round(2)]:
+            data = np.vstack((data, data[::-1]))
+            unique, inverse, counts = trimesh.grouping.unique_rows(data,
+                                                                   return_inverse = True,
+                                                                   return_counts  = True)
+            self.assertTrue((data[unique][inverse] == data).all())
+            self.assertTrue(counts.sum() == len(data))
+            self.assertTrue(len(unique) == len(set(map(tuple, data.tolist()))))
+            # the first occurrence of every row is returned
+            self.assertTrue((unique < len(data) / 2).all())
+
+            pairs = trimesh.grouping.group_rows(data, require_count=2)
+            self.assertTrue((data[pairs[:,0]] == data[pairs[:,1]]).all())
+
+    def test_flat_groups(self):
+        values         = np.random.randint(0, 100, 1000)
+        order, offsets = trimesh.grouping.value_order(values, min_length=5, max_length=15)
+        lengths        = np.diff(offsets)
+        self.assertTrue(((lengths >= 5) & (lengths <= 15)).all())
+        self.assertTrue(len(order) == offsets[-1])
+
+        for i, group in enumerate(trimesh.grouping.group_split(order, offsets)):
+            self.assertTrue((values[group] == values[group[0]]).all())
+            self.assertTrue(trimesh.grouping.group_labels(offsets)[offsets[i]] == i)
+        sums = trimesh.grouping.group_sum(values[order], offsets)
+        self.assertTrue((sums == values[order[offsets[:-1]]] * lengths).all())
+        means = trimesh.grouping.group_mean(values[order], offsets)
+        self.assertTrue(np.allclose(means, values[order[offsets[:-1]]]))
+        odd = trimesh.grouping.group_any(values[order] % 2 == 1, offsets)
+        self.assertTrue((odd == (values[order[offsets[:-1]]] % 2 == 1)).all())
+
+    def test_weld(self):
+        # vertices moved less than the tolerance should be merged
+        vertices = np.random.random((1000,3))
+        jittered = np.vstack((vertices, vertices + TOL_ZERO))
+        unique, inverse = trimesh.grouping.weld_vertices(jittered, tolerance=1e-8)
+        self.assertTrue(len(unique) == len(vertices))
+        self.assertTrue((inverse[:1000] == inverse[1000:]).all())
+        self.assertTrue((jittered[unique][inverse] - jittered).ptp() < 1e-8)
+
+        location = os.path.abspath(os.path.join(TEST_DIR, 'unit_cube.STL'))
+        mesh     = trimesh.load_mesh(location, process=False)
+        mesh.set_face_colors()
+        mesh.generate_vertex_colors()
+        mesh.generate_vertex_normals()
+        merged   = len(trimesh.grouping.unique_rows(mesh.vertices))
+        # the faces of a cube meet at right angles, so within a small
+        # angle only vertices on the same side of the cube are merged
+        mesh.merge_vertices(angle_max=np.radians(10))
+        self.assertTrue(merged < len(mesh.vertices) < 36)
+        self.assertTrue(mesh.vertex_colors_ok())
+        self.assertTrue(np.shape(mesh.vertex_normals) == np.shape(mesh.vertices))
+        normals = mesh.vertex_normals[mesh.faces]
+        self.assertTrue(np.allclose(normals, mesh.face_normals.reshape((-1,1,3))))
+
+        # a 90 degree bend subdivided finely enough that every vertex is
+        # within tolerance and a small angle of its neighbors
+        angles   = np.radians(np.linspace(0, 90, 200))
+        normals  = np.column_stack((np.cos(angles), np.sin(angles), np.zeros(len(angles))))
+        vertices = normals * 1e-9
+        max_angle = np.radians(10)
+        unique, inverse = trimesh.grouping.weld_vertices(vertices,
+                                                         tolerance = 1e-8,
+                                                         normals   = normals,
+                                                         max_angle = max_angle)
+        self.assertTrue(inverse[0] != inverse[-1])
+        # every vertex is within max_angle of the vertex it was merged into
+        self.assertTrue((np.abs(angles - angles[unique][inverse]) < max_angle).all())
+        self.assertTrue(len(unique) < 20)
+
 class MeshTests(unittest.TestCase):
     def setUp(self):
         meshes = deque()
@@ -132,6 +206,647 @@ class MeshTests(unittest.TestCase):
             mesh.fix_normals()
 
 
+class LoadTests(unittest.TestCase):
+    def test_stl_binary(self):
+        from io import BytesIO
+        location = os.path.abspath(os.path.join(TEST_DIR, 'featuretype.STL'))
+        mapped   = trimesh.load_mesh(location, process=False)
+        with open(location, 'rb') as file_obj:
+            data = file_obj.read()
+        streamed = trimesh.load_mesh(BytesIO(data), file_type='stl', process=False)
+        self.assertTrue(np.all(mapped.vertices == streamed.vertices))
+        self.assertTrue(np.all(mapped.face_normals == streamed.face_normals))
+
+        single = trimesh.load_mesh(BytesIO(data),
+                                   file_type = 'stl',
+                                   process   = False,
+                                   dtype     = np.float32)
+        self.assertTrue(single.vertices.dtype == np.float32)
+        self.assertTrue(np.all(single.vertices == mapped.vertices))
+
+        # a stream which can't seek should be read into memory
+        class Unseekable(object):
+            def __init__(self, data): self.stream = BytesIO(data)
+            def read(self, *args):    return self.stream.read(*args)
+            def close(self):          pass
+        unseekable = trimesh.load_mesh(Unseekable(data), file_type='stl', process=False)
+        self.assertTrue(np.all(unseekable.vertices == mapped.vertices))
+
+        # a header that disagrees with the length should raise
+        self.assertRaises(NameError,
+                          trimesh.load_mesh,
+                          BytesIO(data[:-10]),
+                          file_type='stl')
+
+    def test_stl_ascii(self):
+        from io import BytesIO
+        import trimesh.io.stl
+        location = os.path.abspath(os.path.join(TEST_DIR, 'ADIS16480.STL'))
+        with open(location, 'rb') as file_obj:
+            data = file_obj.read()
+        mesh = trimesh.load_mesh(BytesIO(data), file_type='stl', process=False)
+        self.assertTrue(mesh.metadata['name'] == 'ci - ADIS16480-1')
+
+        # facets split across chunks should parse identically
+        chunk = trimesh.io.stl.STL_ASCII_CHUNK
+        try:
+            trimesh.io.stl.STL_ASCII_CHUNK = 1000
+            chunked = trimesh.load_mesh(BytesIO(data), file_type='stl', process=False)
+        finally:
+            trimesh.io.stl.STL_ASCII_CHUNK = chunk
+        self.assertTrue(np.all(chunked.vertices == mesh.vertices))
+
+        # two solids, one in upper case with no endsolid
+        solids = (data.replace(b'endsolid', b'').upper() +
+                  data.replace(b'solid ci', b'solid other'))
+        meshes = trimesh.load_mesh(BytesIO(solids), file_type='stl', process=False)
+        self.assertTrue(len(meshes) == 2)
+        self.assertTrue(meshes[1].metadata['name'] == 'other - ADIS16480-1')
+        for loaded in meshes:
+            self.assertTrue(np.allclose(loaded.vertices, mesh.vertices))
+
+    def test_obj(self):
+        from io import BytesIO
+        location = os.path.abspath(os.path.join(TEST_DIR, 'tube.obj'))
+        mesh     = trimesh.load_mesh(location, process=False)
+        self.assertTrue(mesh.metadata['uv'].shape == (len(mesh.vertices), 2))
+        self.assertTrue(mesh.vertex_normals.shape == mesh.vertices.shape)
+
+        # processing merges vertices, and the texture coordinates must
+        # follow them, with a seam kept as separate vertices
+        text = (b'v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n' +
+                b'vt 0 0\nvt 1 0\nvt 1 1\nvt 0 1\nvt .5 .5\n' +
+                b'f 1/1 2/2 3/3\nf 1/5 3/3 4/4\nf 1/1 2/2 4/4\n')
+        raw       = trimesh.load_mesh(BytesIO(text), file_type='obj', process=False)
+        processed = trimesh.load_mesh(BytesIO(text), file_type='obj', process=True)
+        self.assertTrue(len(processed.metadata['uv']) == len(processed.vertices))
+        self.assertTrue(len(processed.vertices) == 5)
+        corners = lambda m: sorted(np.column_stack((m.vertices[m.faces.reshape(-1)],
+                                                    m.metadata['uv'][m.faces.reshape(-1)])).tolist())
+        self.assertTrue(corners(raw) == corners(processed))
+        processed.unmerge_vertices()
+        self.assertTrue(corners(raw) == corners(processed))
+        mesh = trimesh.load_mesh(location, process=True)
+        self.assertTrue(len(mesh.metadata['uv']) == len(mesh.vertices))
+
+        # a quad with relative indices and no texture coordinates,
+        # and a pentagon referencing vertices by absolute index
+        text = (b'v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nvn 0 0 1\n' +
+                b'f -4//-1 -3//-1 -2//-1 -1//-1\n')
+        quad = trimesh.load_mesh(BytesIO(text), file_type='obj', process=False)
+        self.assertTrue(np.all(quad.faces == [[0,1,2],[0,2,3]]))
+        self.assertTrue(np.allclose(quad.vertex_normals, [0,0,1]))
+
+        text = b'v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nv 0 0 1\nf 1 2 3 4 5\n'
+        fan  = trimesh.load_mesh(BytesIO(text), file_type='obj', process=False)
+        self.assertTrue(np.all(fan.faces == [[0,1,2],[0,2,3],[0,3,4]]))
+
+        # one colored vertex among plain ones, where the total number 
+        # of values divides evenly by the number of vertices
+        text  = b'v 0 0 0 1 1 1\nv 1 0 0\nv 1 1 0\nf 1 2 3\n'
+        mixed = trimesh.load_mesh(BytesIO(text), file_type='obj', process=False)
+        self.assertTrue(np.all(mixed.vertices == [[0,0,0],[1,0,0],[1,1,0]]))
+
+        # indented lines and trailing comments are allowed
+        text = (b'# a comment\n  v 0 0 0 # first\n\tv 1 0 0\nv 1 1 0#last\n' +
+                b'  f 1 2 3 # triangle\n')
+        commented = trimesh.load_mesh(BytesIO(text), file_type='obj', process=False)
+        self.assertTrue(np.all(commented.faces == [[0,1,2]]))
+        self.assertTrue(np.allclose(commented.vertices, [[0,0,0],[1,0,0],[1,1,0]]))
+
+    def test_native(self):
+        import tempfile, shutil
+        from io import BytesIO
+        location = os.path.abspath(os.path.join(TEST_DIR, 'tube.obj'))
+        mesh     = trimesh.load_mesh(location)
+        path     = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(path, 'tube.trimesh')
+            mesh.export(file_name, file_type='trimesh')
+
+            # exporters given a filename close the file they open
+            for file_type in ['trimesh', 'ply', 'glb']:
+                direct = os.path.join(path, 'direct.' + file_type)
+                trimesh.io.export._mesh_exporters[file_type](mesh, direct)
+                with open(direct, 'rb') as file_obj:
+                    self.assertTrue(file_obj.read() == mesh.export(file_type=file_type))
+            loaded = trimesh.load_mesh(file_name)
+            self.assertTrue(np.all(loaded.faces == mesh.faces))
+            self.assertTrue(np.all(loaded.vertices == mesh.vertices))
+            self.assertTrue(np.all(loaded.metadata['uv'] == mesh.metadata['uv']))
+            # processing was recorded, so it is skipped on load
+            self.assertTrue(loaded._cache.get('processed') == trimesh.base.PROCESS_STEPS)
+
+            # the arrays are mapped copy- on- write, so the file is unchanged
+            loaded.vertices[:,0] += 1.0
+            reloaded = trimesh.load_mesh(file_name)
+            self.assertTrue(np.all(reloaded.vertices == mesh.vertices))
+            self.assertTrue(reloaded._cache.get('processed') is not None)
+            self.assertTrue(loaded._cache.get('processed') is None)
+
+            # altering the array data in the file changes the hash, and
+            # the processing recorded in the header is no longer trusted
+            with open(file_name, 'r+b') as file_obj:
+                header = trimesh.io.binary.read_header(file_obj)[0]
+                file_obj.seek(header['arrays']['vertices']['offset'])
+                file_obj.write(b'\xff' * 8)
+            altered = trimesh.load_mesh(file_name, process=False)
+            self.assertTrue(altered.md5() != mesh.md5())
+            self.assertTrue(altered._cache.get('processed') is None)
+        finally:
+            shutil.rmtree(path)
+
+        streamed = trimesh.load_mesh(BytesIO(mesh.export(file_type='trimesh')),
+                                     file_type='trimesh')
+        self.assertTrue(np.all(streamed.faces == mesh.faces))
+
+    def test_ply(self):
+        from io import BytesIO
+        location = os.path.abspath(os.path.join(TEST_DIR, 'featuretype.STL'))
+        mesh     = trimesh.load_mesh(location)
+        mesh.vertex_colors = np.random.randint(0, 255, mesh.vertices.shape)
+        mesh.set_face_colors()
+        for encoding in ['binary', 'ascii']:
+            export = mesh.export(file_type='ply', encoding=encoding)
+            loaded = trimesh.load_mesh(BytesIO(export), file_type='ply', process=False)
+            self.assertTrue(np.all(loaded.vertices == mesh.vertices))
+            self.assertTrue(np.all(loaded.faces == mesh.faces))
+            self.assertTrue(np.all(loaded.vertex_colors == mesh.vertex_colors))
+            self.assertTrue(np.all(loaded.face_colors == mesh.face_colors))
+
+        # a quad and a triangle, which vary in length so are scanned
+        header  = '\n'.join(['ply',
+                              'format ascii 1.0',
+                              'element vertex 5',
+                              'property float x',
+                              'property float y',
+                              'property float z',
+                              'element face 2',
+                              'property list uchar int vertex_indices',
+                              'end_header\n'])
+        body    = '0 0 0\n1 0 0\n1 1 0\n0 1 0\n0 0 1\n4 0 1 2 3\n3 0 1 4\n'
+        polygon = trimesh.load_mesh(BytesIO((header + body).encode('ascii')),
+                                    file_type = 'ply',
+                                    process   = False)
+        self.assertTrue(polygon.faces.tolist() == [[0,1,2], [0,2,3], [0,1,4]])
+
+    def test_glb(self):
+        from io import BytesIO
+        location = os.path.abspath(os.path.join(TEST_DIR, 'featuretype.STL'))
+        mesh     = trimesh.load_mesh(location)
+        mesh.vertex_colors = np.random.randint(0, 255, mesh.vertices.shape)
+        export   = mesh.export(file_type='glb')
+        loaded   = trimesh.load_mesh(BytesIO(export), file_type='glb', process=False)
+        self.assertTrue(np.allclose(loaded.vertices, mesh.vertices))
+        self.assertTrue(np.all(loaded.faces == mesh.faces))
+        self.assertTrue(np.all(loaded.vertex_colors == mesh.vertex_colors))
+        self.assertTrue(np.allclose(loaded.vertex_normals, mesh.vertex_normals, atol=1e-6))
+        # few vertices, so faces are stored as uint16
+        self.assertTrue(len(export) < len(mesh.faces) * 6 + len(mesh.vertices) * 28 + 2048)
+
+    def test_text_export(self):
+        from io import BytesIO
+        location = os.path.abspath(os.path.join(TEST_DIR, 'featuretype.STL'))
+        mesh     = trimesh.load_mesh(location)
+        options  = np.get_printoptions()
+        for precision in [3, 14]:
+            export = mesh.export(file_type='off', precision=precision)
+            loaded = trimesh.load_mesh(BytesIO(export), file_type='off', process=False)
+            self.assertTrue(np.all(loaded.faces == mesh.faces))
+            self.assertTrue(np.allclose(loaded.vertices, mesh.vertices, atol=10.0**-precision))
+        collada = mesh.export(file_type='dae', precision=3)
+        self.assertTrue(('count="%d"' % (len(mesh.vertices) * 3)).encode('ascii') in collada)
+        self.assertTrue(np.get_printoptions() == options)
+
+        # a file opened from a filename is closed, so it is fully written
+        import tempfile, shutil
+        path = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(path, 'streamed.off')
+            trimesh.io.export.export_off(mesh, file_name, precision=3)
+            with open(file_name, 'rb') as file_obj:
+                self.assertTrue(file_obj.read() == mesh.export(file_type='off', precision=3))
+        finally:
+            shutil.rmtree(path)
+
+    def test_off(self):
+        from io import BytesIO
+        # colored vertices, a quad and a triangle with face colors,
+        # comments and blank lines
+        text   = '\n'.join(['# comment',
+                             'COFF',
+                             '5 2 0',
+                             '0 0 0 255 0 0 255',
+                             '1 0 0 0 255 0 255',
+                             '1 1 0 0 0 255 255 # trailing',
+                             '0 1 0 0 0 0 255',
+                             '',
+                             '0 0 1 255 255 255 255',
+                             '4 0 1 2 3 0.5 0.5 0.5',
+                             '3 0 1 4 1.0 0 0\n']).encode('ascii')
+        mesh   = trimesh.load_mesh(BytesIO(text), file_type='off', process=False)
+        self.assertTrue(mesh.faces.tolist() == [[0,1,2], [0,2,3], [0,1,4]])
+        self.assertTrue(mesh.vertex_colors[1].tolist() == [0, 255, 0])
+        self.assertTrue(mesh.face_colors.tolist() == [[128,128,128]] * 2 + [[255,0,0]])
+        self.assertRaises(NameError,
+                          trimesh.load_mesh,
+                          BytesIO(text.replace(b'5 2 0', b'5 3 0')),
+                          file_type='off')
+
+        # float colors are found from the text, even if every value is 0 or 1
+        text   = '\n'.join(['COFF',
+                             '3 1 0',
+                             '0 0 0 1.0 0.0 0.0',
+                             '1 0 0 0.0 1.0 0.0',
+                             '0 1 0 0.0 0.0 1e0',
+                             '3 0 1 2 1. 1. 0.\n']).encode('ascii')
+        mesh   = trimesh.load_mesh(BytesIO(text), file_type='off', process=False)
+        self.assertTrue(mesh.vertex_colors.tolist() == [[255,0,0], [0,255,0], [0,0,255]])
+        self.assertTrue(mesh.face_colors.tolist() == [[255,255,0]])
+
+    def test_probe(self):
+        import hashlib
+        from trimesh.io.load import probe
+        for name in ['featuretype.STL', 'ADIS16480.STL', 'ballA.off', 'tube.obj']:
+            location = os.path.abspath(os.path.join(TEST_DIR, name))
+            info     = probe(location)
+            mesh     = trimesh.load_mesh(location, process=False)
+            with open(location, 'rb') as file_obj:
+                self.assertTrue(info['md5'] == hashlib.md5(file_obj.read()).hexdigest())
+            self.assertTrue(info['face_count'] == len(mesh.faces))
+            if info['bounds'] is not None:
+                self.assertTrue(np.allclose(info['bounds'], mesh.bounds, atol=1e-6))
+                self.assertTrue(np.isclose(info['area'], mesh.area()))
+
+    def test_compressed(self):
+        import tempfile, shutil, gzip, zipfile
+        location = os.path.abspath(os.path.join(TEST_DIR, 'featuretype.STL'))
+        mesh     = trimesh.load_mesh(location)
+        path     = tempfile.mkdtemp()
+        try:
+            compressed = os.path.join(path, 'featuretype.stl.gz')
+            archive    = os.path.join(path, 'parts.zip')
+            with open(location, 'rb') as file_obj:
+                data = file_obj.read()
+            with gzip.GzipFile(compressed, 'wb') as file_obj:
+                file_obj.write(data)
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as file_obj:
+                file_obj.write(location, 'parts/featuretype.STL')
+                file_obj.write(os.path.join(TEST_DIR, 'tube.obj'), 'tube.obj')
+                file_obj.writestr('readme.txt', 'not a mesh')
+
+            loaded = trimesh.load_mesh(compressed)
+            self.assertTrue(np.all(loaded.vertices == mesh.vertices))
+            with open(compressed, 'rb') as file_obj:
+                streamed = trimesh.load_mesh(file_obj, file_type='stl.gz')
+            self.assertTrue(np.all(streamed.faces == mesh.faces))
+
+            members = trimesh.load_mesh(archive)
+            self.assertTrue(len(members) == 2)
+            self.assertTrue(np.all(members[0].vertices == mesh.vertices))
+
+            # dots in directory names are not part of the file type
+            dotted = os.path.join(path, 'dir.v2')
+            os.mkdir(dotted)
+            shutil.copy(compressed, os.path.join(dotted, 'featuretype.stl.gz'))
+            loaded = trimesh.load_mesh(os.path.join(dotted, 'featuretype.stl.gz'))
+            self.assertTrue(np.all(loaded.vertices == mesh.vertices))
+            shutil.copy(compressed, os.path.join(dotted, 'part.gz'))
+            shutil.copy(location, os.path.join(dotted, 'part'))
+            for name in ['part.gz', 'part']:
+                self.assertRaises(NameError, 
+                                  trimesh.load_mesh, 
+                                  os.path.join(dotted, name))
+        finally:
+            shutil.rmtree(path)
+
+    def test_load_many(self):
+        names  = ['featuretype.STL', 'unit_cube.STL', 'tube.obj']
+        files  = [os.path.abspath(os.path.join(TEST_DIR, i)) for i in names]
+        files.append(os.path.abspath(os.path.join(TEST_DIR, 'missing.STL')))
+        serial = dict((i, trimesh.load_mesh(i)) for i in files[:-1])
+        for workers in [None, 2]:
+            results = list(trimesh.load_many(iter(files), workers=workers))
+            self.assertTrue(sorted(i[0] for i in results) == sorted(files))
+            for file_name, mesh, error in results:
+                if file_name not in serial:
+                    self.assertTrue(mesh is None and 'missing.STL' in error)
+                    continue
+                self.assertTrue(error is None)
+                self.assertTrue(np.all(mesh.faces == serial[file_name].faces))
+                self.assertTrue(np.all(mesh.vertices == serial[file_name].vertices))
+                self.assertTrue(mesh._cache.get('processed') is not None)
+
+    def test_stl_export(self):
+        from io import BytesIO
+        location = os.path.abspath(os.path.join(TEST_DIR, 'featuretype.STL'))
+        mesh     = trimesh.load_mesh(location)
+        export   = mesh.export(file_type='stl')
+        self.assertTrue(len(export) == 84 + (50 * len(mesh.faces)))
+
+        # streaming in chunks should produce the same file
+        streamed = BytesIO()
+        trimesh.io.export.export_stl(mesh, streamed, chunk_size=100)
+        self.assertTrue(streamed.getvalue() == export)
+
+        # a file opened from a filename is closed, so it is fully written
+        import tempfile, shutil
+        path = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(path, 'streamed.stl')
+            trimesh.io.export.export_stl(mesh, file_name, chunk_size=100)
+            with open(file_name, 'rb') as file_obj:
+                self.assertTrue(file_obj.read() == export)
+        finally:
+            shutil.rmtree(path)
+
+        loaded = trimesh.load_mesh(BytesIO(export), file_type='stl', process=False)
+        self.assertTrue(np.allclose(loaded.vertices, mesh.vertices[mesh.faces].reshape((-1,3)),
+                                    atol=1e-5))
+
+        # exporting computes missing normals without altering the mesh
+        degenerate = trimesh.Trimesh(vertices = mesh.vertices,
+                                     faces    = np.vstack((mesh.faces, [[0,0,1]])))
+        export     = degenerate.export(file_type='stl')
+        self.assertTrue(len(degenerate.faces) == len(mesh.faces) + 1)
+        self.assertTrue(degenerate.face_normals.shape != degenerate.faces.shape)
+        loaded = trimesh.load_mesh(BytesIO(export), file_type='stl', process=False)
+        normals = trimesh.triangles.normals(mesh.vertices[mesh.faces])[0]
+        self.assertTrue(np.allclose(loaded.face_normals[:-1], normals, atol=1e-5))
+        self.assertTrue(np.all(loaded.face_normals[-1] == 0))
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        location  = os.path.abspath(os.path.join(TEST_DIR, 'featuretype.STL'))
+        self.mesh = trimesh.load_mesh(location)
+
+    def test_invalidation(self):
+        mesh      = self.mesh
+        adjacency = mesh.face_adjacency()
+        area      = mesh.area()
+        hits      = mesh._cache.hits
+        self.assertTrue(mesh.face_adjacency() is adjacency)
+        self.assertTrue(mesh._cache.hits > hits)
+
+        # cached arrays are returned read- only so they can't be altered
+        for cached in [adjacency, mesh.edges(), mesh.area(sum=False)]:
+            with self.assertRaises(ValueError):
+                cached[0] = 0
+
+        # an in- place write to a view of vertices should invalidate
+        mesh.vertices[:,0] *= 2.0
+        self.assertFalse(np.abs(mesh.area() - area) < TOL_ZERO)
+        self.assertFalse(mesh.face_adjacency() is adjacency)
+
+        # as should assigning a new array
+        adjacency  = mesh.face_adjacency()
+        mesh.faces = mesh.faces[1:]
+        self.assertTrue(len(mesh.face_adjacency()) < len(adjacency))
+
+    def test_disk_cache(self):
+        import tempfile, shutil
+        path = tempfile.mkdtemp()
+        try:
+            disk = trimesh.caching.set_disk_cache(path)
+            rays = np.tile([[0,0,-100],[0,0,1]], (10,1)).reshape((-1,2,3))
+            hits = self.mesh.ray.intersects_id(rays)
+            self.assertTrue(len(disk.entries()) == 1)
+
+            # a mesh with the same data should load the tree from disk
+            copied = trimesh.Trimesh(vertices = self.mesh.vertices.copy(),
+                                     faces    = self.mesh.faces.copy())
+            self.assertTrue(isinstance(copied.ray.tree.order, np.memmap))
+            for a, b in zip(hits, copied.ray.intersects_id(rays)):
+                self.assertTrue(np.all(np.sort(a) == np.sort(b)))
+
+            copied.merge_vertices(angle_max=.1)
+            self.assertTrue(len(disk.entries()) == 2)
+            # least recently used entries are evicted first
+            newest = disk.entries()[-1][2]
+            disk.evict(max_size=disk.entries()[-1][1])
+            self.assertTrue([e[2] for e in disk.entries()] == [newest])
+        finally:
+            trimesh.caching.set_disk_cache(None)
+            shutil.rmtree(path)
+
+    def test_disk_cache_native(self):
+        import tempfile, shutil
+        path = tempfile.mkdtemp()
+        try:
+            # the same as setting TRIMESH_CACHE_DIR before import
+            disk      = trimesh.caching.set_disk_cache(os.path.join(path, 'cache'))
+            file_name = os.path.join(path, 'featuretype.trimesh')
+            self.mesh.export(file_name, file_type='trimesh')
+            loaded = trimesh.load_mesh(file_name, process=False)
+            rays   = np.tile([[0,0,-100],[0,0,1]], (10,1)).reshape((-1,2,3))
+            self.assertTrue(loaded.ray.intersects_any(rays).all())
+            self.assertTrue(len(disk.entries()) == 1)
+
+            # move the vertices in the file, without changing the header
+            with open(file_name, 'r+b') as file_obj:
+                header = trimesh.io.binary.read_header(file_obj)[0]
+                file_obj.seek(header['arrays']['vertices']['offset'])
+                file_obj.write((self.mesh.vertices + [1000,0,0]).tobytes())
+
+            # the altered file must not reuse the tree built for the original
+            altered = trimesh.load_mesh(file_name, process=False)
+            self.assertFalse(altered.ray.intersects_any(rays).any())
+            self.assertTrue(len(disk.entries()) == 2)
+        finally:
+            trimesh.caching.set_disk_cache(None)
+            shutil.rmtree(path)
+
+class RayTests(unittest.TestCase):
+    def setUp(self):
+        location  = os.path.abspath(os.path.join(TEST_DIR, 'featuretype.STL'))
+        self.mesh = trimesh.load_mesh(location)
+
+    def random_rays(self, count=100):
+        # rays starting outside the mesh pointed at its centroid
+        origins    = trimesh.unitize(np.random.random((count,3)) - .5)
+        origins   *= np.max(self.mesh.box_size) * 2
+        origins   += self.mesh.centroid
+        directions = self.mesh.centroid - origins
+        return np.column_stack((origins, directions)).reshape((-1,2,3))
+
+    def test_transform(self):
+        mesh = self.mesh
+        rays = self.random_rays()
+        self.assertTrue(mesh.ray.intersects_any(rays).all())
+        tree = mesh.ray.tree
+
+        matrix = trimesh.transformations.random_rotation_matrix()
+        matrix[0:3,3] = (np.random.random(3)-.5)*20
+        mesh.transform(matrix)
+        # the tree should be kept through a transform
+        self.assertTrue(mesh.ray.tree is tree)
+
+        # compare against a copy which will build a new tree
+        rays  = self.random_rays()
+        fresh = trimesh.Trimesh(vertices = mesh.vertices.copy(),
+                                faces    = mesh.faces.copy())
+        kept  = mesh.ray.intersects_id(rays)
+        built = fresh.ray.intersects_id(rays)
+        for a, b in zip(kept, built):
+            self.assertTrue(np.all(np.sort(a) == np.sort(b)))
+
+        # any other change should discard the tree 
+        mesh.faces = mesh.faces[1:]
+        self.assertFalse(mesh.ray.tree is tree)
+
+    def test_narrow_phase(self):
+        from trimesh.ray.ray_triangle_cpu import rays_triangles_id, ray_triangles_vectorized
+        rays      = self.random_rays(20)
+        triangles = self.mesh.ray.triangles
+        # every triangle is a candidate for every ray
+        batched   = rays_triangles_id(triangles, rays)
+        for ray, hits in zip(rays, batched):
+            single = np.nonzero(ray_triangles_vectorized(triangles, *ray))[0]
+            self.assertTrue(np.all(np.sort(hits) == single))
+        # no rays should have no results, rather than one empty result
+        self.assertTrue(len(rays_triangles_id(triangles, np.zeros((0,2,3)))) == 0)
+        self.assertTrue(len(self.mesh.ray.intersects_id(np.zeros((0,2,3)))) == 0)
+        
+    def test_location(self):
+        rays = self.random_rays(500)
+        locations, index_ray, index_tri, distance = self.mesh.ray.intersects_location(rays)
+        # every hit should be on the ray, and on the triangle plane
+        on_ray = rays[index_ray,0] + (trimesh.unitize(rays[index_ray,1]) * 
+                                      distance.reshape((-1,1)))
+        self.assertTrue(np.allclose(on_ray, locations))
+        triangles = self.mesh.ray.triangles[index_tri]
+        normals   = trimesh.triangles.normals(triangles)[0]
+        planar    = np.sum((locations - triangles[:,0]) * normals, axis=1)
+        self.assertTrue(np.allclose(planar, 0.0))
+        # the same hits as intersects_id
+        hits = self.mesh.ray.intersects_id(rays)
+        self.assertTrue(sum(len(i) for i in hits) == len(index_tri))
+
+        first = self.mesh.ray.intersects_location(rays, first_hit_only=True)
+        self.assertTrue(np.all(np.unique(index_ray) == first[1]))
+        # hits are ordered by distance, so the first hit for every ray
+        # should be the first one in the list of all hits
+        starts = np.searchsorted(index_ray, first[1])
+        self.assertTrue(np.allclose(distance[starts], first[3]))
+        
+    def test_broad_phase(self):
+        from trimesh.ray.ray_mesh import ray_triangle_candidates
+        from trimesh.ray.ray_triangle_cpu import rays_triangles_id
+        rays      = self.random_rays()
+        tree      = self.mesh.ray.tree
+        triangles = self.mesh.ray.triangles
+        exact     = ray_triangle_candidates(rays, tree=tree)
+        boxes     = ray_triangle_candidates(rays, tree=tree, segments=4)
+        # segment boxes are looser than traversing the rays
+        self.assertTrue(len(boxes[1]) >= len(exact[1]))
+        for a, b in zip(rays_triangles_id(triangles, rays, exact),
+                        rays_triangles_id(triangles, rays, boxes)):
+            self.assertTrue(np.all(np.sort(a) == np.sort(b)))
+
+    def test_parallel(self):
+        rays = self.random_rays(1000)
+        ray  = self.mesh.ray
+        self.assertTrue(np.all(ray.intersects_any(rays, workers=2) ==
+                               ray.intersects_any(rays)))
+        for a, b in zip(ray.intersects_id(rays, workers=2),
+                        ray.intersects_id(rays)):
+            self.assertTrue(np.all(np.sort(a) == np.sort(b)))
+        parallel = ray.intersects_location(rays, workers=3)
+        serial   = ray.intersects_location(rays)
+        for a, b in zip(parallel, serial):
+            self.assertTrue(np.allclose(a, b))
+
+        # the pool is kept between queries until the mesh changes
+        shared = ray._shared
+        ray.intersects_any(rays, workers=3)
+        self.assertTrue(ray._shared is shared)
+        self.mesh.vertices[:,0] *= 2.0
+        rays = self.random_rays(1000)
+        self.assertTrue(np.all(ray.intersects_any(rays, workers=3) ==
+                               ray.intersects_any(rays)))
+        self.assertFalse(ray._shared is shared)
+        self.assertTrue(shared.pool is None)
+        self.assertFalse(os.path.exists(shared.file_name))
+
+        file_name = ray._shared.file_name
+        ray.close()
+        self.assertTrue(ray._shared is None)
+        self.assertFalse(os.path.exists(file_name))
+
+    def test_contains(self):
+        from trimesh.intersections import CONTAINS_DIRECTIONS
+        mesh   = self.mesh
+        points = (np.random.random((500,3)) * mesh.box_size * 1.2 +
+                  mesh.bounds[0] - mesh.box_size * .1)
+        parity  = mesh.contains(points)
+        winding = mesh.contains(points, mode='winding')
+        self.assertTrue(parity.any())
+        self.assertTrue(np.all(parity == winding))
+
+        # points whose first ray passes exactly through a vertex
+        # should be cast again rather than miscounted
+        vertices = mesh.vertices[mesh.faces[:50,0]]
+        inside   = vertices - CONTAINS_DIRECTIONS[0] * 1e-3
+        outside  = vertices + CONTAINS_DIRECTIONS[0] * 1e-3
+        points   = np.vstack((inside, outside))
+        self.assertTrue(np.all(mesh.contains(points) ==
+                               mesh.contains(points, mode='winding')))
+
+        # rays starting on the surface are ambiguous in every direction
+        from trimesh.intersections import _ray_parity
+        centroids = mesh.ray.triangles[:50].mean(axis=1)
+        for direction in CONTAINS_DIRECTIONS:
+            self.assertTrue(_ray_parity(centroids, mesh, direction)[1].all())
+
+    def test_nearest(self):
+        mesh   = self.mesh
+        points = (np.random.random((200,3)) * mesh.box_size * 1.2 +
+                  mesh.bounds[0] - mesh.box_size * .1)
+        closest, distance, triangle_id = mesh.nearest.on_surface(points)
+
+        # check against every triangle for every point
+        triangles = mesh.ray.triangles
+        count     = len(triangles)
+        brute     = trimesh.triangles.closest_point(np.tile(triangles, (len(points),1,1)),
+                                                    np.repeat(points, count, axis=0))
+        brute     = np.sum((brute - np.repeat(points, count, axis=0)) ** 2,
+                           axis=1).reshape((-1, count)) ** .5
+        self.assertTrue(np.allclose(brute.min(axis=1), distance))
+        self.assertTrue(np.allclose(brute[np.arange(len(points)), triangle_id],
+                                    distance))
+        self.assertTrue(np.allclose(np.sum((closest - points) ** 2, axis=1) ** .5,
+                                    distance))
+
+        signed = mesh.nearest.signed_distance(points)
+        self.assertTrue(np.allclose(np.abs(signed), distance))
+        self.assertTrue(np.all((signed > 0) == mesh.contains(points)))
+
+        parallel = mesh.nearest.on_surface(points, workers=2)
+        self.assertTrue(np.allclose(parallel[1], distance))
+
+    def test_bvh(self):
+        from trimesh.ray.bvh import BVH, bvh_from_bounds
+        from io import BytesIO
+        bounds = np.random.random((1000,2,3))
+        bounds.sort(axis=1)
+        bvh    = bvh_from_bounds(bounds)
+
+        boxes  = np.random.random((100,2,3))
+        boxes.sort(axis=1)
+        offsets, index = bvh.intersects_box(boxes)
+        for i, box in enumerate(boxes):
+            truth = np.logical_and((bounds[:,0] <= box[1]).all(axis=1),
+                                   (bounds[:,1] >= box[0]).all(axis=1))
+            found = index[offsets[i]:offsets[i+1]]
+            self.assertTrue(set(np.nonzero(truth)[0]) == set(found))
+
+        # trees should survive a round trip through a file
+        stored = BytesIO()
+        bvh.save(stored)
+        stored.seek(0)
+        loaded = BVH.load(stored)
+        self.assertTrue(np.all(loaded.intersects_box(boxes)[1] == index))
+
 class MassTests(unittest.TestCase):
     def setUp(self):
         # inertia numbers pulled from solidworks
@@ -5,6 +5,7 @@ Library for importing and doing simple operations on triangular meshes.
 '''
 
 import numpy as np
+from copy import deepcopy
 
 from . import triangles
 from . import grouping
@@ -17,11 +18,19 @@ from . import comparison
 
 from .io.export import export_mesh
 from .ray.ray_mesh import RayMeshIntersector
+from .proximity import ProximityQuery
+from .caching import Cache, tracked_array
 
 from .constants import *
 from .geometry import unitize, transform_points
 
-class Trimesh():
+# methods called by Trimesh.process, in order
+PROCESS_STEPS = ['merge_vertices',
+                 'remove_duplicate_faces',
+                 'remove_degenerate_faces',
+                 'verify_face_normals']
+
+class Trimesh(object):
     def __init__(self, 
                  vertices        = None, 
                  faces           = None, 
@@ -33,6 +42,11 @@ class Trimesh():
                  process         = False,
                  **kwargs):
 
+        # values derived from the mesh geometry (adjacency, area, etc)
+        # are stored here, and are discarded automatically when
+        # vertices, faces, or face normals are changed
+        self._cache          = Cache(id_function=self.md5)
+
         # (n, 3) float, set of vertices
         self.vertices        = np.array(vertices)
         # (m, 3) int of triangle faces, references self.vertices
@@ -55,21 +69,81 @@ class Trimesh():
         # on first query expensive bookkeeping is done (creation of r-tree)
         # and is cached for subsequent queries
         self.ray             = RayMeshIntersector(self)
+        # closest point queries, which share the tree of self.ray
+        self.nearest         = ProximityQuery(self)
         
         # update the mesh metadata with passed metadata
         if isinstance(metadata, dict): self.metadata.update(metadata)
         # if requested, do basic mesh cleanup
         if process:                    self.process()
-            
+
+    @property
+    def vertices(self):
+        '''
+        (n, 3) float, set of vertices.
+        Stored as a TrackedArray so in- place changes are noticed.
+        '''
+        return self._vertices
+
+    @vertices.setter
+    def vertices(self, values):
+        self._vertices = tracked_array(values)
+
+    @property
+    def faces(self):
+        '''
+        (m, 3) int, triangle faces which reference self.vertices
+        Stored as a TrackedArray so in- place changes are noticed.
+        '''
+        return self._faces
+
+    @faces.setter
+    def faces(self, values):
+        self._faces = tracked_array(values)
+
+    @property
+    def face_normals(self):
+        '''
+        (m, 3) float, unit normal vectors of faces
+        Stored as a TrackedArray so in- place changes are noticed.
+        '''
+        return self._face_normals
+
+    @face_normals.setter
+    def face_normals(self, values):
+        self._face_normals = tracked_array(values)
+
+    def md5(self):
+        '''
+        Return a string which changes whenever the vertices, faces, or
+        face normals of the mesh change. Hashes of the individual arrays
+        are only recomputed if that array has been modified.
+
+        Returns
+        ---------
+        md5: str, combined hex digests of vertices, faces, and face_normals
+        '''
+        result = ''.join([self._vertices.md5(), 
+                          self._faces.md5(), 
+                          self._face_normals.md5()])
+        return result
+
     def process(self):
         '''
         Convenience function to do basic processing on a raw mesh
-        '''
-        
-        self.merge_vertices()
-        self.remove_duplicate_faces()
-        self.remove_degenerate_faces()
-        self.verify_face_normals()
+
+        The names of the steps applied are stored in the cache under 
+        'processed', and steps which have already been applied to the 
+        current data are skipped. So if the mesh hasn't changed since 
+        the last call to process, this is a no-op.
+        '''
+        processed = self._cache.get('processed')
+        if processed is None:
+            processed = []
+        for step in PROCESS_STEPS:
+            if step in processed: continue
+            getattr(self, step)()
+        self._cache.set('processed', list(PROCESS_STEPS))
         return self
         
     def rezero(self):
@@ -101,7 +175,17 @@ class Trimesh():
         return graph_ops.split(self, only_count=True)
 
     def edges(self):
-        return geometry.faces_to_edges(self.faces)
+        '''
+        Returns an (n*3, 2) int array of vertex indices, the edges
+        of every face. Cached until the mesh changes, and read- only
+        as it is the cached array.
+        '''
+        cached = self._cache.get('edges')
+        if cached is None:
+            cached = geometry.faces_to_edges(self.faces)
+            cached.flags.writeable = False
+            self._cache.set('edges', cached)
+        return cached
         
     def face_adjacency(self):
         '''
@@ -113,15 +197,27 @@ class Trimesh():
         graph = nx.Graph()
         graph.add_edges_from(mesh.face_adjacency())
         groups = nx.connected_components(graph_connected.subgraph(interesting_faces))
+
+        The result is cached until the mesh changes, and is read- only
+        as it is the cached array.
         '''
-        return graph_ops.face_adjacency(self.faces)
+        cached = self._cache.get('face_adjacency')
+        if cached is None:
+            cached = graph_ops.face_adjacency(self.faces)
+            cached.flags.writeable = False
+            self._cache.set('face_adjacency', cached)
+        return cached
 
     def is_watertight(self):
         '''
         Check if a mesh is watertight. 
         This currently only checks to see if every face has three adjacent faces
         '''
-        return graph_ops.is_watertight(self)
+        cached = self._cache.get('is_watertight')
+        if cached is None:
+            cached = self._cache.set('is_watertight', 
+                                     graph_ops.is_watertight(self))
+        return cached
 
     def remove_degenerate_faces(self):
         '''
@@ -135,9 +231,20 @@ class Trimesh():
         '''
         Return a list of face indices for coplanar adjacent faces
         '''
-        facet_list = graph_ops.facets_group(self)
+        facets = self._cache.get('facets')
+        if facets is None:
+            facets = graph_ops.facets_group(self)
+            for array in facets:
+                array.flags.writeable = False
+            self._cache.set('facets', facets)
+        order, offsets = facets
+        facet_list     = grouping.group_split(order, offsets)
         if return_area:
-            facets_area = [triangles.area(self.vertices[[self.faces[i]]]) for i in facet_list]
+            facets_area = self._cache.get('facets_area')
+            if facets_area is None:
+                facets_area = grouping.group_sum(self.area(sum=False)[order], offsets)
+                facets_area.flags.writeable = False
+                self._cache.set('facets_area', facets_area)
             return facet_list, facets_area
         return facet_list
 
@@ -217,6 +324,30 @@ class Trimesh():
                                        plane_normal  = normal, 
                                        plane_origin  = origin,
                                        return_planar = return_planar)
+
+    def contains(self, points, mode='parity'):
+        '''
+        Check whether points are inside the current mesh, which should be
+        watertight. The BVH used for the ray queries is cached, so 
+        repeated calls on an unchanged mesh only pay for the queries.
+
+        Arguments
+        ---------
+        points: (n, 3) float, points in space
+        mode:   str, 'parity' casts rays and counts crossings, 
+                'winding' computes winding numbers (more tolerant of 
+                defects in the mesh, but every point is compared with 
+                every face, so it is far too slow for millions of points)
+
+        Returns
+        ---------
+        contained: (n) bool, whether each point is inside the mesh
+        '''
+        from .intersections import points_in_mesh
+        return points_in_mesh(points = points, 
+                              mesh   = self,
+                              mode   = mode)
+
     @log_time   
     def convex_hull(self):
         '''
@@ -244,7 +375,8 @@ class Trimesh():
         ---------
         angle_max: if defined, only vertices which are closer than TOL_MERGE
                    AND have vertex normals less than angle_max will be merged.
-                   This is useful for smooth shading, but is much slower. 
+                   This is useful for smooth shading, and the vertex normals
+                   and colors of merged vertices are averaged.
         '''
         if not (angle_max is None):
             grouping.merge_vertices_kdtree(self, angle_max)
@@ -255,6 +387,8 @@ class Trimesh():
         self.faces    = inverse[[self.faces.reshape(-1)]].reshape((-1,3))
         if self.vertex_colors_ok():
             self.vertex_colors = self.vertex_colors[vertex_mask]
+        if self.vertex_uv_ok():
+            self.metadata['uv'] = self.metadata['uv'][vertex_mask]
         self.vertices = self.vertices[vertex_mask]
 
     def update_faces(self, valid):
@@ -306,6 +440,8 @@ class Trimesh():
         '''
         unique, inverse = np.unique(self.faces.reshape(-1), return_inverse=True)
         self.faces      = inverse.reshape((-1,3))          
+        if self.vertex_uv_ok():
+            self.metadata['uv'] = self.metadata['uv'][unique]
         self.vertices   = self.vertices[unique]
 
     def unmerge_vertices(self):
@@ -313,6 +449,8 @@ class Trimesh():
         Removes all face references, so that every face contains
         three unique vertex indices.
         '''
+        if self.vertex_uv_ok():
+            self.metadata['uv'] = self.metadata['uv'][self.faces.reshape(-1)]
         self.vertices = self.vertices[[self.faces]].reshape((-1,3))
         self.faces    = np.arange(len(self.vertices)).reshape((-1,3))
         
@@ -355,6 +493,14 @@ class Trimesh():
 
     def vertex_colors_ok(self):
         return self.vertex_colors.shape == self.vertices.shape
+
+    def vertex_uv_ok(self):
+        '''
+        Return True if metadata['uv'] holds a texture coordinate 
+        for every vertex, as loaded from an OBJ file.
+        '''
+        uv = self.metadata.get('uv')
+        return uv is not None and len(uv) == len(self.vertices)
         
     def verify_face_colors(self):
         '''
@@ -401,14 +547,29 @@ class Trimesh():
     def transform(self, matrix):
         '''
         Transform mesh vertices by matrix
+
+        If the ray tree has already been built it is kept, rather than
+        being discarded and rebuilt on the next ray query. 
         '''
+        matrix        = np.array(matrix, dtype=np.float64)
+        retained      = self.ray.retain_tree(matrix)
         self.vertices = transform_points(self.vertices, matrix)
+        self.ray.restore_tree(retained)
 
     def area(self, sum=True):
         '''
         Summed area of all triangles in the current mesh.
-        '''
-        return triangles.area(self.vertices[self.faces], sum=sum)
+        If sum is False, returns the (m) area of each face, which is
+        read- only as it is the cached array.
+        '''
+        key    = ('area', bool(sum))
+        cached = self._cache.get(key)
+        if cached is None:
+            cached = triangles.area(self.vertices[self.faces], sum=sum)
+            if isinstance(cached, np.ndarray):
+                cached.flags.writeable = False
+            self._cache.set(key, cached)
+        return cached
         
     @property
     def bounds(self):
@@ -444,10 +605,17 @@ class Trimesh():
             'density'     : Included again for convenience (same as kwarg density)
             'inertia'     : Taken at the center of mass and aligned with global coordinate system
             'center_mass' : Center of mass location, in global coordinate system
+
+        Results are cached, and a copy is returned.
         '''
-        return triangles.mass_properties(triangles    = self.vertices[[self.faces]], 
-                                         density      = density,
-                                         skip_inertia = skip_inertia)
+        key    = ('mass_properties', float(density), bool(skip_inertia))
+        cached = self._cache.get(key)
+        if cached is None:
+            cached = triangles.mass_properties(triangles    = self.vertices[[self.faces]], 
+                                               density      = density,
+                                               skip_inertia = skip_inertia)
+            self._cache.set(key, cached)
+        return deepcopy(cached)
 
     def show(self):
         '''
@@ -467,14 +635,15 @@ class Trimesh():
         '''
         return comparison.rotationally_invariant_identifier(self)
 
-    def export(self, file_obj=None, file_type='stl'):
+    def export(self, file_obj=None, file_type='stl', **kwargs):
         '''
         Export the current mesh to a file object. 
         If file_obj is a filename, file will be written there. 
 
         Supported formats are stl, off, and collada. 
+        Any other keyword arguments are passed to the exporter.
         '''
-        return export_mesh(self, file_obj, file_type)
+        return export_mesh(self, file_obj, file_type, **kwargs)
 
 
     def __add__(self, other):
@@ -0,0 +1,386 @@
+'''
+caching.py
+
+Tools for caching values derived from mesh data, and for noticing when
+that data has changed so the cached values can be thrown away.
+
+Expensive structures (like the BVH used for ray queries) can also be
+stored in a persistent DiskCache, keyed by a hash of the data they were
+built from, so they are only built once across processes.
+'''
+import numpy as np
+import hashlib
+import tempfile
+import os
+
+from .constants import log
+from .io.binary import write_arrays, read_arrays
+
+# if this environment variable is set the disk cache is enabled on import,
+# and stored in the directory it names
+DISK_CACHE_VARIABLE = 'TRIMESH_CACHE_DIR'
+# maximum size of the disk cache in bytes, before files are evicted
+DISK_CACHE_SIZE     = 2 ** 30
+# extension of files stored in the disk cache
+DISK_CACHE_SUFFIX   = '.trimesh_cache'
+
+def tracked_array(array, dtype=None):
+    '''
+    Properly subclass a numpy ndarray to track changes.
+
+    Arguments
+    ---------
+    array: array- like object to be tracked
+    dtype: optional, dtype to convert array to
+
+    Returns
+    ---------
+    tracked: TrackedArray, with the same data as array
+    '''
+    if isinstance(array, TrackedArray) and dtype in (None, array.dtype):
+        return array
+    result = np.asarray(array, dtype=dtype, order='C').view(TrackedArray)
+    return result
+
+class TrackedArray(np.ndarray):
+    '''
+    Track changes in a numpy ndarray.
+
+    In- place writes (item assignment and in- place operators) set a
+    modified flag, on this array and on any tracked array it is a view of.
+    The md5 of the array contents is only recomputed if the array has been
+    modified since the last time it was requested.
+
+    Note that writes which bypass the ndarray methods, for example a ufunc
+    called with out=tracked, will NOT be noticed.
+    '''
+    def __array_finalize__(self, obj):
+        # every new array (including views and results of operations)
+        # starts out as modified, so its hash will be computed on request
+        self._modified = True
+        self._hashed   = None
+
+    def __array_wrap__(self, out_arr, context=None):
+        # reductions like sum() would otherwise return a 0-d TrackedArray
+        # rather than a scalar, so unwrap them
+        if out_arr.ndim == 0:
+            return out_arr[()]
+        return np.ndarray.__array_wrap__(self, out_arr, context)
+
+    def md5(self):
+        '''
+        Return an MD5 hex digest of the array contents.
+        Only recomputed if the array has been modified.
+
+        Returns
+        ---------
+        md5: str, hex digest of array data
+        '''
+        if self._modified or self._hashed is None:
+            self._hashed   = hashlib.md5(np.ascontiguousarray(self).tobytes()).hexdigest()
+            self._modified = False
+        return self._hashed
+
+    def _set_modified(self):
+        # writes to a view alter the data of the tracked array
+        # it was taken from, so we flag the whole chain of bases
+        current = self
+        while isinstance(current, TrackedArray):
+            current._modified = True
+            current = current.base
+
+def _tracked_method(name):
+    '''
+    Wrap an ndarray method which alters data in place, so that calling
+    it flags the array as modified.
+    '''
+    method = getattr(np.ndarray, name)
+    def tracked(self, *args, **kwargs):
+        self._set_modified()
+        return method(self, *args, **kwargs)
+    tracked.__name__ = name
+    tracked.__doc__  = method.__doc__
+    return tracked
+
+_TRACKED_METHODS = ['__setitem__', '__setslice__',
+                    '__iadd__',    '__isub__',      '__imul__',
+                    '__idiv__',    '__itruediv__',  '__ifloordiv__',
+                    '__imod__',    '__ipow__',      '__ilshift__',
+                    '__irshift__', '__iand__',      '__ior__',
+                    '__ixor__',    'fill',          'put',
+                    'sort',        'itemset',       'partition']
+for _name in _TRACKED_METHODS:
+    # __setslice__ and __idiv__ only exist on python 2
+    if hasattr(np.ndarray, _name):
+        setattr(TrackedArray, _name, _tracked_method(_name))
+
+class Cache:
+    '''
+    Class to cache values until an id function changes.
+
+    Every access checks the current value of id_function, and if it is
+    different from the value the cache was populated with, all stored
+    values are discarded. Hit and miss counts are kept for inspection.
+    '''
+    def __init__(self, id_function):
+        '''
+        Arguments
+        ---------
+        id_function: function which returns a hashable value
+                     representing the state of the source data
+        '''
+        self._id_function = id_function
+        self.id_current   = None
+        self.cache        = dict()
+        self.hits         = 0
+        self.misses       = 0
+
+    def verify(self):
+        '''
+        Verify that the cached values are still valid for the
+        current source data, and if not clear them.
+        '''
+        id_new = self._id_function()
+        if id_new != self.id_current:
+            if len(self.cache) > 0:
+                log.debug('%d items cleared from cache', len(self.cache))
+            self.clear()
+            self.id_current = id_new
+
+    def get(self, key):
+        '''
+        Get a key from the cache.
+
+        If the key is unavailable or the cache has been invalidated
+        returns None.
+        '''
+        self.verify()
+        if key in self.cache:
+            self.hits += 1
+            return self.cache[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        '''
+        Store a value in the cache, and return it.
+        '''
+        self.verify()
+        self.cache[key] = value
+        return value
+
+    def delete(self, key):
+        '''
+        Remove a single key from the cache, if it exists.
+        '''
+        self.cache.pop(key, None)
+
+    def clear(self):
+        '''
+        Remove all values from the cache.
+        '''
+        self.cache = dict()
+
+    def stats(self):
+        '''
+        Return a dict with the number of cache hits, misses, and
+        the number of values currently stored.
+        '''
+        return {'hits'   : self.hits,
+                'misses' : self.misses,
+                'stored' : len(self.cache)}
+
+    def __contains__(self, key):
+        self.verify()
+        return key in self.cache
+
+    def __len__(self):
+        self.verify()
+        return len(self.cache)
+
+class DiskCache:
+    '''
+    A persistent cache of named numpy arrays, stored in a directory.
+
+    Every entry is a single array container file, so entries are
+    memory- mapped rather than read when they are loaded. When the total
+    size of the directory exceeds max_size, the least recently used
+    entries are deleted. 
+    '''
+    def __init__(self, path, max_size=DISK_CACHE_SIZE):
+        '''
+        Arguments
+        ---------
+        path:     str, directory to store cache files in, created if needed
+        max_size: int, maximum total size of cache files in bytes
+        '''
+        self.path     = os.path.abspath(os.path.expanduser(path))
+        self.max_size = int(max_size)
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def _file_name(self, name, key):
+        return os.path.join(self.path, name + '_' + key + DISK_CACHE_SUFFIX)
+
+    def get(self, name, key):
+        '''
+        Load an entry from the cache.
+
+        Arguments
+        ---------
+        name: str, what kind of value is stored, eg 'bvh'
+        key:  str, hash of the data the value was built from
+
+        Returns
+        ---------
+        arrays:   dict, {str: numpy array}, memory- mapped, or None if
+                  the entry doesn't exist or couldn't be read
+        metadata: dict, as passed to set, or None
+        '''
+        file_name = self._file_name(name, key)
+        if not os.path.isfile(file_name):
+            return None, None
+        try:
+            arrays, metadata = read_arrays(file_name, mmap=True)
+        except Exception:
+            log.warning('Unable to read cache file %s', file_name, exc_info=True)
+            return None, None
+        # the modification time is used as the last access time for eviction
+        try: 
+            os.utime(file_name, None)
+        except OSError: 
+            pass
+        log.debug('Loaded %s from disk cache', name)
+        return arrays, metadata
+
+    def set(self, name, key, arrays, metadata=None):
+        '''
+        Store an entry in the cache, and evict old entries if 
+        the cache is larger than max_size.
+
+        Arguments
+        ---------
+        name:     str, what kind of value is stored, eg 'bvh'
+        key:      str, hash of the data the value was built from
+        arrays:   dict, {str: numpy array}
+        metadata: dict, JSON serializable values
+        '''
+        file_name = self._file_name(name, key)
+        # write to a temporary file and move it into place, so other 
+        # processes never see a partially written entry
+        handle, temporary = tempfile.mkstemp(dir=self.path)
+        try:
+            with os.fdopen(handle, 'wb') as file_obj:
+                write_arrays(file_obj, arrays, metadata)
+            if os.path.exists(file_name):
+                os.remove(file_name)
+            os.rename(temporary, file_name)
+        except (OSError, IOError):
+            log.warning('Unable to write cache file %s', file_name, exc_info=True)
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        self.evict()
+
+    def entries(self):
+        '''
+        Return the files in the cache, least recently used first.
+
+        Returns
+        ---------
+        entries: list of (last used time, size in bytes, file name) tuples
+        '''
+        entries = []
+        for file_name in os.listdir(self.path):
+            if not file_name.endswith(DISK_CACHE_SUFFIX): 
+                continue
+            file_name = os.path.join(self.path, file_name)
+            try:
+                stat = os.stat(file_name)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_name))
+        entries.sort()
+        return entries
+
+    def evict(self, max_size=None):
+        '''
+        Delete the least recently used entries until the cache 
+        is smaller than max_size.
+
+        Arguments
+        ---------
+        max_size: int, size in bytes, if None uses self.max_size
+        '''
+        if max_size is None:
+            max_size = self.max_size
+        entries = self.entries()
+        total   = sum(e[1] for e in entries)
+        for used, size, file_name in entries:
+            if total <= max_size: 
+                break
+            try:
+                os.remove(file_name)
+            except OSError:
+                # a file which is memory- mapped can't be removed on windows
+                continue
+            total -= size
+            log.debug('Evicted %s from disk cache', file_name)
+
+    def clear(self):
+        '''
+        Delete every entry in the cache.
+        '''
+        self.evict(max_size=0)
+
+def content_key(*arrays, **values):
+    '''
+    Return a hash of the contents of arrays and any other values, 
+    suitable for use as a DiskCache key.
+
+    Arguments
+    ---------
+    arrays: numpy arrays, TrackedArrays use their cached md5, which 
+            is always computed from the array data
+    values: other values which affect the result, hashed by repr
+
+    Returns
+    ---------
+    key: str, hex digest
+    '''
+    hasher = hashlib.md5()
+    for array in arrays:
+        if isinstance(array, TrackedArray):
+            digest = array.md5()
+        else:
+            digest = hashlib.md5(np.ascontiguousarray(array).tobytes()).hexdigest()
+        hasher.update((digest + str(np.shape(array))).encode('utf-8'))
+    hasher.update(repr(sorted(values.items())).encode('utf-8'))
+    return hasher.hexdigest()
+
+_disk_cache = None
+
+def set_disk_cache(path, max_size=DISK_CACHE_SIZE):
+    '''
+    Configure the persistent disk cache used by every mesh.
+
+    Arguments
+    ---------
+    path:     str, directory to store the cache in, or None to disable it
+    max_size: int, maximum size of the cache in bytes
+    '''
+    global _disk_cache
+    if path is None:
+        _disk_cache = None
+    else:
+        _disk_cache = DiskCache(path, max_size=max_size)
+    return _disk_cache
+
+def get_disk_cache():
+    '''
+    Return the current DiskCache, or None if it is disabled.
+    '''
+    return _disk_cache
+
+if os.environ.get(DISK_CACHE_VARIABLE):
+    set_disk_cache(os.environ[DISK_CACHE_VARIABLE])
@@ -1,6 +1,6 @@
 import numpy as np
 
-from .grouping import group_rows
+from .grouping import row_order
 from .constants import log, log_time
 
 _MIN_BIN_COUNT = 20
@@ -48,10 +48,11 @@ def merge_duplicates(meshes):
     ---------
     merged: (m) list of meshes where (m <= n)
     '''
-    hashes = [i.identifier() for i in meshes]
-    groups = group_rows(hashes, digits=1)
-    merged = [None] * len(groups)
-    for i, group in enumerate(groups):
+    hashes         = [i.identifier() for i in meshes]
+    order, offsets = row_order(hashes, digits=1)
+    merged         = [None] * (len(offsets) - 1)
+    for i, start in enumerate(offsets[:-1]):
+        group     = order[start:offsets[i+1]]
         merged[i] = meshes[group[0]]
         merged[i].metadata['quantity']       = len(group)
         merged[i].metadata['original_index'] = group
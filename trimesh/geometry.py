@@ -222,6 +222,31 @@ def faces_to_edges(faces, sort=True, return_index=False):
         return edges, face_index
     return edges
 
+def triangulate_fan(counts):
+    '''
+    Fan triangulate polygons stored as consecutive corners of a flat array,
+    by connecting the first corner of every polygon with each pair of 
+    consecutive corners after it. Polygons with fewer than three corners 
+    produce no triangles.
+
+    Arguments
+    ---------
+    counts: (n) int, number of corners of each polygon
+
+    Returns
+    ---------
+    corners: (m, 3) int, index in the flat array of each triangle corner
+    polygon: (m) int, index of the polygon each triangle came from
+    '''
+    counts  = np.asanyarray(counts, dtype=np.int64)
+    size    = np.clip(counts - 2, 0, np.inf).astype(np.int64)
+    offset  = np.cumsum(counts) - counts
+    fan     = np.repeat(offset, size)
+    step    = np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size)
+    corners = np.column_stack((fan, fan + step + 1, fan + step + 2))
+    polygon = np.repeat(np.arange(len(counts)), size)
+    return corners, polygon
+
 def nondegenerate_faces(faces):
     '''
     Returns a 1D boolean array where non-degenerate faces are 'True'                        
@@ -4,7 +4,8 @@ from collections import deque
 from copy import deepcopy
 
 from .constants import *
-from .grouping import group, group_rows, replace_references
+from .grouping import group_rows, unique_rows, replace_references
+from .grouping import value_order, group_any, connected_labels
 from .geometry import faces_to_edges, unitize
 
 try: 
@@ -80,13 +81,19 @@ def facets_group(mesh):
     The other two methods for finding facets rely on looking at the angle between
     adjacent faces, and then if they are below TOL_ZERO, adding them to a graph
     of parallel faces. This method should be somewhat more robust.
+
+    Returns
+    ---------
+    order:   (p) int, indexes of mesh.faces, where each facet is contiguous
+    offsets: (g+1) int, index of order where each facet starts, followed by p
     '''
-    adjacency = nx.from_edgelist(mesh.face_adjacency())
-    facets    = deque()
-    for row_group in group_rows(mesh.face_normals):
-        if len(row_group) < 2: continue
-        facets.extend([i for i in nx.connected_components(adjacency.subgraph(row_group)) if len(i) > 1])
-    return np.array(facets)
+    # label every face with the group of identical normals it is in, 
+    # and only keep adjacent faces which are in the same group
+    adjacency  = mesh.face_adjacency()
+    normal_id  = unique_rows(mesh.face_normals, return_inverse=True)[1]
+    parallel   = adjacency[normal_id[adjacency[:,0]] == normal_id[adjacency[:,1]]]
+    components = connected_labels(parallel, len(mesh.faces))
+    return value_order(components, min_length=2)
 
 def facets_nx(mesh):
     '''
@@ -109,7 +116,7 @@ def facets_gt(mesh):
     Facets are defined as groups of faces which are both adjacent and parallel
     
     facets returned reference indices in mesh.faces
-    If return_area is True, both the list of facets and their area are returned. 
+    Facets are returned as two flat arrays, as in facets_group. 
     '''
     face_idx       = mesh.face_adjacency()
     normal_pairs   = mesh.face_normals[[face_idx]]
@@ -118,8 +125,7 @@ def facets_gt(mesh):
     graph_parallel.add_edge_list(face_idx[parallel])
 
     connected  = label_components(graph_parallel, directed=False)[0].a
-    facets_idx = group(connected, min_length=2)
-    return facets_idx
+    return value_order(connected, min_length=2)
 
 def split_nx(mesh, check_watertight=True, only_count=False):
     '''
@@ -154,22 +160,21 @@ def split_gt(mesh, check_watertight=True, only_count=False):
     g = GTGraph()
     g.add_edge_list(mesh.face_adjacency())    
     component_labels = label_components(g, directed=False)[0].a
-    if check_watertight: 
-        degree = g.degree_property_map('total').a
-    meshes     = deque()
-    components = group(component_labels)
-    if only_count: return len(components)
+    order, offsets   = value_order(component_labels)
+    if only_count: return len(offsets) - 1
 
-    for i, current in enumerate(components):
+    if check_watertight: 
+        # check every component at once, rather than one at a time
+        degree     = g.degree_property_map('total').a[order]
+        not_3      = group_any(degree != 3, offsets)
+        not_2_or_3 = group_any(np.logical_and(degree != 3, degree != 2), offsets)
+    meshes = deque()
+    for i in range(len(offsets) - 1):
+        current    = order[offsets[i]:offsets[i+1]]
         fill_holes = False
-        if check_watertight:
-            degree_3 = degree[current] == 3
-            degree_2 = degree[current] == 2
-            if not degree_3.all():
-                if np.logical_or(degree_3, degree_2).all():
-                    fill_holes = True
-                else: 
-                    continue
+        if check_watertight and not_3[i]:
+            if not_2_or_3[i]: continue
+            fill_holes = True
 
         # these faces have the original vertex indices
         faces_original = mesh.faces[current]
@@ -184,6 +189,8 @@ def split_gt(mesh, check_watertight=True, only_count=False):
                                   face_normals = face_normals, 
                                   vertices     = vertices)
         new_meta = deepcopy(mesh.metadata)
+        if mesh.vertex_uv_ok():
+            new_meta['uv'] = mesh.metadata['uv'][unique_vert]
         if 'name' in new_meta:
             new_meta['name'] = new_meta['name'] + '_' + str(i)
         new_mesh.metadata.update(new_meta)
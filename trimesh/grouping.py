@@ -3,15 +3,20 @@ from collections import deque
 
 from .geometry import unitize
 from .constants import *
+from .caching import get_disk_cache, content_key
 
 def merge_vertices_hash(mesh):
     '''
     Removes duplicate vertices, based on integer hashes.
     This is roughly 20x faster than querying a KD tree in a loop
+    Vertices with different texture coordinates are kept separate.
     '''
     pre_merge = len(mesh.vertices)
 
-    unique, inverse = unique_rows(mesh.vertices, return_inverse=True)        
+    rows = mesh.vertices
+    if mesh.vertex_uv_ok():
+        rows = np.column_stack((rows, mesh.metadata['uv']))
+    unique, inverse = unique_rows(rows, return_inverse=True)        
     mesh.update_vertices(unique, inverse)
     log.debug('merge_vertices_hash reduced vertex count from %i to %i.',
               pre_merge,
@@ -21,46 +26,247 @@ def merge_vertices_kdtree(mesh, max_angle=None):
     '''
     Merges vertices which are identical, AKA within 
     Cartesian distance TOL_MERGE of each other.  
-    Then replaces references in mesh.faces
+    Then replaces references in mesh.faces, and replaces the 
+    vertex normals and colors with the mean of the merged vertices.
     
     If max_angle == None, vertex normals won't be looked at. 
     if max_angle has a value, vertices will only be considered identical
     if they are within TOL_MERGE of each other, and the angle between
     their normals is less than angle_max
 
+    Vertices with different texture coordinates are never merged.
+
+    If a disk cache is enabled, the result is stored in it keyed by
+    the vertices (and normals), so the KD tree is only queried once.
+
     Performance note:
     cKDTree requires scipy >= .12 for this query type and you 
     probably don't want to use plain python KDTree as it is crazy slow (~1000x in tests)
     '''
-    from scipy.spatial import cKDTree as KDTree
-    
-    tree    = KDTree(mesh.vertices)
-    used    = np.zeros(len(mesh.vertices), dtype=np.bool)
-    inverse = np.arange(len(mesh.vertices), dtype=np.int)
-    unique  = deque()
-    
     if max_angle != None: mesh.verify_normals()
+    uv = None
+    if mesh.vertex_uv_ok(): uv = mesh.metadata['uv']
 
-    for index, vertex in enumerate(mesh.vertices):
-        if used[index]: continue
-        neighbors = np.array(tree.query_ball_point(mesh.vertices[index], TOL_MERGE))
-        used[[neighbors]] = True
-        if max_angle != None:
-            normals, aligned = group_vectors(mesh.vertex_normals[[neighbors]], 
-                                             max_angle = max_angle)
-            for group in aligned:
-                inverse[neighbors[[group]]] = len(unique)
-                unique.append(neighbors[group[0]])
-        else:
-            inverse[neighbors] = neighbors[0]
-            unique.append(neighbors[0])
+    disk = get_disk_cache()
+    if disk is not None:
+        arrays = [mesh.vertices]
+        if max_angle != None: 
+            arrays.append(mesh.vertex_normals)
+        if uv is not None:
+            arrays.append(uv)
+        key = content_key(*arrays, 
+                          max_angle = max_angle, 
+                          tol_merge = TOL_MERGE,
+                          clusters  = 'seeded')
+        stored = disk.get('merge_kdtree', key)[0]
+        if stored is not None:
+            update_merged(mesh, 
+                          np.array(stored['unique']), 
+                          np.array(stored['inverse']))
+            return
 
-    mesh.update_vertices(unique, inverse)
-   
+    normals = None
+    if max_angle != None: normals = mesh.vertex_normals
+    unique, inverse = weld_vertices(mesh.vertices, 
+                                    normals    = normals, 
+                                    max_angle  = max_angle,
+                                    attributes = uv)
+    if disk is not None:
+        disk.set('merge_kdtree', key, {'unique'  : unique, 
+                                       'inverse' : inverse})
+    pre_merge = len(mesh.vertices)
+    update_merged(mesh, unique, inverse)
     log.debug('merge_vertices_kdtree reduced vertex count from %i to %i', 
-              len(used),
+              pre_merge,
               len(unique))
 
+def weld_vertices(vertices, tolerance=TOL_MERGE, normals=None, max_angle=None, attributes=None):
+    '''
+    Find clusters of vertices which are within tolerance of each other,
+    without querying the vertices one at a time. 
+
+    Vertices which are identical to TOL_MERGE are merged first with 
+    unique_rows, then every pair of the remaining vertices closer than 
+    tolerance is found with a single KD tree query, and the clusters are 
+    the connected components of those pairs. Clusters are transitive: 
+    a chain of vertices each within tolerance of the next is one vertex.
+
+    With max_angle, a chain of normals which each turn slightly would 
+    join vertices with very different normals, for example across a 
+    finely tessellated fillet. So every cluster is also bounded by the
+    angle to its seed, the vertex in it with the lowest index: vertices
+    further than max_angle from the seed are split off and clustered 
+    again among themselves.
+
+    Arguments
+    ---------
+    vertices:  (n,3) float
+    tolerance: float, distance below which vertices are merged, 
+               which should not be smaller than TOL_MERGE
+    normals:   (n,3) float, vertex normals, only used with max_angle
+    max_angle: float, radians. If defined, only vertices whose normals 
+               are less than max_angle apart are merged
+    attributes: (n,d) values, eg: texture coordinates, which must be 
+                identical for vertices to be merged
+
+    Returns
+    ---------
+    unique:  (p) int, indexes of vertices to keep, the first of each cluster
+    inverse: (n) int, index of unique for every vertex
+    '''
+    from scipy.spatial import cKDTree as KDTree
+
+    vertices = np.asanyarray(vertices, dtype=np.float64).reshape((-1,3))
+    if len(vertices) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    check_angle = max_angle is not None and normals is not None
+    if check_angle:
+        normals  = np.asanyarray(normals, dtype=np.float64).reshape((-1,3))
+        distinct = np.column_stack((vertices, normals))
+    else:
+        distinct = vertices
+    if attributes is not None:
+        attributes = np.asanyarray(attributes).reshape((len(vertices), -1))
+        distinct   = np.column_stack((distinct, attributes))
+    exact, exact_inverse = unique_rows(distinct, return_inverse=True)
+
+    tree  = KDTree(vertices[exact])
+    try: 
+        pairs = tree.query_pairs(tolerance, output_type='ndarray')
+    except TypeError:
+        # scipy < 1.0 only returns a set of tuples
+        pairs = np.array(list(tree.query_pairs(tolerance)), dtype=np.int64)
+    pairs = pairs.reshape((-1,2))
+    if attributes is not None and len(pairs) > 0:
+        kept  = attributes[exact]
+        pairs = pairs[(kept[pairs[:,0]] == kept[pairs[:,1]]).all(axis=1)]
+    if check_angle and len(pairs) > 0:
+        unit    = unitize(normals[exact])
+        cosines = (unit[pairs[:,0]] * unit[pairs[:,1]]).sum(axis=1)
+        pairs   = pairs[cosines > np.cos(max_angle)]
+        labels  = seeded_labels(pairs, unit, max_angle)
+    else:
+        labels  = connected_labels(pairs, len(exact))
+
+    # labels are 0 to the cluster count, so group i is cluster i 
+    order, offsets = value_order(labels)
+    unique         = np.minimum.reduceat(exact[order], offsets[:-1])
+    inverse        = labels[exact_inverse]
+    return unique, inverse
+
+def seeded_labels(pairs, unit, max_angle):
+    '''
+    Label clusters of connected nodes, where every node of a cluster is 
+    within max_angle of the cluster's seed, its lowest indexed node.
+
+    Each pass finds the connected components of the unlabeled nodes, and
+    labels the nodes which are within max_angle of the seed of their 
+    component and still connected to it through such nodes. Every pass 
+    labels at least the seeds, and the rest are clustered again.
+
+    Arguments
+    ---------
+    pairs:     (m,2) int, pairs of connected nodes
+    unit:      (n,3) float, unit normal of every node
+    max_angle: float, radians, largest angle from a seed to a node
+
+    Returns
+    ---------
+    labels: (n) int, cluster of every node, from 0 to the cluster count
+    '''
+    count     = len(unit)
+    labels    = np.zeros(count, dtype=np.int64) - 1
+    remaining = np.ones(count, dtype=bool)
+    while remaining.any():
+        pairs     = pairs[remaining[pairs].all(axis=1)]
+        component = connected_labels(pairs, count)
+        index     = np.nonzero(remaining)[0]
+        # the lowest remaining node of every component
+        seed      = np.zeros(count, dtype=np.int64) + count
+        np.minimum.at(seed, component[index], index)
+        seed      = seed[component]
+
+        within = np.zeros(count, dtype=bool)
+        within[index] = (unit[index] * unit[seed[index]]).sum(axis=1) > np.cos(max_angle)
+        within[seed[index]] = True
+        # nodes are only merged with a seed they are connected to
+        # without passing through a node outside the angle
+        linked = connected_labels(pairs[within[pairs].all(axis=1)], count)
+        accept = index[within[index] & (linked[index] == linked[seed[index]])]
+
+        labels[accept]    = seed[accept]
+        remaining[accept] = False
+    return np.unique(labels, return_inverse=True)[1]
+
+def update_merged(mesh, unique, inverse):
+    '''
+    Update a mesh with merged vertices, where the vertex normals and 
+    colors of each new vertex are the mean of the vertices merged into it.
+
+    Arguments
+    ---------
+    mesh:    Trimesh object
+    unique:  (p) int, indexes of mesh.vertices to keep
+    inverse: (n) int, index of unique for every current vertex
+    '''
+    normals = None
+    if np.shape(mesh.vertex_normals) == np.shape(mesh.vertices):
+        normals        = inverse_mean(mesh.vertex_normals, inverse, len(unique))
+        unit, valid    = unitize(normals, check_valid=True)
+        normals[valid] = unit
+        # merged vertices with opposing normals have no mean normal
+        normals[~valid] = mesh.vertex_normals[unique[~valid]]
+    colors = None
+    if mesh.vertex_colors_ok():
+        mean   = inverse_mean(mesh.vertex_colors, inverse, len(unique))
+        colors = np.round(mean).astype(mesh.vertex_colors.dtype)
+
+    mesh.update_vertices(unique, inverse)
+    if normals is not None: mesh.vertex_normals = normals
+    if colors  is not None: mesh.vertex_colors  = colors
+
+def inverse_mean(values, inverse, count):
+    '''
+    Average the rows of values which have the same index in inverse.
+
+    Arguments
+    ---------
+    values:  (n,d) array
+    inverse: (n) int, index of the result every row is averaged into
+    count:   int, number of rows of the result
+
+    Returns
+    ---------
+    mean: (count, d) float, mean of the rows of values for each index
+    '''
+    values = np.asanyarray(values, dtype=np.float64).reshape((len(inverse), -1))
+    sums   = np.column_stack([np.bincount(inverse, 
+                                          weights   = column, 
+                                          minlength = count) for column in values.T])
+    return sums / np.bincount(inverse, minlength=count).reshape((-1,1))
+
+def connected_labels(edges, count):
+    '''
+    Label the connected components of a graph, with scipy's sparse 
+    graph routines rather than building a networkx graph.
+
+    Arguments
+    ---------
+    edges: (n,2) int, pairs of connected nodes
+    count: int, number of nodes
+
+    Returns
+    ---------
+    labels: (count) int, component of every node, from 0 to the component count
+    '''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    edges  = np.asanyarray(edges, dtype=np.int64).reshape((-1,2))
+    matrix = coo_matrix((np.ones(len(edges), dtype=bool), 
+                         (edges[:,0], edges[:,1])),
+                        shape = (count, count))
+    return connected_components(matrix, directed=False)[1]
+
 def replace_references(data, reference_dict):
     '''
     Replace elements in an array as per a dictionary of replacement values. 
@@ -93,17 +299,151 @@ def group(values, min_length=0, max_length=np.inf):
     ----------
     groups: sequence of indices to form groups
             IE [0,1,0,1] returns [[0,2], [1,3]]
+            value_order returns the same groups as two flat arrays.
+    '''
+    return group_split(*value_order(values, 
+                                    min_length = min_length, 
+                                    max_length = max_length))
+
+def value_order(values, min_length=0, max_length=np.inf):
     '''
-    order     = values.argsort()
-    values    = values[order]
-    dupe      = np.greater(np.abs(np.diff(values)), TOL_ZERO)
-    dupe_idx  = np.append(0, np.nonzero(dupe)[0] + 1)
-    dupe_len  = np.diff(np.hstack((dupe_idx, len(values)))) 
-    dupe_ok   = np.logical_and(np.greater_equal(dupe_len, min_length),
-                               np.less_equal(   dupe_len, max_length))
-    groups    = [order[i:(i+j)] for i, j in zip(dupe_idx[dupe_ok], dupe_len[dupe_ok])]
-    return groups
+    Group values which are identical to within TOL_ZERO, as two flat arrays
+    rather than a sequence of index arrays. 
     
+    Arguments
+    ----------
+    values:     (n) array 
+    min_length: int, the shortest group allowed
+    max_length: int, the longest group allowed
+
+    Returns
+    ----------
+    order:   (p) int, indexes of values, where each group is contiguous
+    offsets: (g+1) int, index of order where each group starts, followed by p
+             So group i is order[offsets[i]:offsets[i+1]]
+    '''
+    values  = np.asanyarray(values).reshape(-1)
+    order   = values.argsort()
+    change  = np.greater(np.abs(np.diff(values[order])), TOL_ZERO)
+    offsets = np.append(np.nonzero(np.append(True, change))[0], len(order))
+    if len(order) == 0:
+        offsets = offsets[-1:]
+    return filter_groups(order, offsets, min_length, max_length)
+
+def filter_groups(order, offsets, min_length=0, max_length=np.inf):
+    '''
+    Remove groups with a length outside of a range from a flat grouping.
+
+    Arguments
+    ----------
+    order:      (n) int, grouped indexes
+    offsets:    (g+1) int, index of order where each group starts, followed by n
+    min_length: int, the shortest group allowed
+    max_length: int, the longest group allowed
+
+    Returns
+    ----------
+    order:   (p) int, indexes in the groups which were kept
+    offsets: (h+1) int, where each kept group starts in order, followed by p
+    '''
+    lengths = np.diff(offsets)
+    ok      = np.logical_and(np.greater_equal(lengths, min_length),
+                             np.less_equal(   lengths, max_length))
+    if ok.all(): 
+        return order, offsets
+    order   = order[np.repeat(ok, lengths)]
+    offsets = np.append(0, np.cumsum(lengths[ok]))
+    return order, offsets
+
+def group_labels(offsets):
+    '''
+    Given the offsets of a flat grouping, return which group every 
+    position of order is in: offsets [0,2,3] returns [0,0,1]
+    '''
+    lengths = np.diff(offsets)
+    return np.repeat(np.arange(len(lengths)), lengths)
+
+def group_split(order, offsets):
+    '''
+    Split a flat grouping into a sequence of index arrays, for 
+    code which needs groups as separate arrays. 
+    '''
+    if len(offsets) < 2:
+        return []
+    return np.split(order, offsets[1:-1])
+
+def group_sum(values, offsets):
+    '''
+    Sum the values of every group of a flat grouping.
+
+    Arguments
+    ----------
+    values:  (n, ...) values in grouped order, eg: data[order]
+    offsets: (g+1) int, index of values where each group starts, followed by n
+             Every group must contain at least one value.
+
+    Returns
+    ----------
+    sums: (g, ...) sum of the values in each group
+    '''
+    values = np.asanyarray(values)
+    return np.add.reduceat(values, offsets[:-1], axis=0)
+
+def group_mean(values, offsets):
+    '''
+    Average the values of every group of a flat grouping.
+
+    Arguments
+    ----------
+    values:  (n, ...) values in grouped order, eg: data[order]
+    offsets: (g+1) int, index of values where each group starts, followed by n
+
+    Returns
+    ----------
+    means: (g, ...) mean of the values in each group
+    '''
+    lengths = np.diff(offsets).reshape((-1,) + (1,)*(np.ndim(values)-1))
+    return group_sum(values, offsets) / lengths.astype(np.float64)
+
+def group_any(values, offsets):
+    '''
+    Check whether any value of every group of a flat grouping is True.
+
+    Arguments
+    ----------
+    values:  (n) bool, in grouped order, eg: data[order]
+    offsets: (g+1) int, index of values where each group starts, followed by n
+
+    Returns
+    ----------
+    any: (g) bool, True if any value in the group is True
+    '''
+    values = np.asanyarray(values, dtype=bool)
+    return np.logical_or.reduceat(values, offsets[:-1], axis=0)
+    
+def quantize_rows(data, digits=None):
+    '''
+    Convert an array to integers, based on the precision given by digits.
+
+    Arguments
+    ---------
+    data:    (n,m) or (n) input array
+    digits:  how many digits to keep, if data is floating point
+             If none, TOL_MERGE will be turned into a digit count and used. 
+
+    Returns
+    ---------
+    as_int:  (n,m) int64 array
+    '''
+    data = np.asanyarray(data)
+    if data.ndim == 1: data = data.reshape((-1,1))
+    if digits == None: digits = abs(int(np.log10(TOL_MERGE)))
+
+    if data.dtype.kind in 'ibu':
+        #if data is an integer or boolean, don't bother multiplying by precision
+        return data.astype(np.int64)
+    return ((data+10**-(digits+1))*10**digits).astype(np.int64)
+
 def hashable_rows(data, digits=None):
     '''
     We turn our array into integers, based on the precision 
@@ -120,31 +460,131 @@ def hashable_rows(data, digits=None):
     hashable:  (n) length array of custom data which can be sorted 
                 or used as hash keys
     '''
-    data = np.array(data)   
-    if digits == None: digits = abs(int(np.log10(TOL_MERGE)))
-     
-    if data.dtype.kind in 'ib':
-        #if data is an integer or boolean, don't bother multiplying by precision
-        as_int = data
-    else:
-        as_int = ((data+10**-(digits+1))*10**digits).astype(np.int64)    
+    as_int   = quantize_rows(data, digits=digits)
     hashable = np.ascontiguousarray(as_int).view(np.dtype((np.void, 
                                                          as_int.dtype.itemsize * as_int.shape[1]))).reshape(-1)
     return hashable
-    
-def unique_rows(data, return_inverse=False, digits=None):
+
+def row_keys(data, digits=None):
+    '''
+    Reduce every row of an array to a single integer, so that rows can
+    be compared with one integer sort rather than sorting byte strings. 
+
+    Rows are quantized as in hashable_rows. If the range of the columns 
+    fits in 63 bits the columns are packed into one int64 and the keys 
+    are exact, otherwise the keys are a 64 bit hash of the row.
+
+    Arguments
+    ---------
+    data:    (n,m) input array
+    digits:  how many digits to keep, if data is floating point
+
+    Returns
+    ---------
+    keys:    (n) int64 or uint64, equal for identical rows
+    as_int:  (n,m) int64, quantized rows
+    exact:   bool, if False different rows may have the same key
+    '''
+    as_int = quantize_rows(data, digits=digits)
+    if len(as_int) == 0:
+        return np.zeros(0, dtype=np.int64), as_int, True
+
+    low  = as_int.min(axis=0)
+    bits = [int(i).bit_length() for i in as_int.max(axis=0) - low]
+    if sum(bits) <= 63:
+        keys  = np.zeros(len(as_int), dtype=np.int64)
+        shift = 0
+        for column, size in enumerate(bits):
+            keys  |= (as_int[:,column] - low[column]) << shift
+            shift += size
+        return keys, as_int, True
+
+    # multiply and xor shift every column into the key, with uint64
+    # scalars so numpy wraps on overflow rather than casting to float
+    keys = np.zeros(len(as_int), dtype=np.uint64)
+    for column in as_int.T:
+        keys ^= column.astype(np.uint64)
+        keys *= _HASH_MULTIPLIER
+        keys ^= keys >> _HASH_SHIFT
+    return keys, as_int, False
+
+# constants for the row hash: the 64 bit golden ratio, and a shift
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_HASH_SHIFT      = np.uint64(29)
+
+def row_order(data, digits=None, min_length=0, max_length=np.inf):
+    '''
+    Find an order of the rows of an array which places identical rows
+    next to each other, through a single integer sort of row_keys. 
+
+    If the keys are hashes, rows with the same key are checked and 
+    if any differ they are sorted exactly by every column instead.
+
+    Arguments
+    ---------
+    data:       (n,m) input array
+    digits:     how many digits to keep, if data is floating point
+    min_length: int, the fewest identical rows a group can have
+    max_length: int, the most identical rows a group can have
+
+    Returns
+    ---------
+    order:   (p) int, indexes of data, where identical rows are adjacent
+    offsets: (g+1) int, index of order where each group of 
+             identical rows starts, followed by p
+             So group i is order[offsets[i]:offsets[i+1]]
+    '''
+    keys, as_int, exact = row_keys(data, digits=digits)
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64)
+
+    # a stable sort would be slower, and groups are not required to be in order
+    order  = np.argsort(keys)
+    ranked = keys[order]
+    change = ranked[1:] != ranked[:-1]
+    if not exact:
+        # only rows with the same key as the next row need to be compared
+        same = np.nonzero(~change)[0]
+        if (as_int[order[same]] != as_int[order[same+1]]).any():
+            log.debug('Row hash collision, sorting rows by every column')
+            order  = np.lexsort(as_int.T[::-1])
+            ranked = as_int[order]
+            change = (ranked[1:] != ranked[:-1]).any(axis=1)
+    offsets = np.append(np.nonzero(np.append(True, change))[0], len(order))
+    return filter_groups(order, offsets, min_length, max_length)
+
+def unique_rows(data, return_inverse=False, digits=None, return_counts=False):
     '''
     Returns indices of unique rows. It will return the 
     first occurrence of a row that is duplicated:
     [[1,2], [3,4], [1,2]] will return [0,1]
+
+    Arguments
+    ---------
+    data:           (n,m) input array
+    return_inverse: bool, also return the index of unique for every row
+    digits:         how many digits to keep, if data is floating point
+    return_counts:  bool, also return the number of times each unique row occurs
+
+    Returns
+    ---------
+    unique:  (p) int, indexes of data
+    inverse: (n) int, index of unique for every row of data, if requested
+    counts:  (p) int, number of occurrences of every unique row, if requested
     '''
-    hashes                   = hashable_rows(data, digits=digits)
-    garbage, unique, inverse = np.unique(hashes, 
-                                         return_index   = True, 
-                                         return_inverse = True)
-    if return_inverse: 
-        return unique, inverse
-    return unique
+    order, offsets = row_order(data, digits=digits)
+    unique         = np.minimum.reduceat(order, offsets[:-1])
+    counts         = np.diff(offsets)
+    result         = [unique]
+    if return_inverse:
+        inverse        = np.empty(len(order), dtype=np.int64)
+        inverse[order] = np.repeat(np.arange(len(unique)), counts)
+        result.append(inverse)
+    if return_counts:
+        result.append(counts)
+    if len(result) == 1:
+        return unique
+    return tuple(result)
     
 def group_rows(data, require_count=None, digits=None):
     '''
@@ -159,8 +599,8 @@ def group_rows(data, require_count=None, digits=None):
                    [[1,2], [3,4], [1,2]] will return [[0,2]]
     
                    Note that using require_count allows numpy advanced indexing
-                   to be used in place of looping and checking hashes, and as a
-                   consequence is ~10x faster. 
+                   to be used in place of splitting into a sequence, and as a
+                   consequence is faster. 
                    
     digits:        If data is floating point, how many decimals to look at.
                    If this is None, the value in TOL_MERGE will be turned into a 
@@ -171,48 +611,19 @@ def group_rows(data, require_count=None, digits=None):
     groups:        List or sequence of indices from data indicating identical rows.
                    If require_count != None, shape will be (j, require_count)
                    If require_count == None, shape will be irregular (AKA a sequence)
+                   row_order returns irregular groups as two flat arrays.
     '''
-    
-    def group_dict():
-        '''
-        Simple hash table based grouping. 
-        The loop and appends make this rather slow on very large arrays,
-        But it works on irregular groups nicely, unlike the slicing version of this function
-        '''
-        observed = dict()
-        hashable = hashable_rows(data, digits=digits)
-        for index, key in enumerate(hashable):
-            key_string = key.tostring()
-            if key_string in observed: observed[key_string].append(index)
-            else:                      observed[key_string] = [index]
-        return np.array(list(observed.values()))
-        
-    def group_slice():
-        # create a representation of the rows that can be sorted
-        hashable = hashable_rows(data, digits=digits)
-        # record the order of the rows so we can get the original indices back later
-        order    = np.argsort(hashable)
-        # but for now, we want our hashes sorted
-        hashable = hashable[order]
-        # this is checking each neighbour for equality, example: 
-        # example: hashable = [1, 1, 1]; dupe = [0, 0]
-        dupe     = hashable[1:] != hashable[:-1]
-        # we want the first index of a group, so we can slice from that location
-        # example: hashable = [0 1 1]; dupe = [1,0]; dupe_idx = [0,1]
-        dupe_idx = np.append(0, np.nonzero(dupe)[0] + 1)
-        # if you wanted to use this one function to deal with non- regular groups
-        # you could use: np.array_split(dupe_idx)
-        # this is roughly 3x slower than using the group_dict method above. 
-        start_ok   = np.diff(np.hstack((dupe_idx, len(hashable)))) == require_count
-        groups     = np.tile(dupe_idx[start_ok].reshape((-1,1)), 
-                             require_count) + np.arange(require_count)
-        groups_idx = order[groups]
-        if require_count == 1: 
-            return groups_idx.reshape(-1)
-        return groups_idx
-
-    if require_count == None: return group_dict()
-    else:                     return group_slice()
+    order, offsets = row_order(data, digits=digits)
+    if require_count == None:
+        return group_split(order, offsets)
+
+    start_ok   = np.diff(offsets) == require_count
+    groups     = np.tile(offsets[:-1][start_ok].reshape((-1,1)), 
+                         require_count) + np.arange(require_count)
+    groups_idx = order[groups]
+    if require_count == 1: 
+        return groups_idx.reshape(-1)
+    return groups_idx
 
 def group_vectors(vectors, 
                   max_angle        = np.radians(10), 
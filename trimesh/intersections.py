@@ -3,6 +3,20 @@ import numpy as np
 from .constants import *
 from .geometry import unitize, project_to_plane, faces_to_edges
 
+# points checked for containment at once
+CONTAINS_CHUNK      = 100000
+# triangle edge distance, in barycentric coordinates, under which
+# a ray crossing is ambiguous and the ray is cast again
+CONTAINS_TOL        = 1e-6
+# directions rays are cast in for containment, in order. They are
+# deliberately not axis aligned, as CAD meshes often have faces which
+# are parallel to an axis. 
+CONTAINS_DIRECTIONS = unitize([[0.4395064455, 0.6175986299, 0.6522315667],
+                               [-0.7071067812, 0.1305262369, -0.6948871413],
+                               [0.2588190451, -0.9238795325, 0.2818660232]])
+# point- triangle pairs evaluated at once for winding numbers
+WINDING_CHUNK       = 200000
+
 def mesh_plane_intersection(mesh, 
                             plane_origin  = [0,0,0], 
                             plane_normal  = [0,0,1],
@@ -34,25 +48,136 @@ def mesh_plane_intersection(mesh,
                             plane_normal = plane_normal,
                             plane_origin = plane_origin).reshape((-1,2,2))
 
-def points_in_mesh(points, mesh):
-    from rtree import Rtree
-    points = np.array(points)
-    tri_3D = mesh.vertices[mesh.faces]
-    tri_2D = tri_3D[:,:,0:2]
-    z_bounds = np.column_stack((np.min(tri_3D[:,:,2], axis=1),
-                                np.max(tri_3D[:,:,2], axis=1)))
-    bounds = np.column_stack((np.min(tri_2D, axis=1), 
-                              np.max(tri_2D, axis=1)))
-    tree = Rtree()
-    for i, bound in enumerate(bounds):
-        tree.insert(i, bound)
-
-    result = np.zeros(len(points), dtype=np.bool)
-    for point_index, point in enumerate(points):
-        intersections = np.array(list(tree.intersection(point[0:2].tolist())))
-        in_triangle   = [point_in_triangle_2D(point[0:2], tri_2D[i]) for i in intersections]
-        result[point_index] = np.int(np.mod(np.sum(in_triangle), 2)) == 0
-    return result
+def points_in_mesh(points, mesh, mode='parity'):
+    '''
+    Check whether points are inside a watertight mesh.
+
+    In 'parity' mode a ray is cast from every point, using the cached 
+    BVH of the mesh ray intersector, and the triangles it crosses are 
+    counted. An odd number of crossings means the point is inside. 
+    A ray which passes within CONTAINS_TOL (in barycentric coordinates) 
+    of a triangle edge or vertex may be counted once, twice or not at all, 
+    and a ray which starts within CONTAINS_TOL of a triangle may or may
+    not cross it, so those points are cast again in the next of 
+    CONTAINS_DIRECTIONS. Any point which is still ambiguous after every 
+    direction (for example a point on the surface, which is ambiguous in 
+    every direction) is classified by its winding number.
+
+    In 'winding' mode the generalized winding number of every point is 
+    computed against every triangle, which is robust to any ray 
+    degeneracy but costs O(points * faces) with no acceleration
+    structure, so it is only practical for small meshes or few points.
+
+    Arguments
+    ---------
+    points: (n, 3) float, points in space
+    mesh:   Trimesh object
+    mode:   str, 'parity' or 'winding'
+
+    Returns
+    ---------
+    contained: (n) bool, whether each point is inside the mesh
+    '''
+    points = np.asanyarray(points, dtype=np.float64).reshape((-1,3))
+    if mode == 'winding':
+        return winding_number(points, mesh.ray.triangles) > .5
+    elif mode != 'parity':
+        raise NameError('Containment mode must be parity or winding, not ' + 
+                        str(mode))
+
+    contained = np.zeros(len(points), dtype=bool)
+    for start in range(0, len(points), CONTAINS_CHUNK):
+        pending = np.arange(start, min(start + CONTAINS_CHUNK, len(points)))
+        for direction in CONTAINS_DIRECTIONS:
+            if len(pending) == 0: break
+            inside, ambiguous  = _ray_parity(points[pending], mesh, direction)
+            contained[pending] = inside
+            pending            = pending[ambiguous]
+        if len(pending) > 0:
+            log.debug('%d points classified by winding number', len(pending))
+            contained[pending] = winding_number(points[pending], 
+                                                mesh.ray.triangles) > .5
+    return contained
+
+def _ray_parity(points, mesh, direction):
+    '''
+    Cast a ray from every point in a single direction, and count 
+    the triangles each ray crosses.
+
+    Arguments
+    ---------
+    points:    (n, 3) float, ray origins
+    mesh:      Trimesh object
+    direction: (3) float, direction of every ray
+
+    Returns
+    ---------
+    inside:    (n) bool, whether the ray crossed an odd number of triangles
+    ambiguous: (n) bool, whether the ray passed close to a triangle edge,
+               or started within CONTAINS_TOL of a triangle
+    '''
+    from .ray.ray_triangle_cpu import ray_triangle_pairs
+
+    directions = np.tile(direction, (len(points), 1))
+    rays       = np.column_stack((points, directions)).reshape((-1,2,3))
+    ray_index, triangle_index = mesh.ray._candidate_pairs(rays)[:2]
+    hit, distance, barycentric = ray_triangle_pairs(triangles      = mesh.ray.triangles,
+                                                    origins        = points,
+                                                    directions     = directions,
+                                                    ray_index      = ray_index,
+                                                    triangle_index = triangle_index)
+    with np.errstate(invalid='ignore'):
+        near_edge = np.logical_and(np.abs(barycentric).min(axis=1) < CONTAINS_TOL,
+                                   barycentric.min(axis=1)         > -CONTAINS_TOL)
+        near_edge &= distance > -CONTAINS_TOL
+        # a ray starting on a triangle may or may not count it as crossed
+        on_surface = np.logical_and(barycentric.min(axis=1) > -CONTAINS_TOL,
+                                    np.abs(distance)        < CONTAINS_TOL)
+        near_edge |= on_surface
+
+    crossings = np.bincount(ray_index[hit],       minlength=len(points))
+    ambiguous = np.bincount(ray_index[near_edge], minlength=len(points)) > 0
+    inside    = np.mod(crossings, 2) == 1
+    return inside, ambiguous
+
+def winding_number(points, triangles):
+    '''
+    Compute the generalized winding number of points with respect to 
+    a set of triangles, as the sum of the solid angles the triangles 
+    subtend at each point divided by 4*pi. For a closed, consistently 
+    wound mesh this is 1.0 inside and 0.0 outside.
+
+    Uses the formula of Van Oosterom and Strackee for solid angles, 
+    evaluated in chunks so memory is bounded. 
+
+    Arguments
+    ---------
+    points:    (n, 3) float, points in space
+    triangles: (m, 3, 3) float, vertices of triangles
+
+    Returns
+    ---------
+    winding: (n) float, winding number of each point
+    '''
+    points    = np.asanyarray(points,    dtype=np.float64).reshape((-1,3))
+    triangles = np.asanyarray(triangles, dtype=np.float64)
+    winding   = np.zeros(len(points))
+    step      = max(1, WINDING_CHUNK // max(len(triangles), 1))
+    for start in range(0, len(points), step):
+        chunk  = slice(start, start + step)
+        # (k, m, 3, 3) vectors from each point to each triangle vertex
+        vector = triangles.reshape((1,-1,3,3)) - points[chunk].reshape((-1,1,1,3))
+        length = np.sum(vector ** 2, axis=3) ** .5
+        a, b, c    = vector[:,:,0], vector[:,:,1], vector[:,:,2]
+        la, lb, lc = length[:,:,0], length[:,:,1], length[:,:,2]
+        numerator   = np.sum(a * np.cross(b, c), axis=2)
+        denominator = ((la * lb * lc) + 
+                       (np.sum(a * b, axis=2) * lc) + 
+                       (np.sum(a * c, axis=2) * lb) + 
+                       (np.sum(b * c, axis=2) * la))
+        winding[chunk] = np.arctan2(numerator, denominator).sum(axis=1)
+    winding /= 2.0 * np.pi
+    return winding
 
 def plane_line_intersection(plane_origin, 
                             plane_normal, 
@@ -0,0 +1,207 @@
+'''
+binary.py
+
+A simple container for storing named numpy arrays in a single file.
+
+The layout is a fixed size preamble, a JSON header describing every array,
+and then the raw array data. Every array starts on an ALIGNMENT byte
+boundary, so the arrays can be memory- mapped directly from disk.
+
+    magic:   8 bytes,   ARRAY_MAGIC
+    version: uint32,    ARRAY_VERSION
+    length:  uint32,    length of JSON header in bytes
+    header:  JSON,      {'metadata': {}, 'arrays': {name: {dtype, shape, offset}}}
+    data:    raw array data, little endian, C order
+'''
+import numpy as np
+import struct
+import json
+import tempfile
+import os
+
+ARRAY_MAGIC   = b'TRIMESHA'
+ARRAY_VERSION = 1
+ALIGNMENT     = 64
+
+# directory backed by memory rather than disk, on systems that have one
+SHARED_DIRECTORY = '/dev/shm'
+
+_PREAMBLE      = '<8sII'
+_PREAMBLE_SIZE = struct.calcsize(_PREAMBLE)
+
+def _aligned(position):
+    '''
+    Return the first position >= position which is on an ALIGNMENT boundary
+    '''
+    return int(np.ceil(float(position) / ALIGNMENT) * ALIGNMENT)
+
+def _little_endian(array):
+    '''
+    Return a C- contiguous, little endian version of an array
+    '''
+    array = np.ascontiguousarray(array)
+    dtype = array.dtype.newbyteorder('<')
+    if dtype != array.dtype:
+        array = array.astype(dtype)
+    return array
+
+def shared_directory():
+    '''
+    Return SHARED_DIRECTORY if it exists on this system, otherwise None,
+    which tempfile interprets as the default temporary directory.
+    '''
+    if os.path.isdir(SHARED_DIRECTORY):
+        return SHARED_DIRECTORY
+    return None
+
+def shared_file(suffix='', directory=None):
+    '''
+    Create a temporary file for passing arrays between processes,
+    in SHARED_DIRECTORY if it exists so the data never touches disk.
+    The caller is responsible for removing the file.
+
+    Arguments
+    ---------
+    suffix:    str, appended to the file name
+    directory: str, directory to create file in, 
+               if None shared_directory() is used
+
+    Returns
+    ---------
+    file_obj:  file object, open for binary writing
+    file_name: str, location of file
+    '''
+    if directory is None:
+        directory = shared_directory()
+    handle, file_name = tempfile.mkstemp(suffix = suffix,
+                                         dir    = directory)
+    return os.fdopen(handle, 'wb'), file_name
+
+def write_arrays(file_obj, arrays, metadata=None):
+    '''
+    Write a dict of numpy arrays to a file object.
+
+    Arguments
+    ---------
+    file_obj: open file object, in binary write mode
+    arrays:   dict, {str: numpy array}
+    metadata: dict, JSON serializable values to store in the header
+
+    Returns
+    ---------
+    written:  int, number of bytes written
+    '''
+    if metadata is None:
+        metadata = dict()
+    names  = sorted(arrays.keys())
+    arrays = dict((name, _little_endian(arrays[name])) for name in names)
+
+    # the header length depends on the offsets, which depend on the header
+    # length, so we iterate until the header stops changing size
+    header_length = 0
+    while True:
+        position    = _aligned(_PREAMBLE_SIZE + header_length)
+        description = dict()
+        for name in names:
+            description[name] = {'dtype'  : arrays[name].dtype.str,
+                                 'shape'  : list(arrays[name].shape),
+                                 'offset' : position}
+            position = _aligned(position + arrays[name].nbytes)
+        header = json.dumps({'metadata' : metadata,
+                             'arrays'   : description}).encode('utf-8')
+        if len(header) == header_length: break
+        header_length = len(header)
+
+    written = 0
+    file_obj.write(struct.pack(_PREAMBLE,
+                               ARRAY_MAGIC,
+                               ARRAY_VERSION,
+                               len(header)))
+    file_obj.write(header)
+    written += _PREAMBLE_SIZE + len(header)
+    for name in names:
+        padding  = description[name]['offset'] - written
+        file_obj.write(b'\x00' * padding)
+        file_obj.write(arrays[name].tobytes())
+        written += padding + arrays[name].nbytes
+    return written
+
+def read_header(file_obj):
+    '''
+    Read the header of an array container from a file object, leaving
+    the file object positioned after the header.
+
+    Arguments
+    ---------
+    file_obj: open file object, in binary read mode
+
+    Returns
+    ---------
+    header: dict, with keys 'metadata' and 'arrays'
+    start:  int, position of the beginning of the container in file_obj
+    '''
+    start    = file_obj.tell()
+    preamble = file_obj.read(_PREAMBLE_SIZE)
+    if len(preamble) != _PREAMBLE_SIZE:
+        raise NameError('File too short to be an array container!')
+    magic, version, length = struct.unpack(_PREAMBLE, preamble)
+    if magic != ARRAY_MAGIC:
+        raise NameError('Not an array container! Magic was ' + repr(magic))
+    if version > ARRAY_VERSION:
+        raise NameError('Array container version %d is newer than supported (%d)!' %
+                        (version, ARRAY_VERSION))
+    header = json.loads(file_obj.read(length).decode('utf-8'))
+    return header, start
+
+def read_arrays(file_obj, mmap=True, mode='r'):
+    '''
+    Read a dict of numpy arrays written by write_arrays.
+
+    Arguments
+    ---------
+    file_obj: open file object, or a file name
+    mmap:     bool, if True and file_obj is on disk, arrays are
+              memory maps rather than being read into memory.
+    mode:     str, np.memmap mode: 'r' for read-only arrays, or 'c' for 
+              copy- on- write arrays, which can be changed in memory 
+              without altering the file
+
+    Returns
+    ---------
+    arrays:   dict, {str: numpy array}
+    metadata: dict, as passed to write_arrays
+    '''
+    if not hasattr(file_obj, 'read'):
+        with open(file_obj, 'rb') as opened:
+            return read_arrays(opened, mmap=mmap, mode=mode)
+
+    header, start = read_header(file_obj)
+    # array offsets are relative to the start of the container
+    position      = file_obj.tell() - start
+    file_name     = getattr(file_obj, 'name', None)
+    can_map       = (mmap and
+                     isinstance(file_name, str) and
+                     os.path.isfile(file_name))
+    if not can_map:
+        data = file_obj.read()
+
+    arrays = dict()
+    for name, description in header['arrays'].items():
+        dtype  = np.dtype(str(description['dtype']))
+        shape  = tuple(description['shape'])
+        offset = description['offset']
+        count  = int(np.prod(shape))
+        if count == 0:
+            arrays[name] = np.zeros(shape, dtype=dtype)
+        elif can_map:
+            arrays[name] = np.memmap(file_name,
+                                     dtype  = dtype,
+                                     mode   = mode,
+                                     offset = start + offset,
+                                     shape  = shape)
+        else:
+            arrays[name] = np.frombuffer(data,
+                                         dtype  = dtype,
+                                         count  = count,
+                                         offset = offset - position).reshape(shape)
+    return arrays, header['metadata']
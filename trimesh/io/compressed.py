@@ -0,0 +1,166 @@
+'''
+compressed.py
+
+Read compressed files and archives into memory, so the loaders of the
+files inside them get a seekable buffer rather than a stream.
+
+Compressed files are named for what they contain, eg: part.stl.gz holds
+an STL file, and archives hold any number of files named by extension.
+'''
+import zipfile
+import zlib
+import bz2
+import os
+
+from io import BytesIO
+
+from ..constants import *
+
+# bytes of a compressed stream read at once
+DECOMPRESS_CHUNK = 2 ** 20
+
+def _gzip_decompressor():
+    # 16 + MAX_WBITS tells zlib to expect a gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+# compressed file types, and functions which create a streaming decompressor
+_decompressors = {'gz'  : _gzip_decompressor,
+                  'bz2' : bz2.BZ2Decompressor}
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+if lzma is not None:
+    _decompressors['xz'] = lzma.LZMADecompressor
+else:
+    log.debug('No lzma, xz compressed files not available!')
+
+# file types which are archives of other files
+ARCHIVE_TYPES = ['zip']
+
+def compressed_types():
+    '''
+    Return the file types which are compressed files or archives
+    '''
+    return list(_decompressors.keys()) + ARCHIVE_TYPES
+
+def split_type(file_type):
+    '''
+    Split a file type into its compression and the type it contains.
+
+    Arguments
+    ---------
+    file_type: str, eg: 'stl', 'stl.gz' or 'zip'
+
+    Returns
+    ---------
+    compression: str, eg: 'gz', or None if file_type isn't compressed
+    contained:   str, eg: 'stl', or None if it isn't known
+    '''
+    file_type = str(file_type).lower()
+    parts     = file_type.split('.')
+    if parts[-1] not in compressed_types():
+        return None, file_type
+    contained = '.'.join(parts[:-1])
+    if len(contained) == 0:
+        contained = None
+    return parts[-1], contained
+
+def file_type_of(file_name):
+    '''
+    Find the file type of a file name from its extension, including
+    the extension before a compression extension: 'part.stl.gz' is 'stl.gz'.
+    Only the last component of a path is used, so directories may contain dots.
+    '''
+    parts = os.path.basename(str(file_name)).lower().split('.')
+    if len(parts) > 2 and parts[-1] in _decompressors:
+        return '.'.join(parts[-2:])
+    return parts[-1]
+
+def decompress(file_obj, file_type, accept=None):
+    '''
+    Decompress a compressed file or the members of an archive into memory.
+
+    Members are decompressed one at a time as they are iterated, and
+    streams are decompressed DECOMPRESS_CHUNK bytes at a time, so only
+    the decompressed data is ever held in memory. The decompressed size
+    is checked against the size recorded in the archive.
+
+    Arguments
+    ---------
+    file_obj:  open file object, in binary read mode
+    file_type: str, eg: 'stl.gz' or 'zip'
+    accept:    function, accept(file_type) returns False for archive
+               members which should be skipped without decompressing them
+
+    Returns
+    ---------
+    generator of (file_type, buffer), the type of each file contained,
+    and a BytesIO positioned at the start of its decompressed data
+    '''
+    compression, contained = split_type(file_type)
+    if compression in _decompressors:
+        if contained is None:
+            raise NameError('Unable to determine the type of file compressed with ' + compression)
+        yield contained, _read_stream(file_obj, _decompressors[compression]())
+        return
+    if compression not in ARCHIVE_TYPES:
+        raise NameError('File type %s is not compressed!' % file_type)
+
+    # archives require seeking, so streams which can't are read into memory
+    try:
+        file_obj.seek(file_obj.tell())
+    except (AttributeError, IOError, OSError):
+        file_obj = BytesIO(file_obj.read())
+
+    archive = zipfile.ZipFile(file_obj)
+    try:
+        for info in archive.infolist():
+            member_type = file_type_of(info.filename)
+            if info.filename.endswith('/'):
+                continue
+            if accept is not None and not accept(member_type):
+                log.debug('Skipping archive member %s', info.filename)
+                continue
+            member = archive.open(info)
+            try:
+                buffer = _read_stream(member, size=info.file_size)
+            finally:
+                member.close()
+            yield member_type, buffer
+    finally:
+        archive.close()
+
+def _read_stream(file_obj, decompressor=None, size=None):
+    '''
+    Read a stream into a buffer DECOMPRESS_CHUNK bytes at a time,
+    decompressing it if a decompressor is passed.
+
+    Arguments
+    ---------
+    file_obj:     open file object
+    decompressor: object with a decompress method, eg: zlib.decompressobj
+    size:         int, expected size of the data, checked if passed
+
+    Returns
+    ---------
+    buffer: BytesIO, positioned at the start of the data
+    '''
+    buffer = BytesIO()
+    while True:
+        chunk = file_obj.read(DECOMPRESS_CHUNK)
+        if len(chunk) == 0:
+            break
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        buffer.write(chunk)
+    if hasattr(decompressor, 'flush'):
+        buffer.write(decompressor.flush())
+    if size is not None and buffer.tell() != size:
+        raise NameError('Decompressed %d bytes, but archive recorded %d!' %
+                        (buffer.tell(), size))
+    buffer.seek(0)
+    return buffer
@@ -1,9 +1,21 @@
 import numpy as np
-import struct
 import json
-from StringIO import StringIO
+import re
+from io import BytesIO
 
-def export_mesh(mesh, file_obj, file_type=None):
+from .. import triangles
+from ..constants import log
+from ..geometry import unitize
+from .binary import write_arrays
+
+# version of the native format written by export_trimesh
+NATIVE_VERSION  = 1
+# prefix of the names of metadata values which are stored as arrays
+NATIVE_METADATA = 'metadata/'
+# rows of an array formatted as text at once by text exporters
+TEXT_CHUNK      = 2 ** 16
+
+def export_mesh(mesh, file_obj, file_type=None, **kwargs):
     '''
     Export a Trimesh object to a file- like object, or to a filename
 
@@ -11,7 +23,7 @@ def export_mesh(mesh, file_obj, file_type=None):
     ---------
     file_obj: a filename string or a file-like object
     file_type: str representing file type (eg: 'stl')
-    process:   boolean flag, whether to process the mesh on load
+    kwargs:    passed to the exporter, eg: chunk_size for STL
 
     Returns:
     mesh: a single Trimesh object, or a list of Trimesh objects, 
@@ -24,77 +36,350 @@ def export_mesh(mesh, file_obj, file_type=None):
         file_type = (str(file_obj).split('.')[-1]).lower()
         file_obj  = open(file_obj, 'wb')
 
-    export = _mesh_exporters[file_type](mesh, file_obj)
+    export = _mesh_exporters[file_type](mesh, file_obj, **kwargs)
     if not (file_obj is None): 
         file_obj.close()
     return export
 
-def export_stl(mesh, file_obj=None):
+def export_stl(mesh, file_obj=None, chunk_size=None):
     '''
     Saves a Trimesh object as a binary STL file.
+
+    The faces are packed into a structured array matching the 50 byte 
+    binary STL record, rather than packing values one at a time. 
+
+    Arguments
+    ---------
+    mesh:       Trimesh object
+    file_obj:   file object or filename to write to, 
+                if None the file contents are returned
+    chunk_size: int, if specified and file_obj is not None, faces are 
+                packed and written chunk_size at a time so memory stays
+                flat for very large meshes
     '''
-    
-    temp_file = StringIO()
-    if len(np.shape(mesh.face_normals)) != 2: 
-        mesh.generate_normals()
-
-    def write_face(vertices, normal):
-        #vertices: (3,3) array of floats
-        #normal:   (3) array of floats
-        temp_file.write(struct.pack('<3f', *normal))
-        for vertex in vertices: 
-            temp_file.write(struct.pack('<3f', *vertex))
-        temp_file.write(struct.pack('<h', 0))
-    
-    #write a blank header
-    temp_file.write(struct.pack("<80x"))
-    #write the number of faces
-    temp_file.write(struct.pack("@i", len(mesh.faces)))
-    # write the faces
-    # TODO: remove the for loop and do this as a single struct.pack operation
-    # like we do in the loader, as it is way, way faster.
-    for index in range(len(mesh.faces)):
-        write_face(mesh.vertices[[mesh.faces[index]]], 
-                   mesh.face_normals[index])
-    temp_file.seek(0)
-    return _write_export(temp_file.read(), file_obj)
-
-def export_off(mesh, file_obj=None):
-    export = 'OFF\n'
-    export += str(len(mesh.vertices)) + ' ' + str(len(mesh.faces)) + ' 0\n'
-    temp_obj = StringIO()
-    faces_stacked = np.column_stack((np.ones(len(mesh.faces))*3, mesh.faces))
-    np.savetxt(temp_obj, mesh.vertices, fmt='%.14f')
-    np.savetxt(temp_obj, faces_stacked, fmt='%i')
-    temp_obj.seek(0)
-    export += temp_obj.read()
+    # imported here as the stl module imports Trimesh
+    from .stl import _STL_HEADER, _STL_FACE
+
+    header = np.zeros(1, dtype=_STL_HEADER)
+    header['face_count'] = len(mesh.faces)
+
+    def pack_faces(chunk):
+        packed = np.zeros(len(mesh.faces[chunk]), dtype=_STL_FACE)
+        packed['normals']  = _export_normals(mesh, chunk)
+        packed['vertices'] = mesh.vertices[mesh.faces[chunk]]
+        return packed.tobytes()
+
+    if chunk_size is None or file_obj is None:
+        export = header.tobytes() + pack_faces(slice(None))
+        return _write_export(export, file_obj)
+
+    if not hasattr(file_obj, 'write'):
+        # a file opened here is closed here
+        with open(file_obj, 'wb') as out_file:
+            return export_stl(mesh, out_file, chunk_size=chunk_size)
+    file_obj.write(header.tobytes())
+    for start in range(0, len(mesh.faces), int(chunk_size)):
+        file_obj.write(pack_faces(slice(start, start + int(chunk_size))))
+    return True
+
+def _export_normals(mesh, chunk):
+    '''
+    Return the face normals of a slice of faces for export. If the mesh
+    doesn't have valid face normals they are computed from the triangles, 
+    rather than regenerating them on the mesh, so exporting never alters it. 
+    Degenerate faces are exported with a zero normal.
+
+    Arguments
+    ---------
+    mesh:  Trimesh object
+    chunk: slice, of mesh.faces
+
+    Returns
+    ---------
+    normals: (n,3) float, normal of every face in chunk
+    '''
+    if np.shape(mesh.face_normals) == np.shape(mesh.faces):
+        normals = mesh.face_normals[chunk]
+        if unitize(normals, check_valid=True)[1].all():
+            return normals
+    normals, valid = triangles.normals(mesh.vertices[mesh.faces[chunk]])
+    result         = np.zeros((len(valid), 3))
+    result[valid]  = normals
+    return result
+
+def export_trimesh(mesh, file_obj=None):
+    '''
+    Export a mesh in the native binary format: an array container 
+    (see trimesh.io.binary) with the mesh arrays, the mesh metadata,
+    and the names of the processing steps already applied, so that
+    loading the file and processing it again is nearly free. 
+
+    Arguments
+    ---------
+    mesh:     Trimesh object
+    file_obj: file object or filename to write to, 
+              if None the file contents are returned
+    '''
+    arrays = {'vertices'     : mesh.vertices,
+              'faces'        : mesh.faces,
+              'face_normals' : mesh.face_normals}
+    # optional arrays are only stored if they match the mesh
+    if np.shape(mesh.vertex_normals) == np.shape(mesh.vertices):
+        arrays['vertex_normals'] = mesh.vertex_normals
+    if len(np.shape(mesh.face_colors)) == 2 and len(mesh.face_colors) == len(mesh.faces):
+        arrays['face_colors'] = mesh.face_colors
+    if len(np.shape(mesh.vertex_colors)) == 2 and len(mesh.vertex_colors) == len(mesh.vertices):
+        arrays['vertex_colors'] = mesh.vertex_colors
+
+    # array values in metadata are stored as arrays, everything else as JSON
+    metadata = dict()
+    for key, value in mesh.metadata.items():
+        if isinstance(value, np.ndarray):
+            arrays[NATIVE_METADATA + str(key)] = value
+            continue
+        try: 
+            json.dumps(value)
+        except (TypeError, ValueError):
+            log.debug('Not exporting metadata %s, as it is not JSON serializable', key)
+            continue
+        metadata[key] = value
+
+    header = {'type'      : 'Trimesh',
+              'version'   : NATIVE_VERSION,
+              'processed' : mesh._cache.get('processed'),
+              'metadata'  : metadata,
+              'md5'       : {'vertices'     : mesh.vertices.md5(),
+                             'faces'        : mesh.faces.md5(),
+                             'face_normals' : mesh.face_normals.md5()}}
+
+    export = BytesIO()
+    write_arrays(export, arrays, header)
+    return _write_export(export.getvalue(), file_obj)
+
+def export_ply(mesh, file_obj=None, encoding='binary'):
+    '''
+    Export a mesh as a PLY file, including vertex and face colors
+    if the mesh has them.
+
+    Arguments
+    ---------
+    mesh:     Trimesh object
+    file_obj: file object or filename to write to, 
+              if None the file contents are returned
+    encoding: str, 'binary' for binary little endian, or 'ascii'
+    '''
+    if encoding not in ['binary', 'ascii']:
+        raise NameError('PLY encoding must be binary or ascii, not %s' % encoding)
+    colors = ['red', 'green', 'blue']
+
+    # numpy dtype and PLY header of each element, with colors if present
+    vertex = [(i, '<f8') for i in 'xyz']
+    face   = [('count', 'u1'), ('vertex_indices', '<i4', (3,))]
+    header = {'vertex' : ['property double ' + i for i in 'xyz'],
+              'face'   : ['property list uchar int vertex_indices']}
+    vertex_colors = mesh.vertex_colors_ok()
+    face_colors   = np.shape(mesh.face_colors) == np.shape(mesh.faces)
+    for enabled, fields, element in [(vertex_colors, vertex, 'vertex'),
+                                     (face_colors,   face,   'face')]:
+        if enabled:
+            fields.extend([(i, 'u1') for i in colors])
+            header[element].extend(['property uchar ' + i for i in colors])
+
+    vertex = np.zeros(len(mesh.vertices), dtype=vertex)
+    face   = np.zeros(len(mesh.faces),    dtype=face)
+    for column, name in enumerate('xyz'):
+        vertex[name] = mesh.vertices[:,column]
+    face['count']          = 3
+    face['vertex_indices'] = mesh.faces
+    for column, name in enumerate(colors):
+        if vertex_colors:
+            vertex[name] = np.clip(mesh.vertex_colors[:,column], 0, 255)
+        if face_colors:
+            face[name] = np.clip(mesh.face_colors[:,column], 0, 255)
+
+    lines = ['ply', 
+             'format %s 1.0' % {'binary' : 'binary_little_endian', 
+                                'ascii'  : 'ascii'}[encoding],
+             'element vertex %d' % len(vertex)]
+    lines.extend(header['vertex'])
+    lines.append('element face %d' % len(face))
+    lines.extend(header['face'])
+    lines.append('end_header\n')
+
+    export = BytesIO()
+    export.write('\n'.join(lines).encode('ascii'))
+    if encoding == 'binary':
+        export.write(vertex.tobytes())
+        export.write(face.tobytes())
+    else:
+        # structured rows are flattened into columns for savetxt
+        precision = ['%.17g'] * 3 + ['%d'] * (len(vertex.dtype.names) - 3)
+        np.savetxt(export, 
+                   np.column_stack([vertex[i] for i in vertex.dtype.names]),
+                   fmt = precision)
+        np.savetxt(export,
+                   np.column_stack([face['count'], face['vertex_indices']] +
+                                   [face[i] for i in face.dtype.names[2:]]),
+                   fmt = '%d')
+    return _write_export(export.getvalue(), file_obj)
+
+def export_glb(mesh, file_obj=None):
+    '''
+    Export a mesh as GLB, the binary container of glTF 2.0.
+
+    Faces, vertices, vertex normals and vertex colors are each written
+    as a raw little endian buffer with an accessor describing it, so a
+    client can upload them to a GPU without parsing. Faces are stored
+    as uint16 when there are few enough vertices, and uint32 otherwise.
+
+    Arguments
+    ---------
+    mesh:     Trimesh object
+    file_obj: file object or filename to write to, 
+              if None the file contents are returned
+    '''
+    # imported here as the gltf module imports Trimesh
+    from .gltf import (_GLB_HEADER, _GLB_CHUNK, GLB_MAGIC, GLB_VERSION,
+                       GLB_JSON, GLB_BIN, GLTF_DTYPES, GLTF_ARRAY_BUFFER,
+                       GLTF_ELEMENT_BUFFER, GLTF_TRIANGLES)
+    component = dict((np.dtype(v), k) for k, v in GLTF_DTYPES.items())
+
+    mesh.verify_vertex_normals()
+    # the largest value of an index type is reserved by glTF
+    index = '<u4'
+    if len(mesh.vertices) < 2**16 - 1:
+        index = '<u2'
+
+    # (attribute, array, accessor type, bufferView target)
+    arrays = [('indices',  mesh.faces.reshape(-1).astype(index), 
+               'SCALAR', GLTF_ELEMENT_BUFFER),
+              ('POSITION', mesh.vertices.astype('<f4'),       
+               'VEC3',   GLTF_ARRAY_BUFFER),
+              ('NORMAL',   mesh.vertex_normals.astype('<f4'), 
+               'VEC3',   GLTF_ARRAY_BUFFER)]
+    if mesh.vertex_colors_ok():
+        # colors are padded to four bytes, as vertex attributes must be aligned
+        colors = np.column_stack((np.clip(mesh.vertex_colors, 0, 255),
+                                  np.zeros(len(mesh.vertices)) + 255))
+        arrays.append(('COLOR_0', colors.astype('<u1'), 'VEC4', GLTF_ARRAY_BUFFER))
+
+    views      = []
+    accessors  = []
+    attributes = dict()
+    blob       = BytesIO()
+    for name, array, kind, target in arrays:
+        data = array.tobytes()
+        views.append({'buffer'     : 0,
+                      'byteOffset' : blob.tell(),
+                      'byteLength' : len(data),
+                      'target'     : target})
+        blob.write(data)
+        blob.write(b'\0' * (-len(data) % 4))
+
+        accessor = {'bufferView'    : len(views) - 1,
+                    'componentType' : component[array.dtype],
+                    'count'         : len(array),
+                    'type'          : kind}
+        if name == 'POSITION':
+            accessor['min'] = array.min(axis=0).tolist()
+            accessor['max'] = array.max(axis=0).tolist()
+        elif name == 'COLOR_0':
+            accessor['normalized'] = True
+        accessors.append(accessor)
+        attributes[name] = len(accessors) - 1
+
+    primitive = {'attributes' : attributes,
+                 'mode'       : GLTF_TRIANGLES,
+                 'indices'    : attributes.pop('indices')}
+    blob  = blob.getvalue()
+    scene = {'asset'       : {'version'   : '2.0',
+                              'generator' : 'trimesh'},
+             'scene'       : 0,
+             'scenes'      : [{'nodes' : [0]}],
+             'nodes'       : [{'mesh' : 0}],
+             'meshes'      : [{'primitives' : [primitive]}],
+             'buffers'     : [{'byteLength' : len(blob)}],
+             'bufferViews' : views,
+             'accessors'   : accessors}
+    scene  = json.dumps(scene).encode('utf-8')
+    scene += b' ' * (-len(scene) % 4)
+
+    chunks = np.zeros(2, dtype=_GLB_CHUNK)
+    chunks['length'] = [len(scene), len(blob)]
+    chunks['type']   = [GLB_JSON, GLB_BIN]
+    header = np.zeros(1, dtype=_GLB_HEADER)
+    header['magic']   = GLB_MAGIC
+    header['version'] = GLB_VERSION
+    header['length']  = header.itemsize + chunks.nbytes + len(scene) + len(blob)
+
+    export = b''.join([header.tobytes(), 
+                       chunks[0:1].tobytes(), scene, 
+                       chunks[1:2].tobytes(), blob])
     return _write_export(export, file_obj)
 
-def export_collada(mesh, file_obj=None):
+def export_off(mesh, file_obj=None, precision=14):
     '''
-    Export a mesh as collada, to filename
+    Export a mesh as an OFF file.
+
+    The text is formatted and written TEXT_CHUNK rows at a time,
+    so memory stays flat for very large meshes.
+
+    Arguments
+    ---------
+    mesh:      Trimesh object
+    file_obj:  file object or filename to write to, 
+               if None the file contents are returned
+    precision: int, number of decimal places of vertex coordinates
+    '''
+    def chunks():
+        yield ('OFF\n%d %d 0\n' % (len(mesh.vertices), len(mesh.faces))).encode('ascii')
+        for chunk in _format_rows(mesh.vertices, '%.' + str(int(precision)) + 'f'):
+            yield chunk
+        for chunk in _format_rows(mesh.faces, '%d', prefix='3 '):
+            yield chunk
+    return _write_chunks(chunks(), file_obj)
+
+def export_collada(mesh, file_obj=None, precision=5):
+    '''
+    Export a mesh as collada.
+
+    The template is filled in as it is written, with the arrays 
+    formatted and written TEXT_CHUNK rows at a time.
+
+    Arguments
+    ---------
+    mesh:      Trimesh object
+    file_obj:  file object or filename to write to, 
+               if None the file contents are returned
+    precision: int, number of decimal places of vertices and normals
     '''
     import os, inspect
     from string import Template
     
     MODULE_PATH = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-    template    = Template(open(os.path.join(MODULE_PATH, 
-                                             'templates', 
-                                             'collada_template.dae'), 'rb').read())
-
-    # we bother setting this because np.array2string uses these printoptions 
-    np.set_printoptions(threshold=np.inf, precision=5, linewidth=np.inf)
-
-    replacement = dict()
-    replacement['VERTEX']   = np.array2string(mesh.vertices.reshape(-1))[1:-1]
-    replacement['FACES']    = np.array2string(mesh.faces.reshape(-1))[1:-1]
-    replacement['NORMALS']  = np.array2string(mesh.vertex_normals.reshape(-1))[1:-1]
-    replacement['VCOUNT']   = str(len(mesh.vertices))
-    replacement['VCOUNTX3'] = str(len(mesh.vertices) * 3)
-    replacement['FCOUNT']   = str(len(mesh.faces))
-
-    export = template.substitute(replacement)
-    return _write_export(export, file_obj)
+    with open(os.path.join(MODULE_PATH, 'templates', 'collada_template.dae'), 'rb') as template:
+        template = template.read().decode('utf-8')
+
+    mesh.verify_vertex_normals()
+    fmt    = '%.' + str(int(precision)) + 'f'
+    counts = {'VCOUNT'   : str(len(mesh.vertices)),
+              'VCOUNTX3' : str(len(mesh.vertices) * 3),
+              'FCOUNT'   : str(len(mesh.faces))}
+    arrays = {'VERTEX'   : (mesh.vertices,       fmt),
+              'NORMALS'  : (mesh.vertex_normals, fmt),
+              'FACES'    : (mesh.faces,          '%d')}
+
+    # the text between the array placeholders alternates with their names
+    parts = re.split(r'\$(' + '|'.join(arrays.keys()) + r')\b',
+                     Template(template).safe_substitute(counts))
+    def chunks():
+        for index, part in enumerate(parts):
+            if index % 2 == 0:
+                yield part.encode('utf-8')
+                continue
+            for chunk in _format_rows(*arrays[part]):
+                yield chunk
+    return _write_chunks(chunks(), file_obj)
 
 def export_json(mesh, file_obj=None):
     mesh.verify_vertex_normals()
@@ -111,27 +396,68 @@ def export_json(mesh, file_obj=None):
 
     return _write_export(export, file_obj)
         
+def _format_rows(array, fmt, prefix=''):
+    '''
+    Format a 2D array as lines of text, TEXT_CHUNK rows at a time.
+    Each chunk is formatted with a single string operation, 
+    rather than formatting one row at a time.
+
+    Arguments
+    ---------
+    array:  (n, m) array
+    fmt:    str, format of each value, eg: '%.5f'
+    prefix: str, prepended to every line
+
+    Returns
+    ---------
+    generator of bytes, lines of text for each chunk of rows
+    '''
+    array = np.asanyarray(array)
+    line  = prefix + ' '.join([fmt] * array.shape[1]) + '\n'
+    for start in range(0, len(array), TEXT_CHUNK):
+        chunk = array[start:start + TEXT_CHUNK]
+        yield ((line * len(chunk)) % tuple(chunk.reshape(-1).tolist())).encode('ascii')
+
+def _write_chunks(chunks, file_obj=None):
+    '''
+    Write an iterable of strings to a file as they are produced.
+    If file_obj isn't specified, return them joined into one string.
+    A file opened from a filename is closed, even if producing
+    the chunks raises partway through.
+
+    Arguments
+    ---------
+    chunks:   iterable of bytes
+    file_obj: a file-like object or a filename
+    '''
+    if file_obj is None:
+        return b''.join(chunks)
+    elif not hasattr(file_obj, 'write'):
+        with open(file_obj, 'wb') as out_file:
+            return _write_chunks(chunks, out_file)
+    for chunk in chunks:
+        file_obj.write(chunk)
+    return True
+
 def _write_export(export, file_obj=None):
     '''
     Write a string to a file.
-    If file_obj isn't specified, return the string
+    If file_obj isn't specified, return the string.
+    A file opened from a filename is closed once it is written.
 
     Arguments
     ---------
     export: a string of the export data
     file_obj: a file-like object or a filename
     '''
-
-    if file_obj is None:             
+    if file_obj is None:
         return export
-    elif hasattr(file_obj, 'write'): 
-        out_file = file_obj
-    else: 
-        out_file = open(file_obj, 'wb')
-    out_file.write(export)
-    return True
+    return _write_chunks([export], file_obj)
 
-_mesh_exporters = {'stl'  : export_stl,
-                   'json' : export_json,
-                   'dae'  : export_collada,
-                   'off'  : export_off}
+_mesh_exporters = {'stl'     : export_stl,
+                   'json'    : export_json,
+                   'dae'     : export_collada,
+                   'off'     : export_off,
+                   'ply'     : export_ply,
+                   'glb'     : export_glb,
+                   'trimesh' : export_trimesh}
@@ -0,0 +1,164 @@
+'''
+gltf.py
+
+Load meshes stored as GLB, the binary container of glTF 2.0.
+
+A GLB file is a 12 byte header followed by a JSON chunk describing the
+scene and an optional binary chunk holding the raw buffer data. Accessors
+in the JSON point into the binary chunk, so every array is read as a view
+of the chunk without parsing any text.
+'''
+import numpy as np
+import json
+
+from ..base import Trimesh
+from ..constants import *
+
+# magic, version and total length of a GLB file
+_GLB_HEADER = np.dtype([('magic',   '<u4'),
+                        ('version', '<u4'),
+                        ('length',  '<u4')])
+# length and type of each chunk
+_GLB_CHUNK  = np.dtype([('length', '<u4'),
+                        ('type',   '<u4')])
+
+GLB_MAGIC   = 0x46546C67
+GLB_VERSION = 2
+GLB_JSON    = 0x4E4F534A
+GLB_BIN     = 0x004E4942
+
+# glTF accessor component types, and the numpy type they are stored as
+GLTF_DTYPES = {5120 : '<i1',
+               5121 : '<u1',
+               5122 : '<i2',
+               5123 : '<u2',
+               5125 : '<u4',
+               5126 : '<f4'}
+# number of components of each glTF accessor type
+GLTF_SHAPES = {'SCALAR' : 1,
+               'VEC2'   : 2,
+               'VEC3'   : 3,
+               'VEC4'   : 4}
+# bufferView targets, and the triangle list primitive mode
+GLTF_ARRAY_BUFFER   = 34962
+GLTF_ELEMENT_BUFFER = 34963
+GLTF_TRIANGLES      = 4
+
+def load_glb(file_obj, file_type=None):
+    '''
+    Load the triangle primitives of a GLB file.
+
+    Every triangle primitive of every mesh becomes a Trimesh, with vertex
+    normals and vertex colors if present. Node transforms are not applied,
+    and only buffers stored in the binary chunk of the file are supported.
+
+    Arguments
+    ---------
+    file_obj:  open file object
+    file_type: not used
+
+    Returns
+    ---------
+    mesh: Trimesh object, or a list of Trimesh objects if the
+          file contains more than one primitive
+    '''
+    data = file_obj.read()
+    if len(data) < _GLB_HEADER.itemsize:
+        raise NameError('File is too short to be GLB!')
+    header = np.frombuffer(data, dtype=_GLB_HEADER, count=1)[0]
+    if header['magic'] != GLB_MAGIC:
+        raise NameError('File is not GLB!')
+    if header['version'] != GLB_VERSION:
+        raise NameError('GLB version %d is not supported!' % header['version'])
+    if header['length'] > len(data):
+        raise NameError('GLB file is shorter than its header specifies!')
+
+    chunks   = dict()
+    position = _GLB_HEADER.itemsize
+    while position + _GLB_CHUNK.itemsize <= header['length']:
+        chunk     = np.frombuffer(data, dtype=_GLB_CHUNK, count=1, offset=position)[0]
+        position += _GLB_CHUNK.itemsize
+        end       = position + int(chunk['length'])
+        if end > header['length']:
+            raise NameError('GLB chunk is longer than the file!')
+        # only the first chunk of each type is used
+        chunks.setdefault(int(chunk['type']), (position, end))
+        position  = end
+    if GLB_JSON not in chunks:
+        raise NameError('GLB file has no JSON chunk!')
+    scene  = json.loads(data[slice(*chunks[GLB_JSON])].decode('utf-8'))
+    buffer = None
+    if GLB_BIN in chunks:
+        buffer = data[slice(*chunks[GLB_BIN])]
+
+    meshes = []
+    for mesh in scene.get('meshes', []):
+        for primitive in mesh.get('primitives', []):
+            if primitive.get('mode', GLTF_TRIANGLES) != GLTF_TRIANGLES:
+                log.debug('Skipping glTF primitive which is not triangles')
+                continue
+            attributes = primitive['attributes']
+            vertices   = _read_accessor(scene, buffer, attributes['POSITION'])
+            if 'indices' in primitive:
+                faces = _read_accessor(scene, buffer, primitive['indices'])
+            else:
+                faces = np.arange(len(vertices))
+            kwargs = {'vertices' : vertices,
+                      'faces'    : faces.reshape((-1, 3)).astype(np.int64),
+                      'metadata' : dict()}
+            if 'name' in mesh:
+                kwargs['metadata']['name'] = mesh['name']
+            if 'NORMAL' in attributes:
+                kwargs['vertex_normals'] = _read_accessor(scene, buffer, attributes['NORMAL'])
+            if 'COLOR_0' in attributes:
+                colors = _read_accessor(scene, buffer, attributes['COLOR_0'])[:,:3]
+                if colors.dtype.kind == 'f':
+                    colors = np.round(np.clip(colors, 0.0, 1.0) * 255)
+                kwargs['vertex_colors'] = colors.astype(np.uint8)
+            meshes.append(Trimesh(**kwargs))
+
+    if len(meshes) == 1:
+        return meshes[0]
+    return meshes
+
+def _read_accessor(scene, buffer, index):
+    '''
+    Read the array of a glTF accessor from the binary chunk.
+
+    Arguments
+    ---------
+    scene:  dict, glTF JSON
+    buffer: bytes, binary chunk of a GLB file
+    index:  int, index of accessor
+
+    Returns
+    ---------
+    array: (count, components) array, or (count) for scalars.
+           Normalized integer values are left as integers.
+    '''
+    accessor = scene['accessors'][index]
+    if 'bufferView' not in accessor:
+        raise NameError('Sparse or empty glTF accessors are not supported!')
+    view = scene['bufferViews'][accessor['bufferView']]
+    if view.get('buffer', 0) != 0 or 'uri' in scene['buffers'][0] or buffer is None:
+        raise NameError('Only glTF buffers stored in a GLB file are supported!')
+
+    dtype  = np.dtype(GLTF_DTYPES[accessor['componentType']])
+    width  = GLTF_SHAPES[accessor['type']]
+    count  = accessor['count']
+    start  = view.get('byteOffset', 0) + accessor.get('byteOffset', 0)
+    stride = view.get('byteStride', dtype.itemsize * width)
+    if count > 0 and start + stride * (count - 1) + dtype.itemsize * width > len(buffer):
+        raise NameError('glTF accessor is outside of buffer!')
+
+    # interleaved attributes are read as a strided view
+    array = np.ndarray(shape   = (count, width),
+                       dtype   = dtype,
+                       buffer  = buffer,
+                       offset  = start,
+                       strides = (stride, dtype.itemsize))
+    if width == 1:
+        return array.reshape(-1)
+    return array
+
+_gltf_loaders = {'glb' : load_glb}
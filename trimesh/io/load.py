@@ -1,40 +1,64 @@
 import numpy as np
+import multiprocessing
+import threading
+import traceback
+import tempfile
+import hashlib
+import shutil
+import os
 
 from ..constants import log_time, log
 
 from .assimp import _assimp_loaders
-from .stl    import _stl_loaders
-from .misc   import _misc_loaders
+from .stl    import _stl_loaders, probe_stl
+from .misc   import _misc_loaders, probe_off
+from .native import _native_loaders, load_trimesh, probe_trimesh
+from .ply    import _ply_loaders, probe_ply
+from .gltf   import _gltf_loaders
+from .export import export_trimesh
+from .binary import shared_file, shared_directory
+from .compressed import decompress, split_type, file_type_of, compressed_types, ARCHIVE_TYPES
+
+# files each worker may have queued or finished but not yet handed back,
+# which bounds memory when loading from a long iterator of file names
+LOAD_MANY_QUEUE = 4
+# bytes read at once when hashing a file in probe
+PROBE_CHUNK     = 2 ** 22
 
 def available_formats():
-    return _mesh_loaders.keys()
+    return list(_mesh_loaders.keys()) + compressed_types()
 
 @log_time
-def load_mesh(file_obj, file_type=None, process=True):
+def load_mesh(file_obj, file_type=None, process=True, **kwargs):
     '''
     Load a mesh file into a Trimesh object
 
+    Compressed files (eg: 'part.stl.gz') are decompressed into memory 
+    and loaded from there, and every mesh file in an archive (eg: 'zip')
+    is loaded.
+
     Arguments
     ---------
     file_obj: a filename string or a file-like object
-    file_type: str representing file type (eg: 'stl')
+    file_type: str representing file type (eg: 'stl', 'stl.gz', 'zip')
     process:   boolean flag, whether to process the mesh on load
+    kwargs:    passed to the loader, eg: dtype=np.float32 for STL
 
     Returns:
     mesh: a single Trimesh object, or a list of Trimesh objects, 
-          depending on the file format. 
+          depending on the file format. Archives return a list
+          with the meshes of every member.
     
     '''
 
     if not hasattr(file_obj, 'read'):
-        file_type = (str(file_obj).split('.')[-1]).lower()
+        file_type = file_type_of(file_obj)
         file_obj  = open(file_obj, 'rb')
 
-    mesh = _mesh_loaders[file_type](file_obj, file_type)
-    file_obj.close()
-    
-    log.debug('loaded mesh using %s',
-             _mesh_loaders[file_type].__name__)
+    try:
+        mesh = _load(file_obj, file_type, **kwargs)
+    finally:
+        file_obj.close()
 
     if process: 
         # if mesh is multi-body, process all bodies
@@ -42,7 +66,250 @@ def load_mesh(file_obj, file_type=None, process=True):
 
     return mesh
 
+def _load(file_obj, file_type, **kwargs):
+    '''
+    Load a file object with the loader for its file type, 
+    decompressing it first if the file type is compressed.
+    '''
+    compression, contained = split_type(file_type)
+    if compression is None:
+        if contained not in _mesh_loaders:
+            raise NameError('No loader for file type %s!' % contained)
+        mesh = _mesh_loaders[contained](file_obj, contained, **kwargs)
+        log.debug('loaded mesh using %s',
+                  _mesh_loaders[contained].__name__)
+        return mesh
+
+    def accept(member_type):
+        return (member_type in _mesh_loaders or 
+                split_type(member_type)[0] is not None)
+    meshes = []
+    for member_type, buffer in decompress(file_obj, file_type, accept):
+        meshes.append(_load(buffer, member_type, **kwargs))
+    if compression in ARCHIVE_TYPES:
+        # one entry per member, with multi- body members flattened
+        return [i for mesh in meshes for i in np.append(mesh, [])]
+    return meshes[0]
+
+def probe(file_name, file_type=None):
+    '''
+    Find the size, bounds and content hash of a mesh file without 
+    creating a Trimesh where the format allows it. Binary STL files are 
+    streamed through to find their bounds and area, and PLY, OFF and 
+    native files only have their header read. Files in other formats 
+    (and ASCII STL) are loaded, without processing. 
+
+    The file is read once, and hashed as it is read.
+
+    Arguments
+    ---------
+    file_name: str, location of mesh file
+    file_type: str, type of file, if None it is taken from the extension
+
+    Returns
+    ---------
+    info: dict, with keys
+          file_type:    str
+          file_size:    int, size of file in bytes
+          md5:          str, hex digest of the file contents
+          face_count:   int, number of faces (polygons for PLY and OFF), or None
+          vertex_count: int, or None if the format doesn't say
+          bounds:       (2,3) float, or None if not found
+          area:         float, or None if not found
+    '''
+    if file_type is None:
+        file_type = file_type_of(file_name)
+    info = {'file_type'    : file_type,
+            'file_size'    : os.path.getsize(file_name),
+            'face_count'   : None,
+            'vertex_count' : None,
+            'bounds'       : None,
+            'area'         : None}
+
+    with open(file_name, 'rb') as file_obj:
+        reader = _HashReader(file_obj)
+        found  = None
+        if file_type in _mesh_probers:
+            found = _mesh_probers[file_type](reader, info['file_size'])
+        if found is None:
+            # loaders may seek, so start hashing again afterwards
+            file_obj.seek(0)
+            found  = _probe_loaded(_load(file_obj, file_type))
+            file_obj.seek(0)
+            reader = _HashReader(file_obj)
+        info.update(found)
+        info['md5'] = reader.hexdigest()
+    return info
+
+class _HashReader(object):
+    '''
+    Wrap a file object, hashing everything read from it in order.
+    '''
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.md5      = hashlib.md5()
+        self.position = 0
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        self.md5.update(data)
+        self.position += len(data)
+        return data
+
+    def readline(self):
+        data = self.file_obj.readline()
+        self.md5.update(data)
+        self.position += len(data)
+        return data
+
+    def tell(self):
+        return self.position
+
+    def hexdigest(self):
+        '''
+        Hash the rest of the file, and return the hex digest of all of it
+        '''
+        while len(self.read(PROBE_CHUNK)) > 0: pass
+        return self.md5.hexdigest()
+
+def _probe_loaded(meshes):
+    '''
+    Find the values returned by probe from loaded meshes.
+    '''
+    meshes = list(np.append(meshes, []))
+    info   = {'face_count'   : sum(len(i.faces)    for i in meshes),
+              'vertex_count' : sum(len(i.vertices) for i in meshes),
+              'area'         : sum(i.area()        for i in meshes)}
+    if info['vertex_count'] > 0:
+        bounds = np.vstack([i.bounds for i in meshes if len(i.vertices) > 0])
+        info['bounds'] = np.vstack((bounds.min(axis=0), bounds.max(axis=0)))
+    return info
+
+def load_many(file_names, workers=None, **kwargs):
+    '''
+    Load and process many mesh files, in a pool of worker processes.
+
+    Meshes are yielded as soon as each file is done, which is not 
+    necessarily the order of file_names. Workers write every mesh to a 
+    temporary file in the native format which is memory- mapped here, 
+    so large arrays are never pickled. file_names may be an iterator, 
+    and only a bounded number of files are in flight at once.
+
+    Arguments
+    ---------
+    file_names: iterable of file name strings
+    workers:    int, number of worker processes, 
+                if None or 1 files are loaded in this process
+    kwargs:     passed to load_mesh
+
+    Returns
+    ---------
+    generator of (file_name, mesh, error) tuples
+    file_name: str, as passed in file_names
+    mesh:      Trimesh object or list of Trimesh objects, None if the load failed
+    error:     None, or str of the traceback if the load failed
+    '''
+    if workers is None or workers <= 1:
+        for file_name in file_names:
+            yield _load_guarded(file_name, kwargs)
+        return
+
+    # the pool pulls file names from a thread, which blocks on window
+    # until the results already in flight have been consumed
+    window = threading.Semaphore(int(workers) * LOAD_MANY_QUEUE)
+    done   = threading.Event()
+    def throttled(directory):
+        for file_name in file_names:
+            window.acquire()
+            if done.is_set():
+                return
+            yield (file_name, directory, kwargs)
+
+    # every worker result is written in here, and it is removed on exit
+    # so results abandoned by closing the generator early are cleaned up
+    directory = tempfile.mkdtemp(suffix = '.trimesh_load',
+                                 dir    = shared_directory())
+    pool      = multiprocessing.Pool(processes = int(workers))
+    try:
+        for file_name, shared, error in pool.imap_unordered(_load_worker, 
+                                                            throttled(directory)):
+            window.release()
+            mesh = None
+            if shared is not None:
+                mesh = _load_shared(*shared)
+            yield file_name, mesh, error
+    finally:
+        done.set()
+        window.release()
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
+def _load_guarded(file_name, kwargs):
+    '''
+    Load a mesh file, capturing any exception as a traceback string.
+
+    Returns
+    ---------
+    file_name: str, as passed
+    mesh:      result of load_mesh, or None
+    error:     None, or str of the traceback
+    '''
+    try:
+        return file_name, load_mesh(file_name, **kwargs), None
+    except Exception:
+        log.warning('Failed to load %s', file_name)
+        return file_name, None, traceback.format_exc()
+
+def _load_worker(arguments):
+    '''
+    Load a mesh file and write the result to the shared directory,
+    in a worker process of load_many.
+
+    Returns
+    ---------
+    file_name: str, as passed
+    shared:    None, or (list of native file names, bool if result is a list)
+    error:     None, or str of the traceback
+    '''
+    file_name, directory, kwargs = arguments
+    file_name, mesh, error = _load_guarded(file_name, kwargs)
+    if error is not None:
+        return file_name, None, error
+    try:
+        shared = []
+        for body in np.append(mesh, []):
+            file_obj, shared_name = shared_file(suffix    = '.trimesh', 
+                                                directory = directory)
+            shared.append(shared_name)
+            with file_obj:
+                export_trimesh(body, file_obj)
+    except Exception:
+        return file_name, None, traceback.format_exc()
+    return file_name, (shared, isinstance(mesh, list)), None
+
+def _load_shared(shared, is_list):
+    '''
+    Memory- map meshes written by _load_worker, removing the files.
+    The mapping remains valid after the file is removed.
+    '''
+    meshes = []
+    for shared_name in shared:
+        meshes.append(load_trimesh(shared_name))
+        os.remove(shared_name)
+    if is_list:
+        return meshes
+    return meshes[0]
+
+_mesh_probers = {'stl'     : probe_stl,
+                 'off'     : probe_off,
+                 'ply'     : probe_ply,
+                 'trimesh' : probe_trimesh}
+
 _mesh_loaders = dict()
 _mesh_loaders.update(_assimp_loaders)
 _mesh_loaders.update(_stl_loaders)
 _mesh_loaders.update(_misc_loaders)
+_mesh_loaders.update(_native_loaders)
+_mesh_loaders.update(_ply_loaders)
+_mesh_loaders.update(_gltf_loaders)
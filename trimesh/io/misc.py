@@ -1,48 +1,439 @@
 import numpy as np
 import struct
+import re
+
+from collections import deque
 
 from ..base import Trimesh
 from ..constants import *
+from .. import grouping
+from ..geometry import triangulate_fan
+
+# bytes of an OFF file parsed at once
+OFF_CHUNK   = 2 ** 24
+# the first word of an OFF file: texture, color and normal prefixes
+_OFF_HEADER = re.compile(r'^(ST)?(C)?(N)?OFF$')
+# bytes of an OBJ file parsed at once
+OBJ_CHUNK   = 2 ** 24
+_NEWLINE    = ord('\n')
+_WHITESPACE = np.array([ord(i) for i in ' \t\r\n'], dtype=np.uint8)
+# characters which only appear in values written as floats
+_DECIMAL    = np.array([ord(i) for i in '.eE'], dtype=np.uint8)
+# number of values kept from each kind of line
+_OBJ_COLUMNS = {b'v' : 3, b'vt' : 2, b'vn' : 3}
+# keywords of lines which are parsed, faces last
+_OBJ_KINDS   = [b'v', b'vt', b'vn', b'f']
+# comments, and whitespace before a keyword, removed before classifying lines
+_OBJ_STRIP   = re.compile(br'#[^\n]*|^[ \t]+', re.MULTILINE)
 
 def load_off(file_obj, file_type=None):
-    header_string = file_obj.readline().decode().strip()
-    if not header_string == 'OFF': 
-        raise NameError('Not an OFF file! Header was ' + header_string)
-
-    header  = np.array(file_obj.readline().split()).astype(int)
-    blob    = np.array(file_obj.read().split())
-    data_ok = np.sum(header * [3,4,0]) == len(blob)    
-    if not data_ok: raise NameError('Incorrect number of vertices or faces!')
-
-    vertices = blob[0:(header[0]*3)].astype(float).reshape((-1,3))
-    faces    = blob[(header[0]*3):].astype(int).reshape((-1,4))[:,1:]
-    mesh     = Trimesh(vertices=vertices, faces=faces)
+    '''
+    Load an OFF file, including the COFF, NOFF and STOFF variants.
+
+    The file is read OFF_CHUNK bytes at a time. Vertices are parsed into
+    arrays allocated from the counts in the header, and faces with any
+    number of vertices are fan triangulated. Vertex normals, and vertex 
+    and face colors are loaded if present.
+
+    Arguments
+    ---------
+    file_obj:  open file object, in binary read mode
+    file_type: not used
+
+    Returns
+    ---------
+    mesh: Trimesh object
+    '''
+    words  = _off_words(file_obj)
+    header = _OFF_HEADER.match(words[0])
+    if header is None:
+        raise NameError('Not an OFF file! Header was ' + ' '.join(words))
+    texture, color, normal = [i is not None for i in header.groups()]
+    counts = words[1:]
+    if len(counts) == 0:
+        counts = _off_words(file_obj)
+    vertex_count, face_count = int(counts[0]), int(counts[1])
+
+    # values on each vertex line, before any colors
+    base      = 3 + 3 * normal
+    vertices  = np.zeros((vertex_count, 3))
+    normals   = np.zeros((vertex_count, 3))
+    colors    = np.zeros((vertex_count, 3))
+    width     = None
+    loaded    = [0, 0]
+    triangles = deque()
+    face_colors = deque()
+    # whether any vertex or face color value was written as a float
+    float_colors = [False, False]
+
+    remainder = b''
+    while True:
+        data  = file_obj.read(OFF_CHUNK)
+        final = len(data) == 0
+        text  = remainder + data
+        if final:
+            text += b'\n'
+        else:
+            cut = text.rfind(b'\n') + 1
+            text, remainder = text[:cut], text[cut:]
+        values, starts, sizes, decimal = _off_lines(text)
+        if final and len(starts) == 0: break
+
+        # lines before the vertex count is reached are vertices
+        take = min(vertex_count - loaded[0], len(starts))
+        if take > 0:
+            if width is None:
+                width = sizes[0]
+            if (sizes[:take] != width).any() or width < base + 2 * texture:
+                raise NameError('OFF vertex lines have differing numbers of values!')
+            rows  = values[starts[0]:starts[take - 1] + width].reshape((take, width))
+            chunk = slice(loaded[0], loaded[0] + take)
+            vertices[chunk] = rows[:,0:3]
+            if normal:
+                normals[chunk] = rows[:,3:base]
+            if width >= base + 3 + 2 * texture:
+                colors[chunk] = rows[:,base:base + 3]
+                marks = decimal[starts[0]:starts[take - 1] + width].reshape((take, width))
+                float_colors[0] |= bool(marks[:,base:base + 3].any())
+            loaded[0] += take
+
+        if take < len(starts):
+            loaded[1] += len(starts) - take
+            float_colors[1] |= _off_faces(values, decimal, starts[take:], sizes[take:], 
+                                          triangles, face_colors)
+        if final: break
+
+    if loaded != [vertex_count, face_count]:
+        raise NameError('Incorrect number of vertices or faces!')
+    faces = np.zeros((0, 3), dtype=np.int64)
+    if len(triangles) > 0:
+        faces = np.vstack(triangles)
+    if len(faces) > 0 and (faces.min() < 0 or faces.max() >= vertex_count):
+        raise NameError('OFF face references nonexistent vertex!')
+
+    kwargs = dict()
+    if normal:
+        kwargs['vertex_normals'] = normals
+    if color and width is not None and width - base - 2 * texture in [3, 4]:
+        kwargs['vertex_colors'] = _off_colors(colors, float_colors[0])
+    if len(face_colors) > 0 and all(i is not None for i in face_colors):
+        kwargs['face_colors'] = _off_colors(np.vstack(face_colors), float_colors[1])
+    mesh = Trimesh(vertices = vertices, 
+                   faces    = faces, 
+                   **kwargs)
     return mesh
 
-def load_wavefront(file_obj, file_type=None):
+def probe_off(file_obj, file_size):
+    '''
+    Read the vertex and face counts from the header of an OFF file.
+
+    Arguments
+    ---------
+    file_obj:  open file object, at the start of the file
+    file_size: int, size of the file in bytes, not used
+
+    Returns
+    ---------
+    info: dict, with vertex_count and face_count (polygons, not triangles)
+    '''
+    words = _off_words(file_obj)
+    if _OFF_HEADER.match(words[0]) is None:
+        raise NameError('Not an OFF file! Header was ' + ' '.join(words))
+    counts = words[1:]
+    if len(counts) == 0:
+        counts = _off_words(file_obj)
+    return {'vertex_count' : int(counts[0]),
+            'face_count'   : int(counts[1])}
+
+def _off_words(file_obj):
+    '''
+    Read the words of the next line of an OFF file which isn't 
+    blank or a comment.
+    '''
+    while True:
+        line = file_obj.readline()
+        if len(line) == 0:
+            raise NameError('OFF file ended before header!')
+        words = line.split(b'#')[0].decode('utf-8', 'replace').split()
+        if len(words) > 0:
+            return [str(i) for i in words]
+
+def _off_lines(text):
+    '''
+    Parse a chunk of an OFF file which contains only complete lines.
+
+    Arguments
+    ---------
+    text: bytes, ending with a newline
+
+    Returns
+    ---------
+    values: (n) float, every value in the chunk
+    starts: (m) int, index in values of the first value of each line
+            which isn't blank or a comment
+    sizes:  (m) int, number of values on each of those lines
+    decimal: (n) bool, whether each value was written with a decimal
+             point or an exponent
+    '''
+    if b'#' in text:
+        text = re.sub(br'#[^\n]*', b'', text)
+    chars = np.frombuffer(text, dtype=np.uint8)
+    space = np.in1d(chars, _WHITESPACE)
+    # a value starts wherever whitespace is followed by anything else
+    first = np.nonzero(np.logical_and(np.logical_not(space), 
+                                      np.append(True, space[:-1])))[0]
+    line  = np.cumsum(chars == _NEWLINE)[first]
+    if len(first) == 0:
+        return np.zeros(0), first, first, np.zeros(0, dtype=bool)
+    values = np.fromstring(text, dtype=np.float64, sep=' ')
+    if len(values) != len(first):
+        raise NameError('Unable to parse OFF values!')
+    sizes  = np.diff(np.append(np.nonzero(np.diff(np.append(-1, line)))[0], len(line)))
+    starts = np.cumsum(sizes) - sizes
+
+    # a value ends wherever anything else is followed by whitespace, and
+    # contains a decimal character if the count of them changes across it
+    last    = np.nonzero(np.logical_and(np.logical_not(space), 
+                                        np.append(space[1:], True)))[0]
+    marked  = np.cumsum(np.in1d(chars, _DECIMAL))
+    decimal = marked[last] > np.append(0, marked)[first]
+    return values, starts, sizes, decimal
+
+def _off_faces(values, decimal, starts, sizes, triangles, face_colors):
+    '''
+    Fan triangulate the face lines of a chunk of an OFF file.
+
+    Arguments
+    ---------
+    values:      (n) float, every value in the chunk
+    decimal:     (n) bool, whether each value was written as a float
+    starts:      (m) int, index in values of each face line
+    sizes:       (m) int, number of values on each face line
+    triangles:   deque, (p, 3) int vertex indices appended to
+    face_colors: deque, (p, 3) float colors of every triangle appended to, 
+                 or None if some faces in the chunk have no color
+
+    Returns
+    ---------
+    float_colors: bool, True if any face color value was written as a float
+    '''
+    corners = values[starts].astype(np.int64)
+    extra   = sizes - corners - 1
+    if (extra < 0).any():
+        raise NameError('OFF face has fewer vertex indices than its count!')
+
+    # position in values of every vertex index, face by face
+    step  = np.arange(corners.sum()) - np.repeat(np.cumsum(corners) - corners, corners)
+    index = values[np.repeat(starts + 1, corners) + step].astype(np.int64)
+    fan, polygon = triangulate_fan(corners)
+    triangles.append(index[fan])
+
+    if (extra >= 3).all():
+        color = starts + corners + 1
+        color = np.column_stack((color, color + 1, color + 2))
+        face_colors.append(values[color][polygon])
+        return bool(decimal[color].any())
+    face_colors.append(None)
+    return False
+
+def _off_colors(colors, float_colors):
+    '''
+    Convert OFF colors to (n, 3) uint8. If any color value was written 
+    as a float, with a decimal point or an exponent, colors are taken 
+    to be floats from 0.0 to 1.0, otherwise integers to 255. This is
+    decided from the text rather than the values, so a color of exactly
+    1.0 0.0 0.0 is still read as a float.
+    '''
+    if float_colors:
+        colors = np.round(np.asarray(colors) * 255)
+    return np.clip(colors, 0, 255).astype(np.uint8)
+
+def load_wavefront(file_obj, file_type=None, dtype=np.float64):
     '''
-    Loads a Wavefront .obj file_obj into a Trimesh object
-    Discards texture normals and vertex color information
+    Loads a Wavefront .obj file_obj into a Trimesh object.
     https://en.wikipedia.org/wiki/Wavefront_.obj_file
+
+    The file is read OBJ_CHUNK bytes at a time, and every chunk is 
+    parsed with vectorized operations on its bytes rather than per line.
+    Polygons are fan triangulated, faces may reference vertices, texture
+    coordinates and normals (including negative, relative indices), and 
+    unique combinations of those are found by hashing.
+
+    Texture coordinates are stored in mesh.metadata['uv']. 
+
+    Arguments
+    ---------
+    file_obj: open file object, in binary read mode
+    dtype:    dtype of the vertices, normals and texture coordinates
+
+    Returns
+    ---------
+    mesh: Trimesh object
     '''
-    data     = np.array(file_obj.read().split())
-    data_str = data.astype(str)
-    
-    # find the locations of keys, then find the proceeding values
-    vid = np.nonzero(data_str == 'v')[0].reshape((-1,1))  + np.arange(3) + 1
-    nid = np.nonzero(data_str == 'vn')[0].reshape((-1,1)) + np.arange(3) + 1
-    fid = np.nonzero(data_str == 'f')[0].reshape((-1,1))  + np.arange(3) + 1
-    
-    # if we wanted to use the texture/vertex normals, we could slice this differently.
-    faces = np.array([i.split(b'/') for i in data[fid].reshape(-1)])[:,0].reshape((-1,3))
-    # wavefront has 1- indexed faces, as opposed to 0- indexed
-    faces = faces.astype(int) - 1
-    mesh  = Trimesh(vertices       = data[vid].astype(float),
-                    vertex_normals = data[nid].astype(float),
-                    faces          = faces)
-    mesh.generate_face_normals()
+    values    = {b'v' : deque(), b'vt' : deque(), b'vn' : deque()}
+    counts    = {b'v' : 0,       b'vt' : 0,       b'vn' : 0}
+    triangles = deque()
+    remainder = b''
+    while True:
+        data  = file_obj.read(OBJ_CHUNK)
+        final = len(data) == 0
+        text  = remainder + data
+        if final:
+            text += b'\n'
+        else:
+            cut = text.rfind(b'\n') + 1
+            text, remainder = text[:cut], text[cut:]
+        if len(text.strip()) > 0:
+            _obj_chunk(text, dtype, values, counts, triangles)
+        if final: break
+
+    if len(triangles) == 0:
+        raise NameError('No faces found in OBJ file!')
+    vertices  = _obj_stack(values[b'v'],  _OBJ_COLUMNS[b'v'],  dtype)
+    normals   = _obj_stack(values[b'vn'], _OBJ_COLUMNS[b'vn'], dtype)
+    uv        = _obj_stack(values[b'vt'], _OBJ_COLUMNS[b'vt'], dtype)
+    triangles = np.vstack(triangles)
+
+    # which of vertex, texture and normal indices the faces reference
+    # missing references are -1, and OBJ files rarely mix layouts
+    referenced = (triangles >= 0).all(axis=0)
+    if ((triangles >= 0).any(axis=0) != referenced).any():
+        raise NameError('OBJ faces mix index layouts!')
+    for column, array in enumerate([vertices, uv, normals]):
+        if referenced[column] and triangles[:,column].max() >= len(array):
+            raise NameError('OBJ face references nonexistent index!')
+
+    if referenced[1:].any():
+        # every unique combination of vertex, texture and normal
+        # becomes one vertex of the mesh
+        unique, inverse = grouping.unique_rows(triangles[:,referenced], 
+                                               return_inverse=True)
+        combos   = triangles[unique]
+        faces    = inverse.reshape((-1,3))
+        vertices = vertices[combos[:,0]]
+    else:
+        combos   = None
+        faces    = triangles[:,0].reshape((-1,3))
+
+    metadata = dict()
+    kwargs   = dict()
+    if combos is not None and referenced[1]:
+        metadata['uv'] = uv[combos[:,1]]
+    if combos is not None and referenced[2]:
+        kwargs['vertex_normals'] = normals[combos[:,2]]
 
+    mesh = Trimesh(vertices = vertices,
+                   faces    = faces,
+                   metadata = metadata,
+                   **kwargs)
+    mesh.generate_face_normals()
     return mesh
 
+def _obj_chunk(text, dtype, values, counts, triangles):
+    '''
+    Parse a chunk of an OBJ file which contains only complete lines.
+
+    Arguments
+    ---------
+    text:      bytes, ending with a newline
+    dtype:     dtype of parsed values
+    values:    dict, {keyword: deque of arrays}, appended to
+    counts:    dict, {keyword: int}, number of values before this chunk,
+               updated with the values in this chunk
+    triangles: deque, (n*3, 3) int arrays of vertex, texture and normal 
+               index for every triangle corner, appended to
+    '''
+    # lines are classified by their first two characters
+    text    = _OBJ_STRIP.sub(b'', text)
+    # an extra byte so the second character of every line exists
+    chars   = np.frombuffer(text + b' ', dtype=np.uint8).copy()
+    ends    = np.nonzero(chars == _NEWLINE)[0]
+    starts  = np.append(0, ends[:-1] + 1)
+    lengths = ends - starts + 1
+    first   = chars[starts]
+    second  = chars[starts + 1]
+    spaced  = np.in1d(second, _WHITESPACE)
+
+    # classify every line by its keyword
+    kinds = {b'v'  : np.logical_and(first == ord('v'), spaced),
+             b'vt' : np.logical_and(first == ord('v'), second == ord('t')),
+             b'vn' : np.logical_and(first == ord('v'), second == ord('n')),
+             b'f'  : np.logical_and(first == ord('f'), spaced)}
+    # blank out keywords so only values remain
+    chars[starts] = ord(' ')
+    chars[starts[np.logical_or(kinds[b'vt'], kinds[b'vn'])] + 1] = ord(' ')
+    chars = chars[:-1]
+
+    # number of each kind of value which precede every line,
+    # for resolving relative indices in faces
+    before = dict()
+    for key in values.keys():
+        before[key] = np.cumsum(kinds[key]) - kinds[key] + counts[key]
+
+    # the kind of line every character is on, as an integer code
+    codes = np.zeros(len(starts), dtype=np.uint8)
+    for code, key in enumerate(_OBJ_KINDS):
+        codes[kinds[key]] = code + 1
+    codes = np.repeat(codes, lengths)
+
+    for code, key in enumerate(_OBJ_KINDS[:3]):
+        count = kinds[key].sum()
+        if count == 0: continue
+        line_chars = chars[codes == code + 1]
+        line_text  = line_chars.tobytes()
+        parsed     = np.fromstring(line_text, dtype=dtype, sep=' ')
+        # number of values on every line, counted where whitespace
+        # is followed by anything else
+        space  = np.in1d(line_chars, _WHITESPACE)
+        start  = np.logical_and(~space, np.append(True, space[:-1]))
+        widths = np.bincount(np.cumsum(line_chars == _NEWLINE)[start], 
+                             minlength = count)
+        if (widths != widths[0]).any() or len(parsed) != widths.sum():
+            # lines have differing numbers of values, eg: some
+            # vertices have colors and some don't, so parse per line
+            parsed = np.array([line.split()[:_OBJ_COLUMNS[key]] 
+                               for line in line_text.splitlines()], 
+                              dtype=dtype)
+        values[key].append(parsed.reshape((count, -1)))
+        counts[key] += count
+
+    face = kinds[b'f']
+    if not face.any(): 
+        return
+    face_text = chars[codes == len(_OBJ_KINDS)]
+    # every face corner starts where whitespace is followed by a value
+    space     = np.in1d(face_text, _WHITESPACE)
+    corner    = np.nonzero(np.logical_and(space[:-1], ~space[1:]))[0] + 1
+    line      = np.cumsum(face_text == _NEWLINE)[corner]
+    corners   = np.bincount(line, minlength=face.sum())
+    slashes   = (face_text == ord('/')).sum()
+
+    # a missing texture index as in 'f 1//1' becomes a zero, which 
+    # is invalid as an OBJ index, and so marks a missing value
+    face_text = face_text.tobytes().replace(b'//', b'/0/').replace(b'/', b' ')
+    indices   = np.fromstring(face_text, dtype=np.int64, sep=' ')
+    if slashes % corners.sum() != 0 or len(indices) != corners.sum() * (1 + slashes // corners.sum()):
+        raise NameError('Unable to parse OBJ faces!')
+    indices = indices.reshape((corners.sum(), -1))
+    
+    # resolve every index to zero based, with -1 for missing
+    resolved = np.zeros((len(indices), 3), dtype=np.int64) - 1
+    for column, key in enumerate([b'v', b'vt', b'vn'][:indices.shape[1]]):
+        index    = indices[:,column]
+        relative = np.repeat(before[key][face], corners)
+        resolved[:,column] = np.where(index < 0, relative + index, index - 1)
+        resolved[index == 0, column] = -1
+
+    corner = triangulate_fan(corners)[0].reshape(-1)
+    triangles.append(resolved[corner])
+
+def _obj_stack(arrays, columns, dtype):
+    '''
+    Stack parsed OBJ values, keeping the first columns of each.
+    '''
+    if len(arrays) == 0:
+        return np.zeros((0, columns), dtype=dtype)
+    return np.vstack([i[:,:columns] for i in arrays])
+
 _misc_loaders = {'obj' : load_wavefront,
                  'off' : load_off}
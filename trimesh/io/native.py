@@ -0,0 +1,106 @@
+'''
+native.py
+
+Load meshes stored in the native binary format written by
+trimesh.io.export.export_trimesh.
+'''
+import numpy as np
+
+from ..base import Trimesh
+from ..constants import *
+from .binary import read_arrays, read_header
+from .export import NATIVE_VERSION, NATIVE_METADATA
+
+def load_trimesh(file_obj, file_type=None, mmap=True):
+    '''
+    Load a mesh from the native binary format.
+
+    If file_obj is a file on disk the arrays are memory- mapped copy- on-
+    write, so nothing is read until it is used, and changes to the mesh
+    never alter the file. Processing steps recorded in the file are marked
+    as applied, so calling process on the loaded mesh skips them, but only
+    if the arrays still match the hashes stored when the file was written.
+
+    Arguments
+    ---------
+    file_obj:  open file object or file name
+    file_type: not used
+    mmap:      bool, whether to memory- map the arrays
+
+    Returns
+    ---------
+    mesh: Trimesh object
+    '''
+    arrays, header = read_arrays(file_obj, mmap=mmap, mode='c')
+    if header.get('type') != 'Trimesh':
+        raise NameError('File does not contain a native mesh!')
+    if header.get('version', 0) > NATIVE_VERSION:
+        raise NameError('Native mesh version %d is newer than supported (%d)!' %
+                        (header['version'], NATIVE_VERSION))
+
+    for name, array in arrays.items():
+        # arrays read from a stream share an immutable buffer
+        if not array.flags.writeable:
+            arrays[name] = array.copy()
+
+    metadata = dict(header.get('metadata', {}))
+    for name in list(arrays.keys()):
+        if name.startswith(NATIVE_METADATA):
+            metadata[name[len(NATIVE_METADATA):]] = arrays.pop(name)
+
+    # arrays are assigned after creation, as the constructor copies them
+    mesh = Trimesh(metadata=metadata)
+    mesh.vertices     = arrays['vertices']
+    mesh.faces        = arrays['faces']
+    mesh.face_normals = arrays['face_normals']
+    for name in ['vertex_normals', 'face_colors', 'vertex_colors']:
+        if name in arrays:
+            setattr(mesh, name, arrays[name])
+
+    processed = header.get('processed')
+    if processed is not None and _verify_arrays(mesh, header.get('md5')):
+        mesh._cache.set('processed', [str(i) for i in processed])
+    return mesh
+
+def _verify_arrays(mesh, stored):
+    '''
+    Check the arrays of a loaded mesh against the hashes stored in the 
+    file header, so a file which was altered or corrupted after it was
+    written isn't trusted to have been processed.
+
+    Arguments
+    ---------
+    mesh:   Trimesh object, as loaded
+    stored: dict, {array name: hex digest}, or None
+
+    Returns
+    ---------
+    verified: bool, True if every stored hash matches the loaded data
+    '''
+    if not stored:
+        return False
+    for name in ['vertices', 'faces', 'face_normals']:
+        if getattr(mesh, name).md5() != stored.get(name):
+            log.warning('Native file %s does not match its stored hash, '
+                        'so it will be processed again', name)
+            return False
+    return True
+
+def probe_trimesh(file_obj, file_size):
+    '''
+    Read the vertex and face counts from the header of a native file.
+
+    Arguments
+    ---------
+    file_obj:  open file object, at the start of the file
+    file_size: int, size of the file in bytes, not used
+
+    Returns
+    ---------
+    info: dict, with vertex_count and face_count
+    '''
+    arrays = read_header(file_obj)[0]['arrays']
+    return {'vertex_count' : arrays['vertices']['shape'][0],
+            'face_count'   : arrays['faces']['shape'][0]}
+
+_native_loaders = {'trimesh' : load_trimesh}
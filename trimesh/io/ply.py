@@ -0,0 +1,367 @@
+'''
+ply.py
+
+Load meshes stored in the Stanford PLY format, ASCII or binary.
+
+The header declares a sequence of elements (vertex, face, ...) which each
+have a number of rows and a list of properties. Binary rows are read with
+np.frombuffer through a structured dtype built from the properties, and
+ASCII files are parsed in one pass into a flat array of values. List
+properties, such as the vertex indices of a face, are read in the same
+pass when every row has lists of the same length, and otherwise the list
+lengths are scanned row by row to find where each row starts.
+'''
+import numpy as np
+import struct
+
+from ..base import Trimesh
+from ..constants import *
+from ..geometry import triangulate_fan
+
+# PLY property types, and the numpy type they are stored as
+PLY_TYPES = {'char'   : 'i1', 'int8'    : 'i1',
+             'uchar'  : 'u1', 'uint8'   : 'u1',
+             'short'  : 'i2', 'int16'   : 'i2',
+             'ushort' : 'u2', 'uint16'  : 'u2',
+             'int'    : 'i4', 'int32'   : 'i4',
+             'uint'   : 'u4', 'uint32'  : 'u4',
+             'float'  : 'f4', 'float32' : 'f4',
+             'double' : 'f8', 'float64' : 'f8'}
+
+# byte order of each PLY format, None for ASCII
+PLY_FORMATS = {'ascii'                : None,
+               'binary_little_endian' : '<',
+               'binary_big_endian'    : '>'}
+
+# names used for the list of vertex indices of a face
+_FACE_INDICES = ['vertex_indices', 'vertex_index']
+
+def load_ply(file_obj, file_type=None):
+    '''
+    Load a mesh from a PLY file, ASCII or binary.
+
+    Faces with more than three vertices are fan triangulated. Vertex
+    normals and vertex and face colors are loaded if they are present,
+    and any other elements or properties are ignored.
+
+    Arguments
+    ---------
+    file_obj:  open file object
+    file_type: not used
+
+    Returns
+    ---------
+    mesh: Trimesh object
+    '''
+    encoding, elements = _parse_header(file_obj)
+    endian = PLY_FORMATS[encoding]
+    data   = file_obj.read()
+    if endian is None:
+        data = np.fromstring(data, dtype=np.float64, sep=' ')
+
+    columns = dict()
+    offset  = 0
+    for name, count, properties in elements:
+        if endian is None:
+            values, offset = _ascii_element(data, offset, count, properties)
+        else:
+            values, offset = _binary_element(data, offset, count, properties, endian)
+        columns[name] = values
+    if offset < len(data):
+        log.debug('Ignoring data after the last PLY element')
+
+    vertex = columns.get('vertex', {})
+    face   = columns.get('face',   {})
+    if not all(i in vertex for i in 'xyz'):
+        raise NameError('PLY file has no vertices!')
+    mesh = {'vertices' : np.column_stack([vertex[i] for i in 'xyz'])}
+    if all(i in vertex for i in ['nx', 'ny', 'nz']):
+        mesh['vertex_normals'] = np.column_stack([vertex[i] for i in ['nx', 'ny', 'nz']])
+    mesh['vertex_colors'] = _colors(vertex)
+
+    indices = [face[i] for i in _FACE_INDICES if i in face]
+    polygon = None
+    if len(indices) == 0:
+        mesh['faces'] = np.zeros((0, 3), dtype=np.int64)
+    elif (indices[0][1] == 3).all():
+        mesh['faces'] = indices[0][0].reshape((-1, 3)).astype(np.int64)
+    else:
+        corners, polygon = triangulate_fan(indices[0][1])
+        mesh['faces']    = indices[0][0][corners].astype(np.int64)
+
+    face_colors = _colors(face)
+    if face_colors is not None and polygon is not None:
+        face_colors = face_colors[polygon]
+    mesh['face_colors'] = face_colors
+
+    return Trimesh(**mesh)
+
+def probe_ply(file_obj, file_size):
+    '''
+    Read the vertex and face counts from the header of a PLY file.
+
+    Arguments
+    ---------
+    file_obj:  open file object, at the start of the file
+    file_size: int, size of the file in bytes, not used
+
+    Returns
+    ---------
+    info: dict, with vertex_count and face_count (polygons, not triangles)
+    '''
+    counts = dict((name, count) for name, count, properties in _parse_header(file_obj)[1])
+    return {'vertex_count' : counts.get('vertex', 0),
+            'face_count'   : counts.get('face',   0)}
+
+def _parse_header(file_obj):
+    '''
+    Read a PLY header, leaving file_obj at the start of the data.
+
+    Returns
+    ---------
+    encoding: str, key of PLY_FORMATS
+    elements: list of (name, count, properties), where properties
+              is a list of (name, dtype, count_dtype), and count_dtype
+              is None for properties which are not lists
+    '''
+    if file_obj.readline().strip() != b'ply':
+        raise NameError('File is not a PLY file!')
+    encoding = None
+    elements = []
+    while True:
+        line = file_obj.readline()
+        if len(line) == 0:
+            raise NameError('PLY header is not terminated!')
+        words = [str(i) for i in line.decode('utf-8', 'replace').split()]
+        if len(words) == 0 or words[0] in ['comment', 'obj_info']:
+            continue
+        elif words[0] == 'end_header':
+            break
+        elif words[0] == 'format':
+            encoding = words[1]
+        elif words[0] == 'element':
+            elements.append((words[1], int(words[2]), []))
+        elif words[0] == 'property' and len(elements) > 0:
+            if words[1] == 'list':
+                elements[-1][2].append((words[4], words[3], words[2]))
+            else:
+                elements[-1][2].append((words[2], words[1], None))
+        else:
+            raise NameError('Unable to parse PLY header line: %s' % ' '.join(words))
+
+    if encoding not in PLY_FORMATS:
+        raise NameError('PLY format %s is not supported!' % encoding)
+    order = PLY_FORMATS[encoding] or '='
+    def to_dtype(kind):
+        if kind is None:
+            return None
+        if kind not in PLY_TYPES:
+            raise NameError('PLY property type %s is not supported!' % kind)
+        return np.dtype(order + PLY_TYPES[kind])
+    elements = [(name, count, [(p, to_dtype(kind), to_dtype(length))
+                               for p, kind, length in properties])
+                for name, count, properties in elements]
+    return encoding, elements
+
+def _binary_element(data, offset, count, properties, endian):
+    '''
+    Read one element of a binary PLY file.
+
+    Arguments
+    ---------
+    data:       bytes, everything after the header
+    offset:     int, byte offset of the element in data
+    count:      int, number of rows in the element
+    properties: list of (name, dtype, count_dtype)
+    endian:     str, '<' or '>'
+
+    Returns
+    ---------
+    values: dict, {property name: (count) array}, and for list properties
+            {property name: ((m) array of every list, (count) list lengths)}
+    end:    int, byte offset of the end of the element
+    '''
+    readers = [None if length is None else struct.Struct(endian + length.char)
+               for name, kind, length in properties]
+    def read_length(position, column):
+        return readers[column].unpack_from(data, position)[0]
+
+    try:
+        # assume every row has lists the same length as the first row
+        lengths  = []
+        position = offset
+        for (name, kind, length), reader in zip(properties, readers):
+            size = 0
+            if reader is not None and count > 0:
+                size = read_length(position, len(lengths))
+                position += reader.size
+            lengths.append(size)
+            position += kind.itemsize * max(size, int(reader is None))
+    except struct.error:
+        raise NameError('PLY data is shorter than header specifies!')
+
+    fields = []
+    for (name, kind, length), size in zip(properties, lengths):
+        if length is None:
+            fields.append((name, kind))
+        else:
+            fields.extend([(name + '/length', length), (name, kind, (size,))])
+    row = np.dtype(fields)
+    end = offset + row.itemsize * count
+    if end <= len(data):
+        rows = np.frombuffer(data, dtype=row, count=count, offset=offset)
+        if all((rows[name + '/length'] == size).all()
+               for (name, kind, length), size in zip(properties, lengths)
+               if length is not None):
+            values = dict()
+            for (name, kind, length), size in zip(properties, lengths):
+                if length is None:
+                    values[name] = rows[name]
+                else:
+                    values[name] = (rows[name].reshape(-1),
+                                    np.zeros(count, dtype=np.int64) + size)
+            return values, end
+
+    # lists vary in length, so find where every row starts
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    def gather(positions, kind):
+        index = positions.reshape((-1, 1)) + np.arange(kind.itemsize)
+        return buffer[index].view(kind).reshape(-1)
+    sizes = [(kind.itemsize, None) if length is None else (length.itemsize, kind.itemsize)
+             for name, kind, length in properties]
+    try:
+        positions, lengths, end = _scan_rows(offset, count, sizes, read_length)
+    except struct.error:
+        raise NameError('PLY data is shorter than header specifies!')
+    if end > len(data):
+        raise NameError('PLY data is shorter than header specifies!')
+    return _scan_values(positions, lengths, properties, sizes, gather), end
+
+def _ascii_element(data, offset, count, properties):
+    '''
+    Read one element of an ASCII PLY file.
+
+    Arguments
+    ---------
+    data:       (n) float, every value after the header
+    offset:     int, index of the first value of the element in data
+    count:      int, number of rows in the element
+    properties: list of (name, dtype, count_dtype)
+
+    Returns
+    ---------
+    values: dict, {property name: (count) array}, and for list properties
+            {property name: ((m) array of every list, (count) list lengths)}
+    end:    int, index in data of the end of the element
+    '''
+    def read_length(position, column):
+        if position >= len(data):
+            raise NameError('PLY data is shorter than header specifies!')
+        return int(data[position])
+
+    # assume every row has lists the same length as the first row
+    lengths  = []
+    position = offset
+    for name, kind, length in properties:
+        size = 0
+        if length is not None and count > 0:
+            size = read_length(position, len(lengths))
+            position += 1
+        lengths.append(size)
+        position += max(size, int(length is None))
+
+    width = position - offset
+    end   = offset + width * count
+    if end <= len(data):
+        rows    = data[offset:end].reshape((count, width))
+        values  = dict()
+        uniform = True
+        column  = 0
+        for (name, kind, length), size in zip(properties, lengths):
+            if length is None:
+                values[name] = rows[:,column].astype(kind)
+                column += 1
+                continue
+            uniform &= bool((rows[:,column] == size).all())
+            values[name] = (rows[:,column + 1:column + 1 + size].reshape(-1).astype(kind),
+                            np.zeros(count, dtype=np.int64) + size)
+            column += size + 1
+        if uniform:
+            return values, end
+
+    def gather(positions, kind):
+        return data[positions].astype(kind)
+    sizes = [(1, None) if length is None else (1, 1)
+             for name, kind, length in properties]
+    positions, lengths, end = _scan_rows(offset, count, sizes, read_length)
+    if end > len(data):
+        raise NameError('PLY data is shorter than header specifies!')
+    return _scan_values(positions, lengths, properties, sizes, gather), end
+
+def _scan_rows(offset, count, sizes, read_length):
+    '''
+    Find the position of every property in every row of an element
+    with lists that vary in length, by walking the rows in order.
+
+    Arguments
+    ---------
+    offset:      int, position of the element
+    count:       int, number of rows in the element
+    sizes:       list of (head, item) for each property: the size of the
+                 value or list length, and the size of each list item,
+                 which is None for properties which are not lists
+    read_length: function, read_length(position, column) returns the
+                 length of the list at position
+
+    Returns
+    ---------
+    positions: (count, len(sizes)) int, position of every property
+    lengths:   (count, len(sizes)) int, length of every list,
+               zero for properties which are not lists
+    end:       int, position of the end of the element
+    '''
+    positions = []
+    lengths   = []
+    position  = offset
+    for row in range(count):
+        for column, (head, item) in enumerate(sizes):
+            positions.append(position)
+            size = 0
+            if item is not None:
+                size = read_length(position, column)
+                position += size * item
+            lengths.append(size)
+            position += head
+    shape = (count, len(sizes))
+    return (np.array(positions, dtype=np.int64).reshape(shape),
+            np.array(lengths,   dtype=np.int64).reshape(shape),
+            position)
+
+def _scan_values(positions, lengths, properties, sizes, gather):
+    '''
+    Gather the values of an element scanned by _scan_rows.
+    '''
+    values = dict()
+    for column, ((name, kind, length), (head, item)) in enumerate(zip(properties, sizes)):
+        if length is None:
+            values[name] = gather(positions[:,column], kind)
+            continue
+        size  = lengths[:,column]
+        start = np.repeat(positions[:,column] + head, size)
+        step  = np.arange(size.sum()) - np.repeat(np.cumsum(size) - size, size)
+        values[name] = (gather(start + step * item, kind), size)
+    return values
+
+def _colors(values):
+    '''
+    Stack the red, green and blue properties of an element into
+    (n, 3) uint8 colors, or return None if they are not present.
+    '''
+    if not all(i in values for i in ['red', 'green', 'blue']):
+        return None
+    colors = np.column_stack([values[i] for i in ['red', 'green', 'blue']])
+    if colors.dtype.kind == 'f':
+        colors = np.round(colors * 255)
+    return np.clip(colors, 0, 255).astype(np.uint8)
+
+_ply_loaders = {'ply' : load_ply}
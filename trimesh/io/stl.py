@@ -1,93 +1,251 @@
 import numpy as np
-import struct
+import io
+import os
+import re
+
+from collections import deque
 
 from ..base import Trimesh
 from ..constants import *
- 
-def load_stl(file_obj, file_type=None):
-    if detect_binary_file(file_obj): return load_stl_binary(file_obj)
-    else:                            return load_stl_ascii(file_obj)
+from .. import triangles
+
+# the header of a binary STL: 80 bytes of anything, then a face count
+_STL_HEADER = np.dtype([('header',     np.void, 80),
+                        ('face_count', '<u4')])
+# every face of a binary STL is 50 bytes: a normal, three vertices,
+# and an attribute byte count which is almost always zero
+_STL_FACE   = np.dtype([('normals',    '<f4', (3)),
+                        ('vertices',   '<f4', (3,3)),
+                        ('attributes', '<u2')])
+
+# bytes of an ASCII STL file parsed at once
+STL_ASCII_CHUNK = 2 ** 24
+# faces of a binary STL read at once when probing
+STL_PROBE_FACES = 2 ** 16
+# a solid or endsolid line, in lower case ASCII STL text
+_SOLID_LINE     = re.compile(br'^[ \t]*(endsolid|solid)\b[^\n]*', re.MULTILINE)
+# every keyword in an ASCII STL facet, so only numbers remain once removed
+_STL_KEYWORDS   = re.compile(br'endloop|endfacet|facet|normal|outer|loop|vertex')
+
+# file objects which are plain files on disk, and can be memory- mapped
+try:    
+    _FILE_TYPES = (file, io.FileIO, io.BufferedReader)
+except NameError:
+    _FILE_TYPES = (io.FileIO, io.BufferedReader)
+
+def load_stl(file_obj, file_type=None, dtype=np.float64):
+    '''
+    Load an STL file, either binary or ASCII
+
+    Arguments
+    ---------
+    file_obj:  open file object or stream, in binary read mode
+    file_type: not used
+    dtype:     dtype of the vertices and normals, np.float32 halves 
+               memory and is the precision binary STL is stored in
+
+    Returns
+    ---------
+    mesh: Trimesh object
+    '''
+    # streams which can't seek (pipes, sockets) are read into memory
+    # as detecting the file type requires looking at the start of the file
+    try:
+        file_obj.seek(file_obj.tell())
+    except (AttributeError, IOError, OSError):
+        file_obj = io.BytesIO(file_obj.read())
+
+    if detect_binary_file(file_obj): return load_stl_binary(file_obj, dtype=dtype)
+    else:                            return load_stl_ascii(file_obj,  dtype=dtype)
         
-def load_stl_binary(file_obj):
+def load_stl_binary(file_obj, dtype=np.float64):
     '''
     Load a binary STL file into a trimesh object. 
-    Uses a single main struct.unpack call, and is significantly faster
-    than looping methods or ASCII STL. 
+
+    The faces are read through a structured dtype, memory- mapping the file
+    if it is on disk, so the only copy made is the conversion of the 
+    vertices and normals to dtype. No python objects are created per value.
+
+    Arguments
+    ---------
+    file_obj: open file object or stream, in binary read mode
+    dtype:    dtype of the vertices and normals
+
+    Returns
+    ---------
+    mesh: Trimesh object
     '''
-    # get the file_obj header
-    header = file_obj.read(80)
+    header = file_obj.read(_STL_HEADER.itemsize)
+    if len(header) != _STL_HEADER.itemsize:
+        raise NameError('Binary STL file is too short to contain a header!')
+    face_count = int(np.frombuffer(header, dtype=_STL_HEADER)['face_count'][0])
     
-    # get the file information about the number of triangles
-    tri_count    = int(struct.unpack("@i", file_obj.read(4))[0])
+    blob = _read_faces(file_obj, face_count)
+
+    # all of our vertices will be loaded in order due to the STL format, 
+    # so faces are just sequential indices reshaped. 
+    faces        = np.arange(face_count*3).reshape((-1,3))
+    # the fields are strided views into the file, so copy them out 
+    # with a single conversion to the requested dtype
+    vertices     = np.empty((face_count, 3, 3), dtype=dtype)
+    face_normals = np.empty((face_count, 3),    dtype=dtype)
+    vertices[:]     = blob['vertices']
+    face_normals[:] = blob['normals']
     
-    # now we check the length from the header versus the length of the file
-    # data_start should always be position 84, but hard coding that felt ugly
-    data_start = file_obj.tell()
-    # this seeks to the end of the file (position 0, relative to the end of the file 'whence=2')
-    file_obj.seek(0, 2)
-    # we save the location of the end of the file and seek back to where we started from
-    data_end = file_obj.tell()
-    file_obj.seek(data_start)
+    # arrays are assigned after creation, as the constructor copies them
+    mesh = Trimesh()
+    mesh.vertices     = vertices.reshape((-1,3))
+    mesh.faces        = faces
+    mesh.face_normals = face_normals
+    return mesh
+
+def _read_faces(file_obj, face_count):
+    '''
+    Read the faces of a binary STL, positioned after the header.
+
+    Arguments
+    ---------
+    file_obj:   open file object or stream
+    face_count: int, number of faces the header says there are
+
+    Returns
+    ---------
+    faces: (face_count) array of dtype _STL_FACE
+    '''
+    expected = face_count * _STL_FACE.itemsize
+    if isinstance(file_obj, _FILE_TYPES):
+        start  = file_obj.tell()
+        length = os.fstat(file_obj.fileno()).st_size - start
+    else:
+        data   = file_obj.read()
+        length = len(data)
+
     # the binary format has a rigidly defined structure, and if the length
     # of the file doesn't match the header, the loaded version is almost
     # certainly going to be garbage. 
-    data_ok = (data_end - data_start) == (tri_count * 50)
-   
-    # this check is to see if this really is a binary STL file. 
-    # if we don't do this and try to load a file that isn't structured properly 
-    # the struct.unpack call uses 100% memory until the whole thing crashes, 
-    # so it's much better to raise an exception here. 
-    if not data_ok:
+    if length != expected:
         raise NameError('Attempted to load binary STL with incorrect length in header!')
-    
-    # all of our vertices will be loaded in order due to the STL format, 
-    # so faces are just sequential indices reshaped. 
-    faces        = np.arange(tri_count*3).reshape((-1,3))
+    if face_count == 0:
+        return np.zeros(0, dtype=_STL_FACE)
 
-    # this blob extracts 12 float values, with 2 pad bytes per face
-    # the first three floats are the face normal
-    # the next 9 are the three vertices 
-    blob = np.array(struct.unpack("<" + "12fxx"*tri_count, 
-                                  file_obj.read())).reshape((-1,4,3))
+    if isinstance(file_obj, _FILE_TYPES):
+        return np.memmap(file_obj, 
+                         dtype  = _STL_FACE, 
+                         mode   = 'r', 
+                         offset = start, 
+                         shape  = (face_count,))
+    return np.frombuffer(data, dtype=_STL_FACE, count=face_count)
 
-    face_normals = blob[:,0]
-    vertices     = blob[:,1:].reshape((-1,3))
-    
-    return Trimesh(vertices     = vertices,
-                   faces        = faces, 
-                   face_normals = face_normals)
-
-def load_stl_ascii(file_obj):
+def load_stl_ascii(file_obj, dtype=np.float64):
     '''
     Load an ASCII STL file.
-    
-    Should be pretty robust to whitespace changes due to the use of split()
+
+    The file is read STL_ASCII_CHUNK bytes at a time. In each chunk the 
+    keywords are removed and the remaining numbers are parsed directly into 
+    an array by numpy, so no python string is created per value. 
+    Keywords may be in any case, whitespace may be anything, and a 
+    missing endsolid is tolerated. 
+
+    Arguments
+    ---------
+    file_obj: open file object, in binary read mode
+    dtype:    dtype of the vertices and normals
+
+    Returns
+    ---------
+    mesh: Trimesh object, or a list of Trimesh objects if 
+          the file contains more than one solid
     '''
-    
-    header = file_obj.readline()
-    blob   = np.array(file_obj.read().split())
-    
-    # there are 21 'words' in each face
-    face_len     = 21
-    face_count   = float(len(blob) - 1) / face_len
-    if (face_count % 1) > TOL_ZERO:
-        raise NameError('Incorrect number of values in STL file!')
-    face_count   = int(face_count)
-    # this offset is to be added to a fixed set of indices that is tiled
-    offset       = face_len * np.arange(face_count).reshape((-1,1))
-    # these hard coded indices will break if the exporter adds unexpected junk
-    # but then it wouldn't really be an STL file... 
-    normal_index = np.tile([2,3,4], (face_count, 1)) + offset
-    vertex_index = np.tile([8,9,10,12,13,14,16,17,18], (face_count, 1)) + offset
-    
-    # faces are groups of three sequential vertices, as vertices are not references
-    faces        = np.arange(face_count*3).reshape((-1,3))
-    face_normals = blob[normal_index].astype(float)
-    vertices     = blob[vertex_index.reshape((-1,3))].astype(float)
-    
-    return Trimesh(vertices     = vertices,
-                   faces        = faces, 
-                   face_normals = face_normals)
+    solids    = []
+    current   = None
+    remainder = b''
+    while True:
+        data  = file_obj.read(STL_ASCII_CHUNK)
+        final = len(data) == 0
+        text  = remainder + data
+        if not final:
+            # only parse complete lines, so keywords are never split
+            cut = text.rfind(b'\n') + 1
+            text, remainder = text[:cut], text[cut:]
+
+        lowered  = text.lower()
+        position = 0
+        for match in _SOLID_LINE.finditer(lowered):
+            if current is None:
+                current = _AsciiSolid(dtype=dtype)
+            current.parse(lowered[position:match.start()])
+            if match.group(1) == b'solid':
+                # a solid without an endsolid is closed by the next solid
+                if not current.empty:
+                    solids.append(current)
+                name    = text[match.end(1):match.end()].strip()
+                current = _AsciiSolid(dtype=dtype, name=name)
+            else:
+                solids.append(current)
+                current = None
+            position = match.end()
+        if current is None and len(lowered[position:].strip()) > 0:
+            current = _AsciiSolid(dtype=dtype)
+        if current is not None:
+            current.parse(lowered[position:])
+        if final: break
+
+    if current is not None and not current.empty:
+        solids.append(current)
+    if len(solids) == 0:
+        raise NameError('No solids found in ASCII STL!')
+
+    meshes = [solid.mesh() for solid in solids]
+    if len(meshes) == 1:
+        return meshes[0]
+    return meshes
+
+class _AsciiSolid:
+    '''
+    Accumulate the values of a single solid in an ASCII STL, 
+    which may be spread across any number of chunks of the file.
+    '''
+    def __init__(self, dtype, name=b''):
+        self.dtype  = dtype
+        self.name   = name
+        self.values = deque()
+
+    @property
+    def empty(self):
+        return len(self.values) == 0
+
+    def parse(self, text):
+        '''
+        Parse the numbers from a chunk of lower case text, which contains
+        no solid or endsolid lines. A facet may be split across chunks, 
+        as the values are only grouped into facets once all are read.
+        '''
+        expected = 3 * (text.count(b'normal') + text.count(b'vertex'))
+        if expected == 0:
+            return
+        values = np.fromstring(_STL_KEYWORDS.sub(b' ', text), 
+                               dtype = self.dtype, 
+                               sep   = ' ')
+        if len(values) != expected:
+            raise NameError('Incorrect number of values in STL file!')
+        self.values.append(values)
+
+    def mesh(self):
+        values = np.concatenate(self.values)
+        # each facet has a normal and three vertices
+        if len(values) % 12 != 0:
+            raise NameError('Incorrect number of values in STL file!')
+        values     = values.reshape((-1,4,3))
+        face_count = len(values)
+        # faces are groups of three sequential vertices, as vertices are not references
+        faces      = np.arange(face_count*3).reshape((-1,3))
+        metadata   = dict()
+        if len(self.name) > 0:
+            metadata['name'] = self.name.decode('utf-8', 'replace')
+        return Trimesh(vertices     = values[:,1:].reshape((-1,3)),
+                       faces        = faces, 
+                       face_normals = values[:,0],
+                       metadata     = metadata)
 
 def detect_binary_file(file_obj):
     '''
@@ -104,5 +262,46 @@ def detect_binary_file(file_obj):
         if code > 127: return True
     return False
 
+def probe_stl(file_obj, file_size):
+    '''
+    Find the face count, bounds and area of a binary STL file by
+    streaming through its faces STL_PROBE_FACES at a time, without
+    creating a mesh.
+
+    Arguments
+    ---------
+    file_obj:  open file object, at the start of the file
+    file_size: int, size of the file in bytes
+
+    Returns
+    ---------
+    info: dict, with face_count, bounds and area, 
+          or None if the file is not a binary STL
+    '''
+    header = file_obj.read(_STL_HEADER.itemsize)
+    if len(header) != _STL_HEADER.itemsize:
+        return None
+    face_count = int(np.frombuffer(header, dtype=_STL_HEADER)['face_count'][0])
+    # an ASCII STL essentially never has a size matching its 'face count'
+    if _STL_HEADER.itemsize + face_count * _STL_FACE.itemsize != file_size:
+        return None
+
+    bounds = np.array([[np.inf] * 3, [-np.inf] * 3])
+    area   = 0.0
+    for start in range(0, face_count, STL_PROBE_FACES):
+        count = min(STL_PROBE_FACES, face_count - start)
+        data  = file_obj.read(count * _STL_FACE.itemsize)
+        if len(data) != count * _STL_FACE.itemsize:
+            raise NameError('Binary STL file is shorter than header specifies!')
+        vertices  = np.frombuffer(data, dtype=_STL_FACE)['vertices'].astype(np.float64)
+        bounds[0] = np.minimum(bounds[0], vertices.reshape((-1,3)).min(axis=0))
+        bounds[1] = np.maximum(bounds[1], vertices.reshape((-1,3)).max(axis=0))
+        area     += triangles.area(vertices, sum=True)
+    if face_count == 0:
+        bounds = None
+    return {'face_count' : face_count,
+            'bounds'     : bounds,
+            'area'       : area}
+
 _stl_loaders = {'stl':load_stl}
 
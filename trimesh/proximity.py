@@ -0,0 +1,155 @@
+'''
+proximity.py
+
+Closest point and signed distance queries against a mesh, using the
+bounding volume hierarchy of the mesh ray intersector as the broad phase.
+'''
+import numpy as np
+
+from .constants import *
+from .geometry  import transform_points
+from .triangles import closest_point
+
+# points queried in a single vectorized pass, which bounds memory
+NEAREST_CHUNK = 20000
+
+class ProximityQuery:
+    '''
+    An object to query the closest points on a mesh surface.
+    Shares the triangles and tree of mesh.ray, so they are only built once.
+    '''
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def _intersector(self):
+        '''
+        Return the ray intersector of the mesh, with a tree that preserves
+        distances. A tree kept through a transform that was not rigid
+        (for example a scale) is discarded so it will be rebuilt.
+        '''
+        intersector = self.mesh.ray
+        rotation    = intersector.tree_frame[0:3,0:3]
+        if not np.allclose(np.dot(rotation, rotation.T), np.eye(3)):
+            log.debug('Ray tree frame is not rigid, tree will be rebuilt')
+            self.mesh._cache.delete('tree')
+            self.mesh._cache.delete('tree_frame')
+        return intersector
+
+    def on_surface(self, points, workers=None):
+        '''
+        Find the closest point on the surface of the mesh to each point.
+
+        Arguments
+        ---------
+        points:  (n, 3) float, points in space
+        workers: int, if greater than 1 the points are split across
+                 this many worker processes
+
+        Returns
+        ---------
+        closest:     (n, 3) float, closest point on the mesh surface
+        distance:    (n) float, distance from each point to the surface
+        triangle_id: (n) int, index of mesh.faces the closest point is on
+        '''
+        intersector = self._intersector()
+        if workers is not None and workers > 1:
+            return intersector._parallel(nearest_intersector, points, workers)
+        return nearest_intersector(intersector, points)
+
+    def signed_distance(self, points, workers=None):
+        '''
+        Find the signed distance from each point to the surface of the mesh.
+        Points inside the mesh have a positive distance, and points outside
+        have a negative distance.
+
+        Arguments
+        ---------
+        points:  (n, 3) float, points in space
+        workers: int, if greater than 1 the points are split across
+                 this many worker processes
+
+        Returns
+        ---------
+        distance: (n) float, signed distance from each point to the surface
+        '''
+        distance = self.on_surface(points, workers=workers)[1]
+        inside   = self.mesh.contains(points)
+        distance[np.logical_not(inside)] *= -1.0
+        return distance
+
+def nearest_intersector(intersector, points):
+    '''
+    Run nearest_points with the triangles and tree of a RayMeshIntersector
+    '''
+    return nearest_points(triangles  = intersector.triangles,
+                          tree       = intersector.tree,
+                          points     = points,
+                          tree_frame = intersector.tree_frame)
+
+def nearest_points(triangles, tree, points, tree_frame=None):
+    '''
+    Find the closest point on a set of triangles to each point.
+
+    For every point an upper bound on the distance is found by descending
+    the tree to a single leaf and checking the triangles in it. The tree
+    is then traversed again, and only triangles whose boxes are within
+    that bound are checked, so most of the mesh is never touched.
+
+    Arguments
+    ---------
+    triangles:  (m, 3, 3) float, vertices of triangles
+    tree:       BVH of the triangle bounding boxes
+    points:     (n, 3) float, points in space
+    tree_frame: (4, 4) float, rigid transform from the frame of
+                triangles to the frame tree was built in
+
+    Returns
+    ---------
+    closest:     (n, 3) float, closest point on the triangles
+    distance:    (n) float, distance from each point to the closest point
+    triangle_id: (n) int, index of triangles the closest point is on
+    '''
+    triangles = np.asanyarray(triangles, dtype=np.float64)
+    points    = np.asanyarray(points,    dtype=np.float64).reshape((-1,3))
+    if len(triangles) == 0:
+        raise MeshError('Cannot find nearest points on an empty mesh!')
+    moved = points
+    if tree_frame is not None:
+        moved = transform_points(points, tree_frame)
+
+    closest     = np.zeros((len(points), 3))
+    distance    = np.zeros(len(points))
+    triangle_id = np.zeros(len(points), dtype=np.int64)
+    for start in range(0, len(points), NEAREST_CHUNK):
+        chunk = slice(start, start + NEAREST_CHUNK)
+        count = len(points[chunk])
+
+        # upper bound from the triangles in a nearby leaf
+        offsets, index = tree.nearest_leaf(moved[chunk])
+        query  = np.repeat(np.arange(count), np.diff(offsets))
+        found  = _pair_distance(triangles[index], points[chunk][query])[1]
+        bound  = np.minimum.reduceat(found, offsets[:-1])
+        bound += TOL_MERGE
+
+        # every triangle which could be closer than the bound
+        offsets, index = tree.within_distance(moved[chunk], bound)
+        query   = np.repeat(np.arange(count), np.diff(offsets))
+        near, found = _pair_distance(triangles[index], points[chunk][query])
+        # the closest candidate for every point: candidates are grouped
+        # by point, so sort each group by distance and take the first
+        best = np.lexsort((found, query))[offsets[:-1]]
+
+        closest[chunk]     = near[best]
+        distance[chunk]    = found[best]
+        triangle_id[chunk] = index[best]
+    return closest, distance, triangle_id
+
+def _pair_distance(triangles, points):
+    '''
+    Closest point and distance between triangles and points, pairwise.
+    Degenerate triangles are given an infinite distance.
+    '''
+    near     = closest_point(triangles, points)
+    distance = np.sum((near - points) ** 2, axis=1) ** .5
+    distance[np.logical_not(np.isfinite(distance))] = np.inf
+    return near, distance
@@ -0,0 +1,470 @@
+'''
+bvh.py
+
+A bounding volume hierarchy stored in flat numpy arrays.
+
+Used for broad- phase queries of rays and boxes against triangles,
+with construction and traversal both vectorized, rather than looping
+over every triangle or ray in python.
+'''
+import numpy as np
+from collections import deque
+
+from ..constants import *
+from ..io.binary import write_arrays, read_arrays
+
+# the maximum number of boxes referenced by a leaf
+BVH_LEAF_SIZE = 8
+# how many rays or boxes to traverse in a single vectorized pass
+# the frontier of (query, node) pairs grows with this, so it bounds memory
+BVH_CHUNK     = 20000
+# boxes are padded by this amount so queries are conservative
+BVH_PAD       = TOL_MERGE
+
+class BVH:
+    '''
+    A bounding volume hierarchy, built by object median splits along
+    the longest axis of each node.
+
+    It is stored as a complete binary tree in flat arrays: node i has
+    children 2i+1 and 2i+2, and every leaf is at the same depth, so no
+    child pointers need to be stored. Each leaf references a contiguous
+    range of self.order, which contains indices of the original boxes.
+    The original boxes are stored in the same order, so queries can 
+    test them after reaching a leaf and return exact results.
+    '''
+    def __init__(self, node_bounds, leaf_start, order, box_bounds):
+        '''
+        Arguments
+        ---------
+        node_bounds: (2**(depth+1) - 1, 2, d) float, [min, max] of each node
+        leaf_start:  (2**depth + 1) int, leaf i references
+                     order[leaf_start[i]:leaf_start[i+1]]
+        order:       (n) int, indices of the original boxes
+        box_bounds:  (n, 2, d) float, [min, max] of original boxes, 
+                     box_bounds[i] is the bounds of box order[i]
+        '''
+        self.node_bounds = node_bounds
+        self.leaf_start  = leaf_start
+        self.order       = order
+        self.box_bounds  = box_bounds
+        self.depth       = int(round(np.log2(len(leaf_start) - 1)))
+
+    @property
+    def dimension(self):
+        return self.node_bounds.shape[2]
+
+    @property
+    def bounds(self):
+        '''
+        The bounds of the root node, in the interleaved format
+        used by rtree: [minx, miny, minz, maxx, maxy, maxz]
+        '''
+        return self.node_bounds[0].reshape(-1)
+
+    def intersects_ray(self, origins, directions, return_distance=False):
+        '''
+        Find which boxes each ray passes through.
+
+        Arguments
+        ---------
+        origins:         (m, d) float, ray origins
+        directions:      (m, d) float, ray directions, don't need to be unit vectors
+        return_distance: bool, if True also return where each ray enters each box
+
+        Returns
+        ---------
+        offsets:  (m + 1) int, boxes hit by ray i are index[offsets[i]:offsets[i+1]]
+        index:    (p) int, indices of boxes hit by rays
+        distance: (p) float, only returned if return_distance. 
+                  The ray parameter t where the ray enters the box, 
+                  so the point is origin + direction * t, clipped to zero 
+                  if the origin is inside the box. 
+        '''
+        origins    = np.asanyarray(origins,    dtype=np.float64)
+        directions = np.array(directions, dtype=np.float64)
+        # a zero direction component would produce nan values in the
+        # slab test, so replace them with a tiny value
+        tiny = np.abs(directions) < TOL_ZERO
+        directions[tiny] = TOL_ZERO
+        inverse = 1.0 / directions
+
+        def test(query, boxes):
+            return _ray_box(origins[query], inverse[query], boxes)
+        query, position = self._traverse(len(origins), test)
+        offsets, index  = self._to_csr(len(origins), query, position)
+        if return_distance:
+            distance = _ray_box_distance(origins[query], 
+                                         inverse[query], 
+                                         self.box_bounds[position])
+            return offsets, index, distance
+        return offsets, index
+
+    def intersects_box(self, boxes):
+        '''
+        Find which boxes in the tree overlap each query box.
+
+        Arguments
+        ---------
+        boxes: (m, 2, d) or (m, 2*d) float, [min, max] of query boxes
+
+        Returns
+        ---------
+        offsets: (m + 1) int, boxes hit by query i are index[offsets[i]:offsets[i+1]]
+        index:   (p) int, indices of boxes which overlap query boxes
+        '''
+        boxes = np.asanyarray(boxes, dtype=np.float64).reshape((-1, 2, self.dimension))
+
+        def test(query, bounds):
+            return _box_box(boxes[query], bounds)
+        query, position = self._traverse(len(boxes), test)
+        return self._to_csr(len(boxes), query, position)
+
+    def within_distance(self, points, radius):
+        '''
+        Find which boxes are within a distance of each point.
+
+        Arguments
+        ---------
+        points: (m, d) float, query points
+        radius: (m) float, maximum distance from each point
+
+        Returns
+        ---------
+        offsets: (m + 1) int, boxes near point i are index[offsets[i]:offsets[i+1]]
+        index:   (p) int, indices of boxes within radius of points
+        '''
+        points = np.asanyarray(points, dtype=np.float64).reshape((-1, self.dimension))
+        radius = np.asanyarray(radius, dtype=np.float64).reshape(-1)
+
+        def test(query, boxes):
+            return _point_box_distance(points[query], boxes) <= radius[query]
+        query, position = self._traverse(len(points), test)
+        return self._to_csr(len(points), query, position)
+
+    def nearest_leaf(self, points):
+        '''
+        Descend the tree from the root to a leaf for every point, at each 
+        level choosing the child whose box is closest to the point. 
+        The leaf found is not necessarily the one containing the nearest 
+        box, but the boxes in it give a cheap upper bound on the distance.
+
+        Arguments
+        ---------
+        points: (m, d) float, query points
+
+        Returns
+        ---------
+        offsets: (m + 1) int, boxes in leaf of point i are index[offsets[i]:offsets[i+1]]
+        index:   (p) int, indices of boxes in the leaf reached by each point
+        '''
+        points = np.asanyarray(points, dtype=np.float64).reshape((-1, self.dimension))
+        node   = np.zeros(len(points), dtype=np.int64)
+        for level in range(self.depth):
+            left  = (node * 2) + 1
+            near  = (_point_box_distance(points, self.node_bounds[left + 1]) <
+                     _point_box_distance(points, self.node_bounds[left]))
+            node  = left + near
+        leaf     = node - ((2 ** self.depth) - 1)
+        counts   = self.leaf_start[leaf + 1] - self.leaf_start[leaf]
+        position = _expand_ranges(self.leaf_start[leaf], counts)
+        offsets  = np.append(0, np.cumsum(counts))
+        return offsets, self.order[position]
+
+    def intersection(self, coordinates):
+        '''
+        Find the boxes in the tree which overlap a single box or point.
+        The same interface as rtree.Index.intersection
+
+        Arguments
+        ---------
+        coordinates: (2*d) box in interleaved format, or (d) point
+
+        Returns
+        ---------
+        index: (p) int, indices of boxes which overlap
+        '''
+        coordinates = np.asanyarray(coordinates, dtype=np.float64).reshape(-1)
+        if len(coordinates) == self.dimension:
+            coordinates = np.tile(coordinates, 2)
+        offsets, index = self.intersects_box(coordinates)
+        return index
+
+    def _traverse(self, count, test):
+        '''
+        Traverse the tree for a set of queries, in chunks, one level at a time.
+
+        Arguments
+        ---------
+        count: int, number of queries
+        test:  function, test(query, bounds) returns a bool mask of whether
+               each query overlaps each (n, 2, d) box in bounds
+
+        Returns
+        ---------
+        query:    (p) int, index of query for each hit, in ascending order
+        position: (p) int, position in self.order of the box for each hit
+        '''
+        query_hit    = deque()
+        position_hit = deque()
+        for chunk_start in range(0, count, BVH_CHUNK):
+            query = np.arange(chunk_start, min(chunk_start + BVH_CHUNK, count))
+            node  = np.zeros(len(query), dtype=np.int64)
+            for level in range(self.depth + 1):
+                hit   = test(query, self.node_bounds[node])
+                query = query[hit]
+                node  = node[hit]
+                if level == self.depth: break
+                # replace every node with its two children
+                query = np.repeat(query, 2)
+                node  = (np.repeat(node * 2, 2) +
+                         np.tile([1, 2], len(node)))
+            # convert the node index to a leaf index
+            leaf     = node - ((2 ** self.depth) - 1)
+            counts   = self.leaf_start[leaf + 1] - self.leaf_start[leaf]
+            query    = np.repeat(query, counts)
+            position = _expand_ranges(self.leaf_start[leaf], counts)
+            # test against the individual boxes in every leaf that was hit
+            hit      = test(query, self.box_bounds[position])
+            query_hit.append(query[hit])
+            position_hit.append(position[hit])
+        if len(query_hit) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # queries were processed in order, and the order is preserved
+        # through traversal, so results are already sorted by query
+        return np.hstack(query_hit), np.hstack(position_hit)
+
+    def _to_csr(self, count, query, position):
+        '''
+        Convert the result of self._traverse to offsets and box indices.
+        '''
+        offsets = np.searchsorted(query, np.arange(count + 1))
+        index   = self.order[position]
+        return offsets, index
+
+    def to_arrays(self):
+        '''
+        Return the arrays which define the tree.
+
+        Returns
+        ---------
+        arrays: dict, {str: numpy array}, can be passed to BVH.from_arrays
+        '''
+        return {'node_bounds' : self.node_bounds,
+                'leaf_start'  : self.leaf_start,
+                'order'       : self.order,
+                'box_bounds'  : self.box_bounds}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        '''
+        Create a tree from the result of BVH.to_arrays
+        '''
+        return cls(**dict((str(k), v) for k, v in arrays.items()))
+
+    def save(self, file_obj):
+        '''
+        Write the tree to a file object, in a format which can be
+        memory- mapped back with BVH.load.
+        '''
+        write_arrays(file_obj,
+                     arrays   = self.to_arrays(),
+                     metadata = {'type' : 'BVH'})
+
+    @classmethod
+    def load(cls, file_obj, mmap=True):
+        '''
+        Load a tree written by BVH.save
+
+        Arguments
+        ---------
+        file_obj: file object or file name
+        mmap:     bool, if True and file_obj is a file on disk, the arrays
+                  will be memory- mapped rather than read into memory.
+        '''
+        arrays, metadata = read_arrays(file_obj, mmap=mmap)
+        if metadata.get('type') != 'BVH':
+            raise NameError('File does not contain a BVH!')
+        return cls.from_arrays(arrays)
+
+def bvh_from_bounds(bounds, leaf_size=BVH_LEAF_SIZE):
+    '''
+    Build a BVH from a set of axis aligned bounding boxes.
+
+    Every level of the tree is built in a single vectorized pass:
+    the boxes in each node are sorted along the longest axis of their
+    centroids, and split at the median.
+
+    Arguments
+    ---------
+    bounds:    (n, 2, d) or (n, 2*d) float, [min, max] of boxes
+    leaf_size: int, the maximum number of boxes in a leaf
+
+    Returns
+    ---------
+    bvh: BVH object
+    '''
+    bounds    = np.asanyarray(bounds, dtype=np.float64)
+    dimension = bounds.shape[-1] // 2 if bounds.ndim == 2 else bounds.shape[-1]
+    bounds    = bounds.reshape((-1, 2, dimension))
+    count     = len(bounds)
+
+    if count == 0:
+        # a single leaf with no boxes and inverted bounds, so nothing hits it
+        node_bounds = np.array([[[np.inf]*dimension, [-np.inf]*dimension]])
+        return BVH(node_bounds = node_bounds,
+                   leaf_start  = np.zeros(2, dtype=np.int64),
+                   order       = np.array([], dtype=np.int64),
+                   box_bounds  = bounds)
+
+    # the depth required for leaves to contain at most leaf_size boxes,
+    # while still having at least one box in every leaf
+    depth = 0
+    while ((float(count) / 2**depth) > leaf_size and
+           2**(depth + 1) <= count):
+        depth += 1
+
+    centroids = bounds.mean(axis=1)
+    order     = np.arange(count)
+    starts    = np.array([0])
+    ends      = np.array([count])
+    for level in range(depth):
+        lengths  = ends - starts
+        node_of  = np.repeat(np.arange(len(starts)), lengths)
+        current  = centroids[order]
+        # the longest axis of the centroids in each node
+        extents  = (np.maximum.reduceat(current, starts, axis=0) -
+                    np.minimum.reduceat(current, starts, axis=0))
+        axis     = extents.argmax(axis=1)
+        # sort by node, then by position along the node's longest axis
+        key      = current[np.arange(count), axis[node_of]]
+        order    = order[np.lexsort((key, node_of))]
+        # split every node at its median
+        middle   = starts + (lengths // 2)
+        starts   = np.column_stack((starts, middle)).reshape(-1)
+        ends     = np.column_stack((middle, ends)).reshape(-1)
+
+    # pad the boxes so queries are conservative
+    ordered = bounds[order] + (np.array([-1.0, 1.0]) * BVH_PAD).reshape((1,2,1))
+    # bounds of the leaves, then each level up is the union of children
+    level_bounds = np.column_stack((np.minimum.reduceat(ordered[:,0], starts, axis=0),
+                                    np.maximum.reduceat(ordered[:,1], starts, axis=0)))
+    levels = deque([level_bounds.reshape((-1, 2, dimension))])
+    for level in range(depth):
+        child = levels[0]
+        union = np.column_stack((np.minimum(child[0::2,0], child[1::2,0]),
+                                 np.maximum(child[0::2,1], child[1::2,1])))
+        levels.appendleft(union.reshape((-1, 2, dimension)))
+
+    return BVH(node_bounds = np.vstack(levels),
+               leaf_start  = np.append(starts, count).astype(np.int64),
+               order       = order.astype(np.int64),
+               box_bounds  = ordered)
+
+def bvh_from_triangles(triangles, leaf_size=BVH_LEAF_SIZE):
+    '''
+    Build a BVH of the bounding boxes of triangles.
+
+    Arguments
+    ---------
+    triangles: (n, 3, 3) float, vertices of triangles
+    leaf_size: int, the maximum number of triangles in a leaf
+
+    Returns
+    ---------
+    bvh: BVH object
+    '''
+    triangles = np.asanyarray(triangles, dtype=np.float64)
+    bounds    = np.column_stack((triangles.min(axis=1),
+                                 triangles.max(axis=1)))
+    return bvh_from_bounds(bounds, leaf_size=leaf_size)
+
+def _ray_box(origins, inverse, boxes):
+    '''
+    Slab test for rays against axis aligned boxes, pairwise.
+
+    Arguments
+    ---------
+    origins: (n, d) float, ray origins
+    inverse: (n, d) float, 1.0 / ray direction
+    boxes:   (n, 2, d) float, [min, max] of boxes
+
+    Returns
+    ---------
+    hit: (n) bool, whether each ray passes through each box
+    '''
+    t_a    = (boxes[:,0] - origins) * inverse
+    t_b    = (boxes[:,1] - origins) * inverse
+    t_near = np.minimum(t_a, t_b).max(axis=1)
+    t_far  = np.maximum(t_a, t_b).min(axis=1)
+    hit    = np.logical_and(t_near <= t_far, t_far >= 0.0)
+    return hit
+
+def _ray_box_distance(origins, inverse, boxes):
+    '''
+    Find where rays enter axis aligned boxes, pairwise.
+
+    Arguments
+    ---------
+    origins: (n, d) float, ray origins
+    inverse: (n, d) float, 1.0 / ray direction
+    boxes:   (n, 2, d) float, [min, max] of boxes
+
+    Returns
+    ---------
+    distance: (n) float, ray parameter where each ray enters each box,
+              zero if the ray origin is inside the box
+    '''
+    t_a      = (boxes[:,0] - origins) * inverse
+    t_b      = (boxes[:,1] - origins) * inverse
+    distance = np.clip(np.minimum(t_a, t_b).max(axis=1), 0.0, np.inf)
+    return distance
+
+def _point_box_distance(points, boxes):
+    '''
+    Distance from points to axis aligned boxes, pairwise.
+    Points inside a box are at zero distance.
+
+    Arguments
+    ---------
+    points: (n, d) float
+    boxes:  (n, 2, d) float, [min, max] of boxes
+
+    Returns
+    ---------
+    distance: (n) float, distance from each point to each box
+    '''
+    outside  = np.maximum(np.maximum(boxes[:,0] - points, 
+                                     points - boxes[:,1]), 
+                          0.0)
+    distance = np.sum(outside ** 2, axis=1) ** .5
+    return distance
+
+def _box_box(boxes_a, boxes_b):
+    '''
+    Overlap test for axis aligned boxes, pairwise.
+
+    Arguments
+    ---------
+    boxes_a: (n, 2, d) float
+    boxes_b: (n, 2, d) float
+
+    Returns
+    ---------
+    hit: (n) bool, whether each pair of boxes overlaps
+    '''
+    hit = np.logical_and((boxes_a[:,0] <= boxes_b[:,1]).all(axis=1),
+                         (boxes_a[:,1] >= boxes_b[:,0]).all(axis=1))
+    return hit
+
+def _expand_ranges(starts, counts):
+    '''
+    Concatenate ranges without a python loop, ie:
+    starts = [0, 10], counts = [2, 3] returns [0, 1, 10, 11, 12]
+    '''
+    total = counts.sum()
+    if total == 0:
+        return np.array([], dtype=np.int64)
+    offsets = np.cumsum(counts) - counts
+    ranges  = np.repeat(starts - offsets, counts) + np.arange(total)
+    return ranges
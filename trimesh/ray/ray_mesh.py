@@ -1,24 +1,30 @@
 import numpy as np
 import time
 
-import rtree.index as rtree
-
 from ..constants       import *
-from ..geometry        import unitize
-from .ray_triangle_cpu import rays_triangles_id
+from ..geometry        import unitize, transform_points
+from .ray_triangle_cpu import rays_triangles_id, ray_triangle_pairs, ray_triangle_first
+from .ray_triangle_cpu import candidates_to_pairs
+from .bvh              import BVH, BVH_LEAF_SIZE, bvh_from_triangles
+from ..caching         import get_disk_cache, content_key
+
+# number of boxes each ray is split into for box based broad- phase queries
+RAY_SEGMENTS = 8
 
 class RayMeshIntersector:
     '''
     An object to query a mesh for ray intersections. 
-    Precomputes an r-tree for each triangle on the mesh.
+    Precomputes a bounding volume hierarchy of the triangles on the mesh.
     '''
     def __init__(self, mesh):
         self.mesh = mesh
 
-        # create triangles and tree from mesh only when requested,
-        # rather than on initialization. 
-        self._triangles = None
-        self._tree      = None
+        # triangles and tree are created from the mesh only when requested,
+        # rather than on initialization. They are stored in the mesh cache
+        # so they are discarded automatically if the mesh changes
+        self._cache = mesh._cache
+        # worker processes kept between parallel queries
+        self._shared = None
 
     @property
     def triangles(self):
@@ -26,25 +32,175 @@ class RayMeshIntersector:
         A (n, 3, 3) array of triangle vertices
         Only created when requested.
         '''
-        if self._triangles is None:
-            self._triangles = self.mesh.vertices[self.mesh.faces]
-        return self._triangles
+        triangles = self._cache.get('triangles')
+        if triangles is None:
+            triangles = self._cache.set('triangles', 
+                                        self.mesh.vertices[self.mesh.faces])
+        return triangles
 
     @property
     def tree(self):
         '''
-        An r-tree that contains every triangle
+        A BVH that contains every triangle
         This is moderately expensive and can be reused,
-        and is only created when requested
+        and is only created when requested. If a disk cache is enabled
+        the tree is loaded from it, rather than built, when possible.
+        '''
+        tree = self._cache.get('tree')
+        if tree is None:
+            tree = self._cache.set('tree', self._load_tree())
+        return tree
+
+    def _load_tree(self):
+        '''
+        Load the tree for the current mesh from the disk cache, 
+        or build it and store it in the disk cache. 
+        '''
+        disk = get_disk_cache()
+        if disk is None:
+            return create_tree(self.triangles)
+        key = content_key(self.mesh.vertices, 
+                          self.mesh.faces, 
+                          leaf_size = BVH_LEAF_SIZE)
+        arrays, metadata = disk.get('bvh', key)
+        if arrays is not None and metadata.get('type') == 'BVH':
+            return BVH.from_arrays(arrays)
+        tree = create_tree(self.triangles)
+        disk.set('bvh', key, tree.to_arrays(), {'type' : 'BVH'})
+        return tree
+
+    @property
+    def tree_frame(self):
+        '''
+        A (4,4) transformation matrix which takes points in the current
+        mesh frame to the frame self.tree was built in. 
+        Identity unless the mesh has been transformed since the tree 
+        was built. 
+        '''
+        frame = self._cache.get('tree_frame')
+        if frame is None:
+            frame = np.eye(4)
+        return frame
+
+    def retain_tree(self, matrix):
+        '''
+        Called before the mesh is transformed by matrix.
+        
+        If a tree has been built, return the state needed to keep using it
+        after the transform. Since an invertible transform maps the tree bounds
+        onto the bounds of the transformed triangles, rather than rebuilding
+        the tree we keep it and move query rays into the frame it was built in.
+
+        Arguments
+        ---------
+        matrix: (4,4) transformation matrix about to be applied to the mesh
+
+        Returns
+        ---------
+        retained: (tree, frame) tuple, or None if there is nothing to keep
         '''
+        if not 'tree' in self._cache: 
+            return None
+        try: 
+            inverse = np.linalg.inv(matrix)
+        except np.linalg.LinAlgError:
+            log.debug('Singular transform, ray tree will be rebuilt')
+            return None
+        if not np.isfinite(inverse).all():
+            return None
+        return self.tree, np.dot(self.tree_frame, inverse)
 
-        if self._tree is None:
-            self._tree = create_tree(self.triangles)
-        return self._tree
+    def restore_tree(self, retained):
+        '''
+        Called after the mesh is transformed, with the result of retain_tree.
+        '''
+        if retained is None: 
+            return
+        tree, frame = retained
+        self._cache.set('tree', tree)
+        self._cache.set('tree_frame', frame)
+        
+    def _rays_to_tree(self, rays):
+        '''
+        Move rays from the current mesh frame into the frame of self.tree
+
+        Arguments
+        ---------
+        rays: (n, 2, 3) array of ray origins and directions
+        
+        Returns
+        ---------
+        rays: (n, 2, 3) array of ray origins and directions, in tree frame
+        '''
+        frame = self._cache.get('tree_frame')
+        if frame is None:
+            return rays
+        rays    = np.array(rays, dtype=np.float64)
+        moved   = np.empty_like(rays)
+        moved[:,0,:] = transform_points(rays[:,0,:], frame)
+        moved[:,1,:] = np.dot(frame[0:3,0:3], rays[:,1,:].T).T
+        return moved
             
-    def intersects_location(self, rays, return_all=True):
+    def intersects_location(self, rays, first_hit_only=False, workers=None):
         '''
-        Find out whether the rays in question hit any triangle on the mesh.
+        Find the locations where rays hit the mesh.
+
+        Arguments
+        ---------
+        rays:           (n, 2, 3) array of ray origins and directions
+        first_hit_only: bool, if True only the nearest hit for each ray 
+                        is returned, and candidates further than the 
+                        nearest hit found so far are skipped. 
+        workers:        int, if greater than 1 the rays are split across
+                        this many worker processes
+
+        Returns
+        ---------
+        locations: (p, 3) float, points where rays hit the mesh
+        index_ray: (p) int, index of the ray for each hit
+        index_tri: (p) int, index of the triangle (in mesh.faces) for each hit
+        distance:  (p) float, distance from the ray origin to each hit
+
+        Hits are ordered by ray, then by distance along the ray. 
+        '''
+        if workers is not None and workers > 1:
+            return self._parallel('intersects_location', 
+                                  rays, 
+                                  workers, 
+                                  first_hit_only = first_hit_only)
+        rays       = np.asanyarray(rays, dtype=np.float64)
+        origins    = rays[:,0,:]
+        directions = rays[:,1,:]
+        ray_index, triangle_index, box_distance = self._candidate_pairs(rays)
+        
+        if first_hit_only:
+            index_ray, index_tri, t = ray_triangle_first(triangles      = self.triangles,
+                                                         origins        = origins,
+                                                         directions     = directions,
+                                                         ray_index      = ray_index,
+                                                         triangle_index = triangle_index,
+                                                         box_distance   = box_distance)[:3]
+        else:
+            hit, t = ray_triangle_pairs(triangles      = self.triangles,
+                                        origins        = origins,
+                                        directions     = directions,
+                                        ray_index      = ray_index,
+                                        triangle_index = triangle_index)[:2]
+            index_ray = ray_index[hit]
+            index_tri = triangle_index[hit]
+            t         = t[hit]
+            order     = np.lexsort((t, index_ray))
+            index_ray = index_ray[order]
+            index_tri = index_tri[order]
+            t         = t[order]
+        
+        locations = origins[index_ray] + (directions[index_ray] * t.reshape((-1,1)))
+        distance  = t * np.sum(directions[index_ray] ** 2, axis=1) ** .5
+        return locations, index_ray, index_tri, distance
+
+    def _candidate_pairs(self, rays):
+        '''
+        Broad phase for rays against the mesh tree.
 
         Arguments
         ---------
@@ -52,29 +208,42 @@ class RayMeshIntersector:
 
         Returns
         ---------
-        intersections: (n) sequence of triangle indexes
+        ray_index:      (p) int, index of ray for each candidate pair
+        triangle_index: (p) int, index of triangle for each candidate pair
+        box_distance:   (p) float, ray parameter where the ray enters the
+                        bounding box of the triangle
         '''
-        pass
+        moved = self._rays_to_tree(rays)
+        offsets, triangle_index, box_distance = self.tree.intersects_ray(moved[:,0,:], 
+                                                                         moved[:,1,:], 
+                                                                         return_distance=True)
+        ray_index = candidates_to_pairs(offsets, triangle_index)[0]
+        return ray_index, triangle_index, box_distance
 
-    def intersects_id(self, rays, return_any=False):
+    def intersects_id(self, rays, return_any=False, workers=None):
         '''
         Find the indexes of triangles the rays intersect
 
         Arguments
         ---------
-        rays: (n, 2, 3) array of ray origins and directions
+        rays:    (n, 2, 3) array of ray origins and directions
+        workers: int, if greater than 1 the rays are split across
+                 this many worker processes
 
         Returns
         ---------
         
-        intersections, return_any=True:
-            (n) sequence of triangle indexes which hit the ray
         intersections, return_any=False:
+            (n) sequence of triangle indexes which hit the ray
+        intersections, return_any=True:
             (n) boolean array of whether the ray hit *any* triangle
-
-        
         '''
-        ray_candidates = ray_triangle_candidates(rays = rays, 
+        if workers is not None and workers > 1:
+            return self._parallel('intersects_id', 
+                                  rays, 
+                                  workers, 
+                                  return_any = return_any)
+        ray_candidates = ray_triangle_candidates(rays = self._rays_to_tree(rays), 
                                                  tree = self.tree)
         intersections  = rays_triangles_id(triangles      = self.triangles, 
                                            rays           = rays, 
@@ -82,41 +251,97 @@ class RayMeshIntersector:
                                            return_any     = return_any)
         return intersections
 
-    def intersects_any(self, rays):
+    def intersects_any(self, rays, workers=None):
         '''
         Find out whether the rays in question hit *any* triangle on the mesh.
 
         Arguments
         ---------
-        rays: (n, 2, 3) array of ray origins and directions
+        rays:    (n, 2, 3) array of ray origins and directions
+        workers: int, if greater than 1 the rays are split across
+                 this many worker processes
 
         Returns
         ---------
         intersections: (n) boolean array of whether or not the ray hit a triangle
         '''
-        return self.intersects_id(rays, return_any=True)
+        return self.intersects_id(rays, return_any=True, workers=workers)
+
+    def _parallel(self, method, rays, workers, **kwargs):
+        '''
+        Run a query method over a pool of worker processes, which share
+        the triangles and tree of this intersector through memory- mapped
+        arrays rather than receiving a pickled copy of the mesh.
+        '''
+        # imported here as ray_parallel subclasses RayMeshIntersector
+        from .ray_parallel import parallel_query
+        return parallel_query(self, method, rays, workers, **kwargs)
+
+    def close(self):
+        '''
+        Stop the worker processes kept for parallel queries, if any.
+        They are also stopped when the interpreter exits.
+        '''
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
 
-def ray_triangle_candidates(rays, triangles=None, tree=None):
+def ray_triangle_candidates(rays, triangles=None, tree=None, segments=None):
     '''
     Do broad- phase search for triangles that the rays
-    may intersect. 
+    may intersect, for every ray at once. 
+
+    If tree is a BVH and segments is None, the rays are traversed through 
+    it directly. Otherwise (for example with an rtree.Index), does this by 
+    creating bounding boxes for each ray as it passes through the volume 
+    occupied by the tree, and querying the tree with them. A single box
+    around a long diagonal ray covers most of the volume, so each ray is 
+    split into segments along its length, with a box for each segment. 
 
-    Does this by creating a bounding box for the ray as it 
-    passes through the volume occupied by 
+    Arguments
+    ---------
+    rays:      (n, 2, 3) float, ray origins and directions
+    triangles: (m, 3, 3) float, only used if tree is None
+    tree:      BVH or rtree.Index of triangle bounds
+    segments:  int, number of boxes per ray for box queries
+
+    Returns
+    ---------
+    offsets: (n + 1) int, candidates for ray i are index[offsets[i]:offsets[i+1]]
+    index:   (p) int, indices of candidate triangles
     '''
     if tree is None:
         tree = create_tree(triangles)
+    rays = np.asanyarray(rays, dtype=np.float64)
+
+    if segments is None and hasattr(tree, 'intersects_ray'):
+        return tree.intersects_ray(origins    = rays[:,0,:], 
+                                   directions = rays[:,1,:])
+    if segments is None: 
+        segments = RAY_SEGMENTS
 
-    ray_bounding   = ray_bounds(rays, tree.bounds)
-    ray_candidates = [None] * len(rays)
-    for ray_index, bounds in enumerate(ray_bounding):
-        ray_candidates[ray_index] = list(tree.intersection(bounds))
-    return ray_candidates
+    boxes = ray_bounds(rays, tree.bounds, segments=segments)
+    if hasattr(tree, 'intersects_box'):
+        box_offsets, index = tree.intersects_box(boxes)
+    else:
+        # rtree can only be queried one box at a time
+        found       = [np.fromiter(tree.intersection(box), dtype=np.int64) for box in boxes]
+        box_offsets = np.append(0, np.cumsum([len(i) for i in found]))
+        index       = np.hstack(found + [np.zeros(0, dtype=np.int64)])
+
+    # segments of the same ray may share candidates, so merge them
+    box_ray   = np.repeat(np.arange(len(boxes)) // segments, np.diff(box_offsets))
+    stride    = int(index.max()) + 1 if len(index) > 0 else 1
+    unique    = np.unique(box_ray * stride + index)
+    ray_index = unique // stride
+    index     = unique %  stride
+    offsets   = np.searchsorted(ray_index, np.arange(len(rays) + 1))
+    return offsets, index
 
 def create_tree(triangles):
     '''
-    Given a set of triangles, create an r-tree for broad- phase 
-    collision detection
+    Given a set of triangles, create a bounding volume hierarchy 
+    for broad- phase collision detection
 
     Arguments
     ---------
@@ -124,41 +349,45 @@ def create_tree(triangles):
 
     Returns
     ---------
-    tree: Rtree object 
+    tree: BVH object 
     '''
-  
-    # the property object required to get a 3D r-tree index
-    properties = rtree.Property()
-    properties.dimension = 3
-    # the (n,6) interleaved bounding box for every triangle
-    tri_bounds = np.column_stack((triangles.min(axis=1), triangles.max(axis=1)))
-  
-    # stream loading wasn't getting proper index
-    tree       = rtree.Index(properties=properties)  
-    for i, bounds in enumerate(tri_bounds):
-        tree.insert(i, bounds)
-    
-    return tree
+    return bvh_from_triangles(triangles)
 
-def ray_bounds(rays, bounds, buffer_dist = 1e-5):
+def ray_bounds(rays, bounds, buffer_dist = 1e-5, segments = 1):
     '''
     Given a set of rays and a bounding box for the volume of interest
     where the rays will be passing through, find the bounding boxes 
     of the rays as they pass through the volume. 
+
+    Arguments
+    ---------
+    rays:        (n, 2, d) float, ray origins and directions
+    bounds:      (2*d) float, interleaved [min, max] of the volume
+    buffer_dist: float, distance to pad boxes by
+    segments:    int, number of pieces to split each ray into along 
+                 its primary axis, with a box for each piece
+
+    Returns
+    ---------
+    ray_bounding: (n * segments, 2*d) float, interleaved bounding boxes,
+                  with the boxes for ray i in rows [i*segments, (i+1)*segments)
     '''
     # separate out the (n, 2, 3) rays array into (n, 3) 
     # origin/direction arrays
-    ray_ori    = rays[:,0,:]
-    ray_dir = unitize(rays[:,1,:])
+    rays      = np.asanyarray(rays, dtype=np.float64)
+    ray_ori   = rays[:,0,:]
+    ray_dir   = unitize(rays[:,1,:])
+    dimension = ray_dir.shape[1]
 
     # bounding box we are testing against
-    bounds  = np.array(bounds)
+    bounds  = np.array(bounds, dtype=np.float64)
 
     # find the primary axis of the vector
     axis       = np.abs(ray_dir).argmax(axis=1)
     axis_bound = bounds.reshape((2,-1)).T[axis]
-    axis_ori   = np.array([ray_ori[i][a] for i, a in enumerate(axis)]).reshape((-1,1))
-    axis_dir   = np.array([ray_dir[i][a] for i, a in enumerate(axis)]).reshape((-1,1))
+    ray_range  = np.arange(len(rays))
+    axis_ori   = ray_ori[ray_range, axis].reshape((-1,1))
+    axis_dir   = ray_dir[ray_range, axis].reshape((-1,1))
 
     # parametric equation of a line
     # point = direction*t + origin
@@ -170,22 +399,22 @@ def ray_bounds(rays, bounds, buffer_dist = 1e-5):
     # behind the ray origin
     t[t < buffer_dist] = buffer_dist
 
-    # the value of t for both the upper and lower bounds
-    t_a = t[:,0].reshape((-1,1))
-    t_b = t[:,1].reshape((-1,1))
-
-    # the cartesion point for where the line hits the plane defined by
-    # axis
-    on_a = (ray_dir * t_a) + ray_ori
-    on_b = (ray_dir * t_b) + ray_ori
+    # the values of t where segments start and end, (n, segments + 1)
+    fraction = np.linspace(0.0, 1.0, int(segments) + 1)
+    t_split  = t[:,0].reshape((-1,1)) + np.outer(t[:,1] - t[:,0], fraction)
 
-    on_plane = np.column_stack((on_a, on_b)).reshape((-1,2,ray_dir.shape[1]))
+    # the cartesian points where the line hits the planes defined by axis
+    # at the start and end of every segment, (n, segments + 1, d)
+    on_plane = ((ray_dir.reshape((-1,1,dimension)) * 
+                 t_split.reshape((len(rays),-1,1))) + 
+                ray_ori.reshape((-1,1,dimension)))
     
-    ray_bounding = np.hstack((on_plane.min(axis=1), on_plane.max(axis=1)))
+    ray_bounding = np.column_stack((np.minimum(on_plane[:,:-1], on_plane[:,1:]).reshape((-1,dimension)),
+                                    np.maximum(on_plane[:,:-1], on_plane[:,1:]).reshape((-1,dimension))))
     # pad the bounding box by TOL_BUFFER
     # not sure if this is necessary, but if the ray is  axis aligned
     # this function will otherwise return zero volume bounding boxes
     # which may or may not screw up the r-tree intersection queries
-    ray_bounding += np.array([-1,-1,-1,1,1,1]) * buffer_dist
+    ray_bounding += np.append(-np.ones(dimension), np.ones(dimension)) * buffer_dist
 
     return ray_bounding
@@ -0,0 +1,223 @@
+'''
+ray_parallel.py
+
+Run ray queries against a mesh across a pool of worker processes.
+
+The triangles and BVH arrays are written once to an array container on a
+shared memory backed file system (/dev/shm, where available), and every
+worker memory- maps them when it starts. The mesh itself is never pickled,
+only the rays of each shard are sent to the workers.
+
+The pool and the shared file are kept on the intersector and reused by 
+later queries until the mesh changes, so querying in batches doesn't 
+start a new pool every time. They are released by the intersector's 
+close method, or when the interpreter exits.
+'''
+import numpy as np
+import multiprocessing
+import weakref
+import atexit
+import os
+
+from ..constants import log
+from ..caching   import Cache
+from ..io.binary import write_arrays, read_arrays, shared_file
+from .bvh        import BVH
+from .ray_mesh   import RayMeshIntersector
+
+# number of shards each worker receives, so uneven shards balance out
+SHARDS_PER_WORKER = 4
+
+# state of a worker process, populated by _worker_init
+_worker = dict()
+
+# pools which are open, closed on exit if they haven't been already
+_open_pools = weakref.WeakSet()
+
+class SharedIntersector(RayMeshIntersector):
+    '''
+    A RayMeshIntersector which queries precomputed triangles and a tree,
+    rather than a mesh. Used by worker processes.
+    '''
+    def __init__(self, triangles, tree, tree_frame):
+        self.mesh    = None
+        self._shared = None
+        # the source data never changes, so the cache never needs clearing
+        self._cache = Cache(id_function = _shared_id)
+        self._cache.set('triangles',  triangles)
+        self._cache.set('tree',       tree)
+        self._cache.set('tree_frame', tree_frame)
+
+def _shared_id():
+    return None
+
+def _worker_init(file_name):
+    '''
+    Memory- map the shared arrays, called once in every worker process
+    '''
+    arrays, metadata = read_arrays(file_name, mmap=True)
+    tree = BVH(node_bounds = arrays['node_bounds'],
+               leaf_start  = arrays['leaf_start'],
+               order       = arrays['order'],
+               box_bounds  = arrays['box_bounds'])
+    _worker['intersector'] = SharedIntersector(triangles  = arrays['triangles'],
+                                               tree       = tree,
+                                               tree_frame = arrays['tree_frame'])
+
+def _worker_query(arguments):
+    '''
+    Run a query on one shard of rays, in a worker process
+    '''
+    method, rays, kwargs = arguments
+    if callable(method):
+        return method(_worker['intersector'], rays, **kwargs)
+    return getattr(_worker['intersector'], method)(rays, **kwargs)
+
+def _write_shared(intersector):
+    '''
+    Write the triangles and tree of an intersector to a temporary file.
+
+    Returns
+    ---------
+    file_name: str, location of array container
+    '''
+    tree = intersector.tree
+    if not isinstance(tree, BVH):
+        raise NameError('Parallel queries require a BVH, not ' +
+                        type(tree).__name__)
+    file_obj, file_name = shared_file(suffix='.trimesh_rays')
+    with file_obj:
+        write_arrays(file_obj,
+                     {'triangles'   : intersector.triangles,
+                      'tree_frame'  : intersector.tree_frame,
+                      'node_bounds' : tree.node_bounds,
+                      'leaf_start'  : tree.leaf_start,
+                      'order'       : tree.order,
+                      'box_bounds'  : tree.box_bounds})
+    return file_name
+
+class SharedPool:
+    '''
+    A pool of worker processes which have memory- mapped the triangles 
+    and tree of an intersector, so it can be reused by later queries.
+    '''
+    def __init__(self, intersector, workers):
+        '''
+        Arguments
+        ---------
+        intersector: RayMeshIntersector object
+        workers:     int, number of worker processes
+        '''
+        # the tree is kept so it can be compared by identity
+        self.tree      = intersector.tree
+        self.md5       = intersector.mesh.md5()
+        self.workers   = int(workers)
+        self.file_name = _write_shared(intersector)
+        try:
+            self.pool = multiprocessing.Pool(processes   = self.workers,
+                                             initializer = _worker_init,
+                                             initargs    = (self.file_name,))
+        except Exception:
+            os.remove(self.file_name)
+            raise
+        _open_pools.add(self)
+        log.debug('Started %d workers for parallel ray queries', self.workers)
+
+    def matches(self, intersector, workers):
+        '''
+        Return True if this pool holds the current triangles and tree
+        of intersector, with the requested number of workers.
+        '''
+        return (self.pool is not None and
+                self.workers == int(workers) and
+                self.tree is intersector.tree and
+                self.md5 == intersector.mesh.md5())
+
+    def map(self, arguments):
+        '''
+        Run _worker_query on every item of arguments, in the workers.
+        '''
+        return self.pool.map(_worker_query, arguments)
+
+    def close(self):
+        '''
+        Stop the worker processes and remove the shared file.
+        '''
+        if self.pool is None:
+            return
+        pool, self.pool = self.pool, None
+        pool.close()
+        pool.join()
+        _open_pools.discard(self)
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+    def __del__(self):
+        # a pool which was never closed is terminated rather than joined
+        if getattr(self, 'pool', None) is None:
+            return
+        pool, self.pool = self.pool, None
+        pool.terminate()
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+def _close_pools():
+    for shared in list(_open_pools):
+        shared.close()
+
+atexit.register(_close_pools)
+
+def _merge(method, results, starts, kwargs):
+    '''
+    Merge the results of each shard, in the order of the shards
+    '''
+    if isinstance(results[0], tuple):
+        merged = [np.concatenate([r[i] for r in results]) 
+                  for i in range(len(results[0]))]
+        if method == 'intersects_location':
+            # ray indexes are relative to the start of each shard
+            merged[1] = np.concatenate([r[1] + s for r, s in zip(results, starts)])
+        return tuple(merged)
+    if kwargs.get('return_any', False):
+        return np.concatenate(results)
+    merged = []
+    for result in results:
+        merged.extend(result)
+    return merged
+
+def parallel_query(intersector, method, rays, workers, **kwargs):
+    '''
+    Split rays into shards and run an intersector method on each shard
+    in a pool of worker processes. The pool is kept on the intersector 
+    and reused until the mesh changes or the number of workers does.
+
+    Arguments
+    ---------
+    intersector: RayMeshIntersector object
+    method:      str, name of method ('intersects_id', 'intersects_location'),
+                 or a module level function called as method(intersector, rays)
+                 which returns an array or a tuple of arrays
+    rays:        (n, 2, 3) array of ray origins and directions, 
+                 or other per- query data for a function
+    workers:     int, number of worker processes
+    kwargs:      passed to method
+
+    Returns
+    ---------
+    result: the same as intersector.method(rays, **kwargs)
+    '''
+    rays   = np.asanyarray(rays, dtype=np.float64)
+    count  = min(int(workers) * SHARDS_PER_WORKER, len(rays))
+    shards = np.array_split(rays, max(count, 1))
+    starts = np.cumsum([0] + [len(i) for i in shards])[:-1]
+
+    shared = intersector._shared
+    if shared is None or not shared.matches(intersector, workers):
+        intersector.close()
+        shared = intersector._shared = SharedPool(intersector, workers)
+    log.debug('Casting %d rays in %d shards over %d workers',
+              len(rays),
+              len(shards),
+              workers)
+    results = shared.map([(method, shard, kwargs) for shard in shards])
+    return _merge(method, results, starts, kwargs)
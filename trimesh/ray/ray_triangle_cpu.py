@@ -6,6 +6,13 @@ import time
 
 from ..constants import log, log_time, TOL_ZERO
 
+# the number of (ray, triangle) pairs evaluated in a single vectorized pass
+# peak memory of the narrow phase is proportional to this
+RAY_PAIR_CHUNK = 100000
+# when finding the first hit, how many candidates per ray to evaluate
+# in the first pass. Every following pass evaluates twice as many. 
+FIRST_HIT_BLOCK = 4
+
 @log_time
 def rays_triangles_id(triangles,
                       rays, 
@@ -18,8 +25,10 @@ def rays_triangles_id(triangles,
     ---------
     triangles:      (n, 3, 3) float array of triangle vertices
     rays:           (m, 2, 3) float array of ray start, ray directions
-    ray_candidates: (m, *) int array of which triangles are candidates
-                    for the ray. 
+    ray_candidates: (offsets, index) tuple of which triangles are candidates
+                    for each ray, as returned by ray_triangle_candidates: 
+                    candidates of ray i are index[offsets[i]:offsets[i+1]]
+                    If None, every triangle is a candidate.
     return_any:     bool flag for output format
 
     Returns
@@ -27,19 +36,210 @@ def rays_triangles_id(triangles,
     intersections, return_any:      (m) bool of whether the ray hit any triangles
     intersections, not return_any:  (m) sequence of triangle indexes hit by rays
     '''
+    rays = np.asanyarray(rays, dtype=np.float64)
+    if ray_candidates is None:
+        ray_index      = np.repeat(np.arange(len(rays)), len(triangles))
+        triangle_index = np.tile(np.arange(len(triangles)), len(rays))
+    else:
+        ray_index, triangle_index = candidates_to_pairs(*ray_candidates)
+
+    hit = ray_triangle_pairs(triangles      = triangles,
+                             origins        = rays[:,0,:],
+                             directions     = rays[:,1,:],
+                             ray_index      = ray_index,
+                             triangle_index = triangle_index)[0]
+    counts = np.bincount(ray_index[hit], minlength=len(rays))
+    if return_any: 
+        return counts > 0
+    if len(rays) == 0:
+        # splitting an empty array would return one empty group
+        return []
+    # pairs are ordered by ray, so hits can be split by ray without sorting
+    return np.split(triangle_index[hit], np.cumsum(counts)[:-1])
+
+def candidates_to_pairs(offsets, index):
+    '''
+    Convert triangle candidates per ray into flat arrays of 
+    (ray, triangle) pairs. 
+
+    Arguments
+    ---------
+    offsets: (m + 1) int, candidates of ray i are index[offsets[i]:offsets[i+1]]
+    index:   (p) int, candidate triangle indices
+
+    Returns
+    ---------
+    ray_index:      (p) int, index of ray for each pair, in ascending order
+    triangle_index: (p) int, index of triangle for each pair
+    '''
+    offsets        = np.asanyarray(offsets, dtype=np.int64)
+    ray_index      = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    triangle_index = np.asanyarray(index, dtype=np.int64)
+    return ray_index, triangle_index
+
+def ray_triangle_pairs(triangles, 
+                       origins, 
+                       directions, 
+                       ray_index, 
+                       triangle_index):
+    '''
+    Intersect rays and triangles pairwise, for any number of pairs.
+    
+    Uses the Moller-Trumbore intersection algorithm, evaluated for 
+    every pair at once in chunks of RAY_PAIR_CHUNK so memory is bounded. 
+
+    Arguments
+    ---------
+    triangles:      (n, 3, 3) float, vertices of triangles
+    origins:        (m, 3) float, ray origins
+    directions:     (m, 3) float, ray directions
+    ray_index:      (p) int, index of ray for each pair
+    triangle_index: (p) int, index of triangle for each pair
+
+    Returns
+    ---------
+    hit:         (p) bool, whether the ray hits the triangle
+    distance:    (p) float, ray parameter t where the ray hits the triangle 
+                 plane, so the point is origin + direction * t
+                 Only meaningful where hit is True.
+    barycentric: (p, 3) float, barycentric coordinates of the hit on the 
+                 triangle. Only meaningful where hit is True.
+    '''
+    triangles      = np.asanyarray(triangles,  dtype=np.float64)
+    origins        = np.asanyarray(origins,    dtype=np.float64)
+    directions     = np.asanyarray(directions, dtype=np.float64)
+    ray_index      = np.asanyarray(ray_index,      dtype=np.int64)
+    triangle_index = np.asanyarray(triangle_index, dtype=np.int64)
+
+    count       = len(ray_index)
+    hit         = np.zeros(count, dtype=bool)
+    distance    = np.zeros(count)
+    barycentric = np.zeros((count, 3))
+
+    for start in range(0, count, RAY_PAIR_CHUNK):
+        chunk     = slice(start, min(start + RAY_PAIR_CHUNK, count))
+        triangle  = triangles[triangle_index[chunk]]
+        origin    = origins[ray_index[chunk]]
+        direction = directions[ray_index[chunk]]
+
+        vert0 = triangle[:,0,:]
+        edge0 = triangle[:,1,:] - vert0
+        edge1 = triangle[:,2,:] - vert0
+
+        #P is a vector perpendicular to the ray direction and one
+        # triangle edge. 
+        P   = np.cross(direction, edge1)
+        #if determinant is near zero, ray lies in plane of triangle
+        det = _diag_dot(edge0, P)
+        ok  = np.abs(det) >= TOL_ZERO
+
+        # rather than stopping early on failed pairs we evaluate every pair
+        # and mask at the end: the cost is then just floating point work
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_det = 1.0 / det
+            T = origin - vert0
+            u = _diag_dot(T, P) * inv_det
+            Q = np.cross(T, edge0)
+            v = _diag_dot(direction, Q) * inv_det
+            t = _diag_dot(edge1, Q) * inv_det
+
+            ok &= u >= 0.0
+            ok &= u <= 1.0
+            ok &= v >= TOL_ZERO
+            ok &= (u + v) <= (1.0 - TOL_ZERO)
+            ok &= t > TOL_ZERO
+
+        hit[chunk]         = ok
+        distance[chunk]    = t
+        barycentric[chunk] = np.column_stack((1.0 - u - v, u, v))
+    return hit, distance, barycentric
+
+def ray_triangle_first(triangles,
+                       origins,
+                       directions,
+                       ray_index,
+                       triangle_index,
+                       box_distance):
+    '''
+    Find the nearest triangle hit by each ray, from (ray, triangle)
+    candidate pairs and a lower bound on the hit distance of each pair.
+
+    Candidates are visited in order of their lower bound, in passes of
+    growing size. After each pass any candidate whose lower bound is 
+    further than the nearest hit found so far for its ray is discarded, 
+    so for most rays only a few candidates are evaluated. 
+
+    Arguments
+    ---------
+    triangles:      (n, 3, 3) float, vertices of triangles
+    origins:        (m, 3) float, ray origins
+    directions:     (m, 3) float, ray directions
+    ray_index:      (p) int, index of ray for each pair
+    triangle_index: (p) int, index of triangle for each pair
+    box_distance:   (p) float, ray parameter where the ray enters the 
+                    bounding box of the triangle
+
+    Returns
+    ---------
+    index_ray:   (k) int, index of every ray which hit a triangle
+    index_tri:   (k) int, index of the nearest triangle hit by each ray
+    distance:    (k) float, ray parameter t of the hit
+    barycentric: (k, 3) float, barycentric coordinates of the hit
+    '''
+    ray_count      = len(origins)
+    # sort candidates by ray, then by where the ray enters their box
+    order          = np.lexsort((box_distance, ray_index))
+    ray_index      = np.asanyarray(ray_index)[order]
+    triangle_index = np.asanyarray(triangle_index)[order]
+    box_distance   = np.asanyarray(box_distance)[order]
+    # the position of every candidate in the sorted list for its ray
+    rank           = (np.arange(len(ray_index)) - 
+                      np.searchsorted(ray_index, np.arange(ray_count))[ray_index])
+
+    best_distance    = np.tile(np.inf, ray_count)
+    best_triangle    = np.zeros(ray_count, dtype=np.int64) - 1
+    best_barycentric = np.zeros((ray_count, 3))
+
+    remaining = np.arange(len(ray_index))
+    lower     = 0
+    block     = FIRST_HIT_BLOCK
+    while len(remaining) > 0:
+        upper     = lower + block
+        current   = remaining[rank[remaining] < upper]
+        remaining = remaining[rank[remaining] >= upper]
+        current   = current[box_distance[current] <= best_distance[ray_index[current]]]
+
+        hit, distance, barycentric = ray_triangle_pairs(triangles      = triangles,
+                                                        origins        = origins,
+                                                        directions     = directions,
+                                                        ray_index      = ray_index[current],
+                                                        triangle_index = triangle_index[current])
+        current     = current[hit]
+        distance    = distance[hit]
+        barycentric = barycentric[hit]
+        if len(current) > 0:
+            # the nearest hit in this pass for each ray
+            nearest  = np.lexsort((distance, ray_index[current]))
+            rays     = ray_index[current][nearest]
+            nearest  = nearest[np.append(True, rays[1:] != rays[:-1])]
+            rays     = ray_index[current][nearest]
+            closer   = distance[nearest] < best_distance[rays]
+            nearest  = nearest[closer]
+            rays     = rays[closer]
+            best_distance[rays]    = distance[nearest]
+            best_triangle[rays]    = triangle_index[current][nearest]
+            best_barycentric[rays] = barycentric[nearest]
+
+        # candidates whose box starts past the nearest hit can't be closer
+        remaining = remaining[box_distance[remaining] <= best_distance[ray_index[remaining]]]
+        lower     = upper
+        block    *= 2
 
-    if return_any: hits = np.zeros(len(rays), dtype=np.bool)
-    else:          hits = [None] * len(rays)
-  
-    for ray_index, ray in enumerate(rays):
-        if ray_candidates is None:
-            triangle_candidates = triangles
-        else: 
-            triangle_candidates = triangles[ray_candidates[ray_index]]
-        hit = ray_triangles_vectorized(triangle_candidates, *ray)
-        if return_any: hits[ray_index] = hit.sum() > 0
-        else:          hits[ray_index] = np.nonzero(hit)[0]
-    return hits
+    index_ray = np.nonzero(best_triangle >= 0)[0]
+    return (index_ray,
+            best_triangle[index_ray],
+            best_distance[index_ray],
+            best_barycentric[index_ray])
 
 def ray_triangles_loop(triangles, 
                        ray_origin, 
@@ -151,5 +351,5 @@ def _diag_dot(a, b):
     Same as np.diag(np.dot(a, b.T)) but without the monstrous 
     intermediate matrix (and is much faster). 
     '''
-    result = np.array([np.dot(i,j) for i,j in zip(a,b)])
+    result = np.einsum('ij,ij->i', a, b)
     return result
@@ -133,3 +133,70 @@ def mass_properties(triangles, density = 1.0, skip_inertia=False):
     result['inertia'] = inertia.tolist()
     
     return result
+
+def closest_point(triangles, points):
+    '''
+    Return the closest point on each triangle to each point, pairwise.
+
+    Classifies every point by which Voronoi region of its triangle 
+    (vertex, edge or face) it is in, following Ericson's 
+    "Real-Time Collision Detection", for every pair at once.
+
+    triangles: vertices of triangles, (n,3,3)
+    points:    points in space, (n,3)
+    returns:   closest point on each triangle, (n,3)
+    '''
+    triangles = np.asanyarray(triangles, dtype=np.float64)
+    points    = np.asanyarray(points,    dtype=np.float64)
+    a, b, c   = triangles[:,0], triangles[:,1], triangles[:,2]
+
+    def dot(x, y):
+        return np.einsum('ij,ij->i', x, y)
+
+    ab = b - a
+    ac = c - a
+    ap = points - a
+    bp = points - b
+    cp = points - c
+    d1 = dot(ab, ap)
+    d2 = dot(ac, ap)
+    d3 = dot(ab, bp)
+    d4 = dot(ac, bp)
+    d5 = dot(ab, cp)
+    d6 = dot(ac, cp)
+    va = (d3 * d6) - (d5 * d4)
+    vb = (d5 * d2) - (d1 * d6)
+    vc = (d1 * d4) - (d3 * d2)
+
+    closest = np.zeros(points.shape)
+    # which pairs still need their region found, as regions are
+    # checked in order and the first one which matches is used
+    remain  = np.ones(len(points), dtype=bool)
+
+    def assign(mask, values):
+        mask = np.logical_and(mask, remain)
+        closest[mask] = values(mask)
+        remain[mask]  = False
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # vertex regions, then edge regions, then the face
+        assign(np.logical_and(d1 <= 0, d2 <= 0), 
+               lambda m: a[m])
+        assign(np.logical_and(d3 >= 0, d4 <= d3), 
+               lambda m: b[m])
+        assign(np.logical_and(d6 >= 0, d5 <= d6), 
+               lambda m: c[m])
+        assign(np.logical_and.reduce((vc <= 0, d1 >= 0, d3 <= 0)),
+               lambda m: a[m] + (ab[m] * (d1[m] / (d1[m] - d3[m])).reshape((-1,1))))
+        assign(np.logical_and.reduce((vb <= 0, d2 >= 0, d6 <= 0)),
+               lambda m: a[m] + (ac[m] * (d2[m] / (d2[m] - d6[m])).reshape((-1,1))))
+        assign(np.logical_and.reduce((va <= 0, (d4 - d3) >= 0, (d5 - d6) >= 0)),
+               lambda m: b[m] + ((c[m] - b[m]) * 
+                                 ((d4[m] - d3[m]) / 
+                                  ((d4[m] - d3[m]) + (d5[m] - d6[m]))).reshape((-1,1))))
+        denom = va + vb + vc
+        assign(remain,
+               lambda m: (a[m] + 
+                          (ab[m] * (vb[m] / denom[m]).reshape((-1,1))) + 
+                          (ac[m] * (vc[m] / denom[m]).reshape((-1,1)))))
+    return closest